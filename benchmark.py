@@ -0,0 +1,155 @@
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import campaign_stats
+import campaign_store
+import delivery
+import ingest
+import messenger_core
+import suppression
+import transport
+
+# Synthetic campaigns end to end against the fake osascript in fakebin/:
+#
+#   python benchmark.py --sizes 10000 100000 1000000
+#
+# Everything runs in a scratch directory, so no real campaigns, images or
+# Messages are touched. Each run appends one JSON line to --output.
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+DEFAULT_OUTPUT = os.path.join(REPO_DIR, 'benchmark_results.jsonl')
+
+FIRST_NAMES = ["Ana", "Ben", "Carla", "Dev", "Elena", "Frank", "Grace", "Hugo", "Iris", "Jamal"]
+PARTIES = ["DEM", "REP", "NPA", "LIB", ""]
+
+
+def synthetic_csv(rows, seed=0):
+    # Tab-separated UTF-16, as exported by the voter file tools the app is fed
+    rng = random.Random(seed)
+    lines = ["Phone\tName\tAge\tSex\tParty Last Primary\tPrecinct Name\tZip Code"]
+    for i in range(rows):
+        lines.append(f"({200 + i // 10000}) 555-{i % 10000:04d}\t{rng.choice(FIRST_NAMES)} {i}\t"
+                     f"{rng.randint(18, 95)}\t{rng.choice('FM')}\t{rng.choice(PARTIES)}\t"
+                     f"Precinct {rng.randint(1, 250)}\t{rng.randint(32001, 32099)}")
+    return ("\n".join(lines) + "\n").encode('utf-16')
+
+
+def _timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    value = function(*args, **kwargs)
+    return value, time.perf_counter() - start
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_campaigns(sizes, results):
+    for rows in sizes:
+        data = synthetic_csv(rows)
+        df, seconds = _timed(ingest.read_voter_csv, io.BytesIO(data))
+        results.append({"benchmark": "ingest", "rows": rows, "bytes": len(data), "seconds": seconds,
+                        "rows_per_second": rows / seconds})
+
+        (df, _), seconds = _timed(suppression.screen, df)
+        results.append({"benchmark": "screen", "rows": rows, "seconds": seconds})
+
+        name = f"bench-{rows}"
+        _, seconds = _timed(messenger_core.create_campaign, name, df, "Vote in [Precinct Name]!",
+                            "https://example.org/vote")
+        results.append({"benchmark": "save_campaign_data", "rows": len(df), "seconds": seconds,
+                        "campaigns_in_store": len(campaign_store.campaign_index())})
+
+        campaigns, seconds = _timed(messenger_core.load_campaigns)
+        results.append({"benchmark": "load_campaigns", "campaigns_in_store": len(campaigns),
+                        "rows_in_store": sum(len(c['results']) for c in campaigns), "seconds": seconds})
+
+        _, seconds = _timed(campaign_store.campaign_index)
+        results.append({"benchmark": "campaign_index", "campaigns_in_store": len(campaigns), "seconds": seconds})
+
+        _, seconds = _timed(campaign_stats.summary, name)
+        results.append({"benchmark": "stats_summary", "rows": len(df), "seconds": seconds})
+        _, seconds = _timed(campaign_stats.breakdowns, name)
+        results.append({"benchmark": "stats_breakdowns", "rows": len(df), "seconds": seconds})
+        _, seconds = _timed(campaign_stats.breakdowns, name)
+        results.append({"benchmark": "stats_breakdowns_cached", "rows": len(df), "seconds": seconds})
+        _, seconds = _timed(campaign_store.query_recipients, name, {"Status": ["Not Sent"]}, "Name",
+                            offset=len(df) // 2)
+        results.append({"benchmark": "recipient_page", "rows": len(df), "seconds": seconds})
+        print(f"{rows} rows done", file=sys.stderr, flush=True)
+
+
+def bench_send(sends, results):
+    # The blocking flow sleeps DELIVERY_CHECK_DELAY per message to let
+    # Messages deliver; the fake delivers instantly, so measure without it
+    transport.DELIVERY_CHECK_DELAY = 0
+    for name, transport_class in transport.TRANSPORTS.items():
+        transport._transport = transport_class()
+        start = time.perf_counter()
+        for i in range(sends):
+            messenger_core.send_imessage(f"555{i:07d}", f"Voter {i}", "Benchmark message ", "https://example.org")
+        seconds = time.perf_counter() - start
+        transport._transport.close()
+        results.append({"benchmark": "send_imessage", "transport": name, "messages": sends, "seconds": seconds,
+                        "messages_per_second": sends / seconds})
+
+    # Queue path: enqueue, worker, delivery verifier, unthrottled and at any hour
+    delivery.INITIAL_CHECK_DELAY = 0.05
+    delivery.POLL_INTERVAL = 0.05
+    transport._transport = transport.PersistentOsascriptTransport()
+    campaign_store.save_campaign({
+        'name': "bench-send", 'date': datetime.now().isoformat(), 'message_text': "Benchmark",
+        'base_url': "https://example.org", 'image_hash': None,
+        'results': [{"Phone": f"+1555{i:07d}", "Name": f"Voter {i}", "result": "Not Sent"} for i in range(sends)],
+    })
+    _, seconds = _timed(messenger_core.run_campaign, "bench-send", 60 * 10_000, concurrency=2, poll_interval=0.05,
+                        quiet_hours=None)
+    transport._transport.close()
+    results.append({"benchmark": "run_campaign", "transport": "persistent", "messages": sends, "seconds": seconds,
+                    "messages_per_second": sends / seconds})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark ingestion, storage, statistics and sending")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="campaign sizes in rows")
+    parser.add_argument("--sends", type=int, default=500, help="messages for the send benchmarks (0 to skip)")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="JSON lines file to append this run to")
+    args = parser.parse_args(argv)
+
+    os.environ['PATH'] = os.path.join(REPO_DIR, 'fakebin') + os.pathsep + os.environ.get('PATH', '')
+    output = os.path.abspath(args.output)
+    results = []
+    with tempfile.TemporaryDirectory(prefix="messenger-bench-") as scratch:
+        os.chdir(scratch)
+        bench_campaigns(args.sizes, results)
+        if args.sends:
+            bench_send(args.sends, results)
+
+    run = {
+        "timestamp": datetime.now().isoformat(),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    with open(output, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(run) + "\n")
+    for result in results:
+        print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
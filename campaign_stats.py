@@ -0,0 +1,55 @@
+import functools
+
+import pandas as pd
+
+import campaign_store
+
+AGE_BANDS = [0, 25, 35, 45, 55, 65, float('inf')]
+AGE_BAND_LABELS = ["Under 25", "25-34", "35-44", "45-54", "55-64", "65+"]
+SEGMENTS = ["Precinct Name", "Party Last Primary", "Zip Code", "Age Band", "Sex"]
+OUTCOMES = {"sent": "Sent", "imessage": "iMessage", "sms": "SMS Fallback", "failed": "Failed",
+            "clicked": "Clicked", "replied": "Replied"}
+
+
+def summary(campaign_name, db_path=None):
+    counters = campaign_store.campaign_counters(campaign_name, db_path)
+    if counters is None:
+        return None
+    return {
+        "Recipients": counters['row_count'],
+        "Sent": counters['imessage_count'] + counters['sms_count'],
+        "iMessage": counters['imessage_count'],
+        "SMS Fallback": counters['sms_count'],
+        "Failed": counters['failed_count'],
+        "Clicked": counters['clicked_count'],
+        "Total Clicks": counters['click_count'],
+        "Replied": counters['replied_count'],
+    }
+
+
+def breakdowns(campaign_name, db_path=None):
+    # {segment: DataFrame}, recomputed only when the campaign's version moves
+    db_path = db_path or campaign_store.DB_PATH
+    version = campaign_store.campaign_version(campaign_name, db_path)
+    if version is None:
+        return {}
+    return _breakdowns(db_path, campaign_name, version)
+
+
+@functools.lru_cache(maxsize=16)
+def _breakdowns(db_path, campaign_name, version):
+    cells = campaign_store.segment_counts(campaign_name, db_path)
+    cells["Age Band"] = pd.cut(pd.to_numeric(cells["Age"], errors='coerce'), AGE_BANDS,
+                               labels=AGE_BAND_LABELS, right=False)
+    counts = cells[["recipients"] + list(OUTCOMES)]
+    tables = {}
+    for segment in SEGMENTS:
+        keys = cells[segment].astype(object).where(cells[segment].notna(), "(blank)").astype(str)
+        if segment == "Age Band":
+            keys = pd.Categorical(keys, categories=AGE_BAND_LABELS + ["(blank)"], ordered=True)
+        table = counts.groupby(keys, observed=True).sum().rename(columns={"recipients": "Recipients", **OUTCOMES})
+        click_rate = 100 * table["Clicked"] / table["Sent"].where(table["Sent"] > 0)
+        table["Click Rate (%)"] = click_rate.fillna(0.0).round(1)
+        table.index.name = segment
+        tables[segment] = table.reset_index()
+    return tables
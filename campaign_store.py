@@ -0,0 +1,840 @@
+import sqlite3
+import base64
+import json
+import os
+import queue
+import threading
+from contextlib import contextmanager
+
+import pandas as pd
+
+import image_store
+import phones
+import recipient_table
+
+DB_PATH = 'campaigns.db'
+LEGACY_JSON_PATH = 'campaigns.json'
+
+# (key used in the campaign's results dicts, column in the recipients table)
+RECIPIENT_FIELDS = [
+    ("Phone", "phone"),
+    ("Name", "name"),
+    ("Age", "age"),
+    ("Sex", "sex"),
+    ("Party Last Primary", "party"),
+    ("Precinct Name", "precinct"),
+    ("Zip Code", "zip"),
+    ("result", "result"),
+    ("tracking_id", "tracking_id"),
+]
+RECIPIENT_COLUMNS = [column for _, column in RECIPIENT_FIELDS]
+RECIPIENT_KEYS = {key for key, _ in RECIPIENT_FIELDS}
+
+# Send status and delivering service derived from a recipient's result text
+RESULT_STATUSES = ["Not Sent", "Pending", "Sent", "Failed", "Skipped"]
+
+
+def _status_sql(result):
+    return f"""CASE
+    WHEN {result} IS NULL OR {result} = 'Not Sent' THEN 'Not Sent'
+    WHEN {result} = 'Skipped' THEN 'Skipped'
+    WHEN {result} LIKE 'Awaiting%' THEN 'Pending'
+    WHEN {result} LIKE 'Failed%' OR {result} LIKE 'Unexpected error%' OR {result} LIKE 'Error%' THEN 'Failed'
+    ELSE 'Sent' END"""
+
+
+def _service_sql(result):
+    return f"""CASE WHEN ({_status_sql(result)}) != 'Sent' THEN NULL
+    WHEN {result} LIKE '%via iMessage%' THEN 'iMessage'
+    WHEN {result} LIKE 'SMS sent%' OR {result} LIKE '%via SMS%' THEN 'SMS' END"""
+
+
+STATUS_SQL = _status_sql("result")
+SERVICE_SQL = _service_sql("result")
+# Columns the recipient grid can filter and sort on
+FILTER_COLUMNS = {"Precinct Name": "precinct", "Party Last Primary": "party", "Zip Code": "zip"}
+SORT_COLUMNS = {"Row": "idx", "Name": "name", "Precinct Name": "precinct", "Zip Code": "zip", "Status": "status",
+                "Clicks": "clicks"}
+
+# Recipient value columns are left untyped so ints/floats/strings round-trip
+# the same way they did through campaigns.json
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS campaigns (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    date TEXT NOT NULL,
+    message_text TEXT,
+    image_data TEXT,
+    base_url TEXT,
+    tracking_info TEXT,
+    image_hash TEXT,
+    version INTEGER NOT NULL DEFAULT 0,
+    row_count INTEGER,
+    sent_count INTEGER
+);
+CREATE TABLE IF NOT EXISTS recipients (
+    campaign_id INTEGER NOT NULL REFERENCES campaigns(id) ON DELETE CASCADE,
+    idx INTEGER NOT NULL,
+    phone, name, age, sex, party, precinct, zip,
+    result TEXT,
+    tracking_id TEXT,
+    extra TEXT,
+    PRIMARY KEY (campaign_id, idx)
+);
+CREATE INDEX IF NOT EXISTS recipients_phone ON recipients(phone);
+CREATE INDEX IF NOT EXISTS recipients_tracking ON recipients(tracking_id);
+CREATE INDEX IF NOT EXISTS recipients_precinct ON recipients(campaign_id, precinct);
+CREATE INDEX IF NOT EXISTS recipients_party ON recipients(campaign_id, party);
+CREATE INDEX IF NOT EXISTS recipients_zip ON recipients(campaign_id, zip);
+CREATE TABLE IF NOT EXISTS send_queue (
+    id INTEGER PRIMARY KEY,
+    campaign_name TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    enqueued_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    service TEXT,
+    sent_at REAL,
+    next_check_at REAL,
+    checks INTEGER NOT NULL DEFAULT 0,
+    payload TEXT,
+    tracking_id TEXT,
+    UNIQUE (campaign_name, idx)
+);
+CREATE INDEX IF NOT EXISTS send_queue_status ON send_queue(status, id);
+CREATE TABLE IF NOT EXISTS store_meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO store_meta (key, value) VALUES ('version', 0);
+INSERT OR IGNORE INTO store_meta (key, value) VALUES ('queue_seq', 0);
+CREATE TABLE IF NOT EXISTS replies (
+    campaign_id INTEGER NOT NULL,
+    idx INTEGER NOT NULL,
+    message_rowid INTEGER NOT NULL,
+    text TEXT,
+    received_at TEXT,
+    PRIMARY KEY (campaign_id, idx, message_rowid),
+    FOREIGN KEY (campaign_id, idx) REFERENCES recipients(campaign_id, idx) ON DELETE CASCADE
+);
+INSERT OR IGNORE INTO store_meta (key, value) VALUES ('reply_rowid', 0);
+CREATE TABLE IF NOT EXISTS suppressed (
+    handle TEXT PRIMARY KEY,
+    reason TEXT,
+    added_at TEXT
+) WITHOUT ROWID;
+INSERT OR IGNORE INTO store_meta (key, value) VALUES ('suppression_version', 0);
+CREATE TABLE IF NOT EXISTS send_journal (
+    idempotency_key TEXT PRIMARY KEY,
+    campaign_name TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    attempt INTEGER NOT NULL,
+    service TEXT NOT NULL,
+    intent_at REAL NOT NULL,
+    outcome_at REAL,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS send_journal_campaign ON send_journal(campaign_name);
+CREATE TABLE IF NOT EXISTS senders (
+    sender_id TEXT PRIMARY KEY,
+    host TEXT,
+    registered_at REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    sent INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS capabilities (
+    handle TEXT PRIMARY KEY,
+    service TEXT NOT NULL,
+    observed_at REAL NOT NULL
+) WITHOUT ROWID;
+'''
+
+# Every write bumps a version, per campaign and store-wide, so cached reads
+# (see catalog.py and campaign_stats.py) can tell they are stale without
+# re-reading any data.
+# Each time a send_queue item goes back to queued it takes the next
+# queued_seq (enqueue numbers new items itself), so the scheduler (see
+# scheduler.py) only reads what was queued since it last looked. The numbers
+# come from a counter in store_meta that never goes back, so unlike ids they
+# aren't reused once a campaign's items are deleted.
+# Created after ADDED_COLUMNS so older databases have the columns first.
+TRIGGERS = f'''
+CREATE TRIGGER IF NOT EXISTS recipients_result_version AFTER UPDATE OF result, tracking_id ON recipients
+BEGIN
+    UPDATE campaigns SET version = version + 1,
+        sent_count = sent_count + (NEW.result IS NOT 'Not Sent') - (OLD.result IS NOT 'Not Sent')
+    WHERE id = NEW.campaign_id;
+END;
+CREATE TRIGGER IF NOT EXISTS recipients_result_stats AFTER UPDATE OF result ON recipients
+WHEN OLD.result IS NOT NEW.result
+BEGIN
+    UPDATE campaigns SET
+        imessage_count = imessage_count + (({_service_sql("NEW.result")}) IS 'iMessage')
+            - (({_service_sql("OLD.result")}) IS 'iMessage'),
+        sms_count = sms_count + (({_service_sql("NEW.result")}) IS 'SMS') - (({_service_sql("OLD.result")}) IS 'SMS'),
+        failed_count = failed_count + (({_status_sql("NEW.result")}) = 'Failed')
+            - (({_status_sql("OLD.result")}) = 'Failed')
+    WHERE id = NEW.campaign_id;
+END;
+CREATE TRIGGER IF NOT EXISTS recipients_reply_stats AFTER UPDATE OF reply ON recipients
+BEGIN
+    UPDATE campaigns SET version = version + 1,
+        replied_count = replied_count + (NEW.reply IS NOT NULL) - (OLD.reply IS NOT NULL)
+    WHERE id = NEW.campaign_id;
+END;
+CREATE TRIGGER IF NOT EXISTS suppressed_insert_version AFTER INSERT ON suppressed
+BEGIN
+    UPDATE store_meta SET value = value + 1 WHERE key = 'suppression_version';
+END;
+CREATE TRIGGER IF NOT EXISTS suppressed_delete_version AFTER DELETE ON suppressed
+BEGIN
+    UPDATE store_meta SET value = value + 1 WHERE key = 'suppression_version';
+END;
+CREATE TRIGGER IF NOT EXISTS campaigns_insert_version AFTER INSERT ON campaigns
+BEGIN
+    UPDATE store_meta SET value = value + 1 WHERE key = 'version';
+END;
+CREATE TRIGGER IF NOT EXISTS campaigns_update_version AFTER UPDATE ON campaigns
+BEGIN
+    UPDATE store_meta SET value = value + 1 WHERE key = 'version';
+END;
+CREATE TRIGGER IF NOT EXISTS campaigns_delete_version AFTER DELETE ON campaigns
+BEGIN
+    UPDATE store_meta SET value = value + 1 WHERE key = 'version';
+END;
+CREATE TRIGGER IF NOT EXISTS send_queue_requeue_counter AFTER UPDATE OF status ON send_queue
+WHEN NEW.status = 'queued' AND OLD.status IS NOT 'queued'
+BEGIN
+    UPDATE store_meta SET value = value + 1 WHERE key = 'queue_seq';
+    UPDATE send_queue SET queued_seq = (SELECT value FROM store_meta WHERE key = 'queue_seq') WHERE id = NEW.id;
+END;
+DROP TRIGGER IF EXISTS send_queue_requeue_seq;
+'''
+
+# Indexes on columns from ADDED_COLUMNS, created once the columns exist
+ADDED_INDEXES = '''
+CREATE INDEX IF NOT EXISTS recipients_handle ON recipients(handle);
+CREATE INDEX IF NOT EXISTS send_queue_queued_seq ON send_queue(queued_seq);
+'''
+
+# Columns added after a table was first shipped, so older databases are
+# brought up to date when they are opened
+ADDED_COLUMNS = [
+    ("send_queue", "service", "TEXT"),
+    ("send_queue", "sent_at", "REAL"),
+    ("send_queue", "next_check_at", "REAL"),
+    ("send_queue", "checks", "INTEGER NOT NULL DEFAULT 0"),
+    ("recipients", "extra", "TEXT"),
+    ("send_queue", "payload", "TEXT"),
+    ("send_queue", "tracking_id", "TEXT"),
+    ("campaigns", "image_hash", "TEXT"),
+    ("campaigns", "version", "INTEGER NOT NULL DEFAULT 0"),
+    ("campaigns", "row_count", "INTEGER"),
+    ("campaigns", "sent_count", "INTEGER"),
+    ("recipients", "clicks", "INTEGER NOT NULL DEFAULT 0"),
+    ("campaigns", "click_count", "INTEGER NOT NULL DEFAULT 0"),
+    ("campaigns", "clicked_count", "INTEGER NOT NULL DEFAULT 0"),
+    ("recipients", "reply", "TEXT"),
+    ("campaigns", "imessage_count", "INTEGER"),
+    ("campaigns", "sms_count", "INTEGER"),
+    ("campaigns", "failed_count", "INTEGER"),
+    ("campaigns", "replied_count", "INTEGER"),
+    ("recipients", "handle", "TEXT"),
+    ("send_queue", "attempt", "INTEGER NOT NULL DEFAULT 0"),
+    ("send_queue", "lease_owner", "TEXT"),
+    ("send_queue", "lease_expires", "REAL"),
+    ("send_queue", "priority", "INTEGER NOT NULL DEFAULT 10"),
+    ("send_queue", "queued_seq", "INTEGER"),
+]
+
+_init_lock = threading.Lock()
+_initialized = set()
+
+# Campaign writes from every session and worker go through one writer
+# thread per database, which commits everything queued since its last
+# commit as a single transaction. Callers block until theirs is committed.
+WRITE_BATCH_LIMIT = 1000
+
+_writers_lock = threading.Lock()
+_writers = {}
+
+
+class CampaignExistsError(Exception):
+    pass
+
+
+def _open(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA foreign_keys = ON")
+    try:
+        with _init_lock:
+            if db_path not in _initialized:
+                # WAL lets readers keep a consistent snapshot while the writer commits
+                conn.execute("PRAGMA journal_mode = WAL")
+                conn.executescript(SCHEMA)
+                _add_missing_columns(conn)
+                conn.executescript(ADDED_INDEXES)
+                _backfill_counts(conn)
+                _backfill_handles(conn)
+                _backfill_queued_seq(conn)
+                conn.executescript(TRIGGERS)
+                _migrate_inline_images(conn)
+                _migrate_json(conn, LEGACY_JSON_PATH)
+                _initialized.add(db_path)
+    except BaseException:
+        conn.close()
+        raise
+    return conn
+
+
+@contextmanager
+def connect(db_path=None):
+    conn = _open(db_path or DB_PATH)
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+@contextmanager
+def snapshot(db_path=None):
+    # Read-only connection whose queries all see the store as of one moment
+    conn = _open(db_path or DB_PATH)
+    try:
+        conn.execute("BEGIN")
+        yield conn
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+class _Write:
+    def __init__(self, function, args):
+        self.function = function
+        self.args = args
+        self.value = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class StoreWriter(threading.Thread):
+    def __init__(self, db_path):
+        super().__init__(name="store-writer", daemon=True)
+        self.db_path = db_path
+        self._pending = queue.SimpleQueue()
+        self._failed = None
+
+    def write(self, function, *args):
+        # Runs function(conn, *args) in the writer's next commit and returns its value
+        write = _Write(function, args)
+        self._pending.put(write)
+        if self._failed is not None:
+            # The writer is gone; nothing else will take this off the queue
+            self._fail_pending()
+        write.done.wait()
+        if write.error is not None:
+            raise write.error
+        return write.value
+
+    def _fail_pending(self):
+        while True:
+            try:
+                write = self._pending.get_nowait()
+            except queue.Empty:
+                return
+            write.error = self._failed
+            write.done.set()
+
+    def run(self):
+        try:
+            conn = _open(self.db_path)
+        except Exception as e:
+            # Fail what is queued and let the next write start a new writer
+            with _writers_lock:
+                if _writers.get(self.db_path) is self:
+                    del _writers[self.db_path]
+            self._failed = e
+            self._fail_pending()
+            return
+        while True:
+            batch = [self._pending.get()]
+            while len(batch) < WRITE_BATCH_LIMIT:
+                try:
+                    batch.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._commit(conn, batch)
+            except Exception:
+                # One failing write must not take the rest of the group with it
+                for write in batch:
+                    try:
+                        self._commit(conn, [write])
+                    except Exception as e:
+                        write.error = e
+            for write in batch:
+                write.done.set()
+
+    def _commit(self, conn, batch):
+        with conn:
+            values = [write.function(conn, *write.args) for write in batch]
+        for write, value in zip(batch, values):
+            write.value = value
+
+
+def _write(db_path, function, *args):
+    db_path = db_path or DB_PATH
+    with _writers_lock:
+        writer = _writers.get(db_path)
+        if writer is None:
+            writer = _writers[db_path] = StoreWriter(db_path)
+            writer.start()
+    return writer.write(function, *args)
+
+
+def write(function, *args, db_path=None):
+    # For the send queue, journal and capability cache: function(conn, *args)
+    # commits with the campaign writes, so everything one send changes lands
+    # in one transaction. function must not call write() itself.
+    return _write(db_path, function, *args)
+
+
+def _add_missing_columns(conn):
+    for table, column, declaration in ADDED_COLUMNS:
+        existing = [row['name'] for row in conn.execute(f"PRAGMA table_info({table})")]
+        if column not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+    conn.commit()
+
+
+def _backfill_counts(conn):
+    conn.execute(
+        "UPDATE campaigns SET "
+        "row_count = (SELECT COUNT(*) FROM recipients WHERE campaign_id = campaigns.id), "
+        "sent_count = (SELECT COUNT(*) FROM recipients WHERE campaign_id = campaigns.id "
+        "AND result IS NOT 'Not Sent') "
+        "WHERE row_count IS NULL"
+    )
+    _count_results(conn, "imessage_count IS NULL")
+    conn.commit()
+
+
+def _backfill_handles(conn):
+    # The E.164 phone that replies in chat.db are matched against
+    conn.create_function("to_e164", 1, phones.to_e164)
+    conn.execute("UPDATE recipients SET handle = to_e164(phone) WHERE handle IS NULL AND phone IS NOT NULL")
+    conn.commit()
+
+
+def _backfill_queued_seq(conn):
+    # Items queued before queued_seq existed, in the order they would have been sent
+    conn.execute("UPDATE send_queue SET queued_seq = id WHERE queued_seq IS NULL AND status = 'queued'")
+    # Numbered by MAX(queued_seq) + 1 before the counter existed
+    conn.execute("UPDATE store_meta SET value = MAX(value, (SELECT COALESCE(MAX(queued_seq), 0) FROM send_queue)) "
+                 "WHERE key = 'queue_seq'")
+    conn.commit()
+
+
+def _count_results(conn, where):
+    # Result counters from scratch; the triggers keep them current after this
+    conn.execute(
+        "UPDATE campaigns SET (imessage_count, sms_count, failed_count, replied_count) = ("
+        f"SELECT COALESCE(SUM(({SERVICE_SQL}) IS 'iMessage'), 0), COALESCE(SUM(({SERVICE_SQL}) IS 'SMS'), 0), "
+        f"COALESCE(SUM(({STATUS_SQL}) = 'Failed'), 0), COUNT(reply) "
+        f"FROM recipients WHERE campaign_id = campaigns.id) WHERE {where}"
+    )
+
+
+def _migrate_inline_images(conn):
+    # Campaigns used to carry their image base64-encoded in image_data
+    rows = conn.execute("SELECT id, image_data FROM campaigns WHERE image_data IS NOT NULL").fetchall()
+    for row in rows:
+        image_hash = image_store.store_image(base64.b64decode(row['image_data']))
+        conn.execute("UPDATE campaigns SET image_hash = ?, image_data = NULL WHERE id = ?", (image_hash, row['id']))
+    conn.commit()
+
+
+def _insert_campaign(conn, campaign_data, replace=False):
+    # Only the JSON migration replaces a campaign by name: anywhere else that
+    # would throw away its results, replies and the send journal with them
+    if replace:
+        conn.execute("DELETE FROM campaigns WHERE name = ?", (campaign_data['name'],))
+        conn.execute("DELETE FROM send_queue WHERE campaign_name = ?", (campaign_data['name'],))
+        conn.execute("DELETE FROM send_journal WHERE campaign_name = ?", (campaign_data['name'],))
+    elif conn.execute("SELECT 1 FROM campaigns WHERE name = ?", (campaign_data['name'],)).fetchone():
+        raise CampaignExistsError(f"A campaign named '{campaign_data['name']}' already exists. "
+                                  "Choose another name, or delete the existing campaign first.")
+    image_hash = campaign_data.get('image_hash')
+    if not image_hash and campaign_data.get('image_data'):
+        image_hash = image_store.store_image(base64.b64decode(campaign_data['image_data']))
+    results = campaign_data.get('results')
+    if not isinstance(results, recipient_table.RecipientTable):
+        results = recipient_table.RecipientTable.from_records(results or [])
+    # Seeding version from the store version keeps it from repeating when
+    # a campaign is deleted and re-created under the same name
+    cursor = conn.execute(
+        "INSERT INTO campaigns (name, date, message_text, image_hash, base_url, tracking_info, row_count, sent_count, "
+        "version) VALUES (?, ?, ?, ?, ?, ?, ?, ?, (SELECT value FROM store_meta WHERE key = 'version'))",
+        (campaign_data['name'], campaign_data['date'], campaign_data.get('message_text'),
+         image_hash, campaign_data.get('base_url'),
+         json.dumps(campaign_data.get('tracking_info') or {}),
+         len(results), int((results.frame['result'] != 'Not Sent').sum()))
+    )
+    campaign_id = cursor.lastrowid
+    # Column by column, so no per-recipient dict is ever built
+    columns = [results.column(key) if key in results.frame else [None] * len(results)
+               for key, _ in RECIPIENT_FIELDS]
+    extra_keys = [key for key in results.columns if key not in RECIPIENT_KEYS]
+    if extra_keys:
+        extras = [json.dumps(dict(zip(extra_keys, values)))
+                  for values in zip(*(results.column(key) for key in extra_keys))]
+    else:
+        extras = [None] * len(results)
+    phone_index = [key for key, _ in RECIPIENT_FIELDS].index("Phone")
+    placeholders = ", ".join("?" for _ in range(len(RECIPIENT_COLUMNS) + 4))
+    conn.executemany(
+        f"INSERT INTO recipients (campaign_id, idx, {', '.join(RECIPIENT_COLUMNS)}, extra, handle) "
+        f"VALUES ({placeholders})",
+        ((campaign_id, idx, *values, extra, phones.to_e164(values[phone_index]))
+         for idx, (values, extra) in enumerate(zip(zip(*columns), extras)))
+    )
+    _count_results(conn, f"id = {campaign_id}")
+    return campaign_id
+
+
+def _recipient_dict(recipient):
+    result = {key: recipient[column] for key, column in RECIPIENT_FIELDS}
+    if recipient['extra']:
+        result.update(json.loads(recipient['extra']))
+    return result
+
+
+def _migrate_json(conn, json_path):
+    # One-time import of the old campaigns.json. Every send used to append a
+    # full copy of the campaign, so the last copy of each name is the newest.
+    if not os.path.exists(json_path):
+        return
+    with open(json_path, 'r') as f:
+        campaigns = json.load(f)
+    latest = {}
+    for campaign_data in campaigns:
+        latest[campaign_data['name']] = campaign_data
+    with conn:
+        for campaign_data in latest.values():
+            _insert_campaign(conn, campaign_data, replace=True)
+    os.replace(json_path, json_path + '.migrated')
+    print(f"Migrated {len(latest)} campaigns from {json_path} to the campaign store")
+
+
+def _row_to_campaign(conn, row, with_results=True):
+    campaign_data = {
+        'name': row['name'],
+        'date': row['date'],
+        'results': [],
+        'tracking_info': json.loads(row['tracking_info'] or '{}'),
+        'message_text': row['message_text'],
+        'image_hash': row['image_hash'],
+        'version': row['version'],
+        'base_url': row['base_url'],
+    }
+    if with_results:
+        frame = _read_recipients(conn, "campaign_id = ?", (row['id'],))
+        # Every issued link, clicked or not, as the click tracker recorded it
+        issued = frame[frame['tracking_id'].notna()]
+        for tracking_id, name, phone, clicks in zip(issued['tracking_id'], issued['Name'], issued['Phone'],
+                                                    issued['clicks']):
+            campaign_data['tracking_info'][tracking_id] = {'Name': name, 'Phone': phone, 'clicked': clicks > 0}
+        campaign_data['results'] = recipient_table.RecipientTable(frame.drop(columns=['clicks']))
+    return campaign_data
+
+
+def _read_recipients(conn, where, params):
+    # Recipients straight into columns, indexed by idx, with extra CSV
+    # columns expanded back out of their JSON
+    # Plain tuples: building a sqlite3.Row per recipient costs more than the query
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    rows = cursor.execute(
+        f"SELECT idx, {', '.join(RECIPIENT_COLUMNS)}, extra, clicks FROM recipients WHERE {where} ORDER BY idx",
+        params
+    ).fetchall()
+    columns = ['idx'] + [key for key, _ in RECIPIENT_FIELDS] + ['extra', 'clicks']
+    frame = pd.DataFrame.from_records(rows, columns=columns, index='idx')
+    extra = frame.pop('extra')
+    if extra.notna().any():
+        expanded = pd.DataFrame.from_records([json.loads(value) if value else {} for value in extra],
+                                             index=frame.index)
+        frame = pd.concat([frame, expanded[[key for key in expanded.columns if key not in frame]]], axis=1)
+    return frame
+
+
+def load_recipients(campaign_name, indices=None, db_path=None):
+    # A RecipientTable of the campaign's recipients, or of just `indices`,
+    # indexed by idx
+    with snapshot(db_path) as conn:
+        row = conn.execute("SELECT id FROM campaigns WHERE name = ?", (campaign_name,)).fetchone()
+        if row is None:
+            return None
+        if indices is None:
+            frame = _read_recipients(conn, "campaign_id = ?", (row['id'],))
+        else:
+            indices = sorted(set(indices))
+            chunks = [indices[start:start + 500] for start in range(0, len(indices), 500)] or [[]]
+            frame = pd.concat([_read_recipients(conn, f"campaign_id = ? AND idx IN ({', '.join('?' for _ in chunk)})",
+                                                (row['id'], *chunk))
+                               for chunk in chunks])
+    return recipient_table.RecipientTable(frame.drop(columns=['clicks']))
+
+
+def save_campaign(campaign_data, db_path=None):
+    _write(db_path, _insert_campaign, campaign_data)
+
+
+def store_version(db_path=None):
+    with connect(db_path) as conn:
+        return conn.execute("SELECT value FROM store_meta WHERE key = 'version'").fetchone()['value']
+
+
+def campaign_index(db_path=None):
+    # Campaign metadata without recipients, for pickers and listings
+    with connect(db_path) as conn:
+        rows = conn.execute(
+            "SELECT name, date, row_count, sent_count, version FROM campaigns ORDER BY id"
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+
+def campaign_counters(campaign_name, db_path=None):
+    # Running totals kept by the triggers, so reading them costs one row
+    with connect(db_path) as conn:
+        row = conn.execute(
+            "SELECT row_count, sent_count, imessage_count, sms_count, failed_count, click_count, clicked_count, "
+            "replied_count, version FROM campaigns WHERE name = ?",
+            (campaign_name,)
+        ).fetchone()
+        return dict(row) if row else None
+
+
+def segment_counts(campaign_name, db_path=None):
+    # Recipients and outcomes per distinct (precinct, party, zip, age, sex)
+    # cell. Far fewer cells than recipients, so segment breakdowns can be
+    # grouped from these without reading every row out of SQLite.
+    with connect(db_path) as conn:
+        return pd.read_sql_query(
+            'SELECT precinct AS "Precinct Name", party AS "Party Last Primary", zip AS "Zip Code", '
+            'age AS "Age", sex AS "Sex", COUNT(*) AS recipients, SUM(status = \'Sent\') AS sent, '
+            "SUM(status = 'Sent' AND result LIKE '%via iMessage%') AS imessage, "
+            "SUM(status = 'Sent' AND (result LIKE 'SMS sent%' OR result LIKE '%via SMS%')) AS sms, "
+            "SUM(status = 'Failed') AS failed, SUM(clicks > 0) AS clicked, COUNT(reply) AS replied "
+            f"FROM (SELECT *, {STATUS_SQL} AS status FROM recipients "
+            "WHERE campaign_id = (SELECT id FROM campaigns WHERE name = ?)) "
+            "GROUP BY precinct, party, zip, age, sex",
+            conn, params=(campaign_name,)
+        )
+
+
+def campaign_version(campaign_name, db_path=None):
+    with connect(db_path) as conn:
+        row = conn.execute("SELECT version FROM campaigns WHERE name = ?", (campaign_name,)).fetchone()
+        return row['version'] if row else None
+
+
+def load_campaigns(db_path=None):
+    with snapshot(db_path) as conn:
+        rows = conn.execute("SELECT * FROM campaigns ORDER BY id").fetchall()
+        return [_row_to_campaign(conn, row) for row in rows]
+
+
+def load_campaign(campaign_name, with_results=True, db_path=None):
+    with snapshot(db_path) as conn:
+        row = conn.execute("SELECT * FROM campaigns WHERE name = ?", (campaign_name,)).fetchone()
+        if row is None:
+            return None
+        return _row_to_campaign(conn, row, with_results)
+
+
+def load_recipient(campaign_name, idx, db_path=None):
+    with connect(db_path) as conn:
+        recipient = conn.execute(
+            f"SELECT {', '.join(RECIPIENT_COLUMNS)}, extra FROM recipients "
+            "WHERE campaign_id = (SELECT id FROM campaigns WHERE name = ?) AND idx = ?",
+            (campaign_name, idx)
+        ).fetchone()
+        if recipient is None:
+            return None
+        return _recipient_dict(recipient)
+
+
+def _delete_campaign(conn, campaign_name):
+    conn.execute("DELETE FROM campaigns WHERE name = ?", (campaign_name,))
+    conn.execute("DELETE FROM send_queue WHERE campaign_name = ?", (campaign_name,))
+    conn.execute("DELETE FROM send_journal WHERE campaign_name = ?", (campaign_name,))
+
+
+def delete_campaign(campaign_name, db_path=None):
+    _write(db_path, _delete_campaign, campaign_name)
+
+
+def set_recipient_result(conn, campaign_name, idx, result, tracking_id=None):
+    cursor = conn.execute(
+        "UPDATE recipients SET result = ?, tracking_id = COALESCE(?, tracking_id) "
+        "WHERE campaign_id = (SELECT id FROM campaigns WHERE name = ?) AND idx = ?",
+        (result, tracking_id, campaign_name, idx)
+    )
+    return cursor.rowcount == 1
+
+
+def update_recipient_result(campaign_name, idx, result, tracking_id=None, db_path=None):
+    return _write(db_path, set_recipient_result, campaign_name, idx, result, tracking_id)
+
+
+def _update_results(conn, updates):
+    conn.executemany(
+        "UPDATE recipients SET result = ? "
+        "WHERE campaign_id = (SELECT id FROM campaigns WHERE name = ?) AND idx = ?",
+        ((result, campaign_name, idx) for campaign_name, idx, result in updates)
+    )
+
+
+def update_recipient_results(updates, db_path=None):
+    # updates: iterable of (campaign_name, idx, result), written in one transaction
+    _write(db_path, _update_results, list(updates))
+
+
+def _record_clicks(conn, click_counts):
+    ids = list(click_counts)
+    rows = []
+    for start in range(0, len(ids), 500):
+        chunk = ids[start:start + 500]
+        rows.extend(conn.execute(
+            "SELECT r.campaign_id, r.idx, r.tracking_id, r.clicks, c.name FROM recipients r "
+            "JOIN campaigns c ON c.id = r.campaign_id "
+            f"WHERE r.tracking_id IN ({', '.join('?' for _ in chunk)})",
+            chunk
+        ).fetchall())
+    conn.executemany(
+        "UPDATE recipients SET clicks = clicks + ? WHERE campaign_id = ? AND idx = ?",
+        ((click_counts[row['tracking_id']], row['campaign_id'], row['idx']) for row in rows)
+    )
+    totals = {}
+    for row in rows:
+        clicks, first_clicks, name = totals.get(row['campaign_id'], (0, 0, row['name']))
+        totals[row['campaign_id']] = (clicks + click_counts[row['tracking_id']],
+                                      first_clicks + (row['clicks'] == 0), name)
+    conn.executemany(
+        "UPDATE campaigns SET click_count = click_count + ?, clicked_count = clicked_count + ?, "
+        "version = version + 1 WHERE id = ?",
+        ((clicks, first_clicks, campaign_id) for campaign_id, (clicks, first_clicks, _) in totals.items())
+    )
+    return {name: clicks for clicks, _, name in totals.values()}
+
+
+def record_clicks(click_counts, db_path=None):
+    # click_counts: {tracking_id: clicks}. Applied as one transaction that
+    # also moves the campaign's click counters and version.
+    # Returns {campaign_name: clicks} for the ids that were issued.
+    if not click_counts:
+        return {}
+    return _write(db_path, _record_clicks, click_counts)
+
+
+def reply_watermark(db_path=None):
+    with connect(db_path) as conn:
+        return conn.execute("SELECT value FROM store_meta WHERE key = 'reply_rowid'").fetchone()['value']
+
+
+def _record_replies(conn, messages, watermark):
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS incoming "
+                 "(message_rowid INTEGER PRIMARY KEY, handle TEXT, text TEXT, received_at TEXT)")
+    conn.execute("DELETE FROM incoming")
+    conn.executemany("INSERT OR IGNORE INTO incoming VALUES (?, ?, ?, ?)", messages)
+    matched = conn.execute(
+        "INSERT OR IGNORE INTO replies (campaign_id, idx, message_rowid, text, received_at) "
+        "SELECT r.campaign_id, r.idx, i.message_rowid, i.text, i.received_at FROM incoming i "
+        "JOIN recipients r ON r.handle = i.handle "
+        "JOIN campaigns c ON c.id = r.campaign_id "
+        "WHERE r.result IS NOT 'Not Sent' AND r.result IS NOT 'Skipped' AND i.received_at >= c.date"
+    ).rowcount
+    conn.execute(
+        "UPDATE recipients SET reply = latest.text FROM ("
+        "SELECT campaign_id, idx, text, MAX(message_rowid) FROM replies "
+        "WHERE message_rowid IN (SELECT message_rowid FROM incoming) GROUP BY campaign_id, idx"
+        ") AS latest WHERE recipients.campaign_id = latest.campaign_id AND recipients.idx = latest.idx"
+    )
+    conn.execute("UPDATE store_meta SET value = ? WHERE key = 'reply_rowid'", (watermark,))
+    conn.execute("DELETE FROM incoming")
+    return matched
+
+
+def record_replies(messages, watermark, db_path=None):
+    # messages: [(message_rowid, handle, text, received_at)] read from chat.db.
+    # Each is matched by handle to every contacted recipient of a campaign
+    # created before it arrived; the recipient's reply becomes their latest
+    # one and the watermark moves to `watermark`, all in one transaction.
+    return _write(db_path, _record_replies, messages, watermark)
+
+
+def _recipient_filter(filters):
+    clauses, params = [], []
+    for key, values in (filters or {}).items():
+        if not values:
+            continue
+        if key == "Status":
+            column = "status"
+        elif key == "Replied":
+            column = "(reply IS NOT NULL)"
+        else:
+            column = FILTER_COLUMNS[key]
+        clauses.append(f"{column} IN ({', '.join('?' for _ in values)})")
+        params.extend(values)
+    return (" AND " + " AND ".join(clauses) if clauses else ""), params
+
+
+def query_recipients(campaign_name, filters=None, sort="Row", descending=False, limit=500, offset=0, db_path=None):
+    # One page of recipients, filtered and sorted in SQL so the cost of a
+    # page does not depend on the size of the campaign.
+    # filters: {"Precinct Name": [...], "Party Last Primary": [...], "Zip Code": [...], "Status": [...],
+    #           "Replied": [True/False]}
+    where, params = _recipient_filter(filters)
+    keys = [key for key, _ in RECIPIENT_FIELDS]
+    with snapshot(db_path) as conn:
+        base = (f"FROM (SELECT *, {STATUS_SQL} AS status FROM recipients "
+                "WHERE campaign_id = (SELECT id FROM campaigns WHERE name = ?)) WHERE 1 = 1" + where)
+        total = conn.execute(f"SELECT COUNT(*) {base}", (campaign_name, *params)).fetchone()[0]
+        rows = conn.execute(
+            f"SELECT idx, {', '.join(RECIPIENT_COLUMNS)}, status, clicks, reply {base} "
+            f"ORDER BY {SORT_COLUMNS[sort]} {'DESC' if descending else 'ASC'}, idx LIMIT ? OFFSET ?",
+            (campaign_name, *params, limit, offset)
+        ).fetchall()
+    page = pd.DataFrame([tuple(row) for row in rows], columns=["Row"] + keys + ["Status", "Clicks", "Reply"])
+    return page, total
+
+
+def recipient_indices(campaign_name, filters=None, db_path=None):
+    where, params = _recipient_filter(filters)
+    with connect(db_path) as conn:
+        rows = conn.execute(
+            f"SELECT idx FROM (SELECT idx, precinct, party, zip, reply, {STATUS_SQL} AS status FROM recipients "
+            "WHERE campaign_id = (SELECT id FROM campaigns WHERE name = ?)) WHERE 1 = 1" + where + " ORDER BY idx",
+            (campaign_name, *params)
+        )
+        return [row['idx'] for row in rows]
+
+
+def filter_options(campaign_name, db_path=None):
+    with connect(db_path) as conn:
+        options = {}
+        for key, column in FILTER_COLUMNS.items():
+            rows = conn.execute(
+                f"SELECT DISTINCT {column} FROM recipients "
+                f"WHERE campaign_id = (SELECT id FROM campaigns WHERE name = ?) AND {column} IS NOT NULL "
+                f"ORDER BY {column}",
+                (campaign_name,)
+            )
+            options[key] = [row[column] for row in rows]
+        options["Status"] = RESULT_STATUSES
+        return options
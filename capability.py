@@ -0,0 +1,107 @@
+import sqlite3
+import time
+
+import campaign_store
+import phones
+import reply_sync
+
+# Which service each handle can be reached on, so known SMS-only numbers go
+# straight to SMS instead of an iMessage attempt, delivery wait and check.
+# Learned from how sends turned out and, ahead of a campaign, from the
+# Messages history. Observations expire because people switch phones: an
+# SMS-only number is tried on iMessage again once its entry is SMS_TTL old.
+IMESSAGE = 'iMessage'
+SMS_ONLY = 'SMS'
+IMESSAGE_TTL = 30 * 24 * 3600
+SMS_TTL = 14 * 24 * 3600
+
+
+def add_observations(conn, observations):
+    # Inside a campaign_store.write; an older observation never replaces a newer one
+    cursor = conn.executemany(
+        "INSERT INTO capabilities (handle, service, observed_at) VALUES (?, ?, ?) "
+        "ON CONFLICT (handle) DO UPDATE SET service = excluded.service, observed_at = excluded.observed_at "
+        "WHERE excluded.observed_at >= capabilities.observed_at",
+        ((handle, service, observed_at) for handle, service, observed_at in observations if handle)
+    )
+    return cursor.rowcount
+
+
+def record(observations, db_path=None):
+    # observations: iterable of (handle, service, unix time observed)
+    return campaign_store.write(add_observations, list(observations), db_path=db_path)
+
+
+def observations(handle, result):
+    # What the result of a send that tried iMessage first says about handle.
+    # Only sends that went out count: a failure names both services it tried.
+    if not result.startswith("Text message sent"):
+        return []
+    if " via iMessage" in result:
+        return [(handle, IMESSAGE, time.time())]
+    if " via SMS" in result:
+        return [(handle, SMS_ONLY, time.time())]
+    return []
+
+
+def observe(handle, result, db_path=None):
+    found = observations(handle, result)
+    if found:
+        record(found, db_path)
+
+
+def _unexpired(now):
+    # WHERE clause and parameters for entries still within their TTL
+    return ("(service = 'iMessage' AND observed_at >= ?) OR (service = 'SMS' AND observed_at >= ?)",
+            (now - IMESSAGE_TTL, now - SMS_TTL))
+
+
+def service_for(handle, db_path=None):
+    # IMESSAGE, SMS_ONLY, or None when unknown or expired
+    where, params = _unexpired(time.time())
+    with campaign_store.connect(db_path) as conn:
+        row = conn.execute(f"SELECT service FROM capabilities WHERE handle = ? AND ({where})",
+                           (handle, *params)).fetchone()
+        return row['service'] if row else None
+
+
+def known(db_path=None):
+    # {handle: service} for every unexpired entry, for routing a whole batch
+    where, params = _unexpired(time.time())
+    with campaign_store.connect(db_path) as conn:
+        return {row['handle']: row['service']
+                for row in conn.execute(f"SELECT handle, service FROM capabilities WHERE {where}", params)}
+
+
+def read_history(chat_db_path=None):
+    # (handle, service, unix time) of the latest evidence per handle in
+    # chat.db: anything they sent us, or an iMessage of ours that was
+    # delivered. Our own SMS says nothing about their phone, so it is ignored.
+    chat_db_path = chat_db_path or reply_sync.CHAT_DB_PATH
+    conn = sqlite3.connect(f"file:{chat_db_path}?mode=ro", uri=True)
+    try:
+        rows = conn.execute(
+            "SELECT h.id, m.service, MAX(m.date) FROM message m JOIN handle h ON h.ROWID = m.handle_id "
+            "WHERE m.service IN ('iMessage', 'SMS') AND m.date IS NOT NULL "
+            "AND (m.is_from_me = 0 OR (m.service = 'iMessage' AND m.is_delivered = 1)) GROUP BY h.id"
+        ).fetchall()
+    finally:
+        conn.close()
+    return [(phones.to_e164(handle), service, reply_sync.unix_time(date)) for handle, service, date in rows]
+
+
+def probe(handles, chat_db_path=None, db_path=None):
+    # Fills in handles the cache doesn't know from one read of the Messages
+    # history. Returns how many were learned; 0 if chat.db can't be read.
+    unknown = set(handles) - set(known(db_path))
+    if not unknown:
+        return 0
+    try:
+        history = read_history(chat_db_path)
+    except sqlite3.Error as e:
+        print(f"Capability probe skipped, could not read {chat_db_path or reply_sync.CHAT_DB_PATH}: {e}")
+        return 0
+    now = time.time()
+    ttl = {IMESSAGE: IMESSAGE_TTL, SMS_ONLY: SMS_TTL}
+    return record([(handle, service, observed_at) for handle, service, observed_at in history
+                   if handle in unknown and now - observed_at < ttl[service]], db_path)
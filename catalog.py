@@ -0,0 +1,34 @@
+import threading
+
+import campaign_store
+
+_lock = threading.Lock()
+_index = {}
+
+
+def campaign_status(entry):
+    if not entry['row_count']:
+        return "Empty"
+    if not entry['sent_count']:
+        return "Not Started"
+    if entry['sent_count'] >= entry['row_count']:
+        return "Complete"
+    return "In Progress"
+
+
+def campaign_index(db_path=None):
+    # Name, date, row count and status of every campaign, re-read only when
+    # the store version has moved
+    db_path = db_path or campaign_store.DB_PATH
+    version = campaign_store.store_version(db_path)
+    with _lock:
+        cached = _index.get(db_path)
+        if cached and cached[0] == version:
+            return cached[1]
+    index = campaign_store.campaign_index(db_path)
+    for entry in index:
+        entry['status'] = campaign_status(entry)
+    with _lock:
+        _index[db_path] = (version, index)
+    return index
+
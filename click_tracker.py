@@ -0,0 +1,204 @@
+import argparse
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, urlsplit
+
+import campaign_store
+
+# When set, campaign links point here and the tracker redirects each click
+# on to the campaign's base URL, e.g. http://localhost:8765/c
+TRACKING_URL = os.environ.get('MESSENGER_TRACKING_URL')
+DEFAULT_PORT = 8765
+LOG_PATH = 'clicks.log'
+# Clicks are logged and applied to the store in groups: one write, one
+# fsync and one transaction per FLUSH_INTERVAL however many clicks arrive
+FLUSH_INTERVAL = 0.05
+MAX_CACHED_IDS = 500_000
+
+_tracker_lock = threading.Lock()
+_tracker = None
+
+
+def link_base(base_url):
+    return TRACKING_URL or base_url
+
+
+class ClickTracker:
+    def __init__(self, db_path=None, log_path=LOG_PATH):
+        self.db_path = db_path or campaign_store.DB_PATH
+        self.log_path = log_path
+        self.counts = {}
+        self._targets = {}
+        self._pending = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        # Make sure the schema exists, then keep one connection open for the
+        # tracking id lookups that every first click needs
+        campaign_store.store_version(self.db_path)
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._log = open(self.log_path, 'a', encoding='utf-8')
+        self._flusher = threading.Thread(target=self._flush_loop, name="click-flusher", daemon=True)
+        self._flusher.start()
+
+    def target(self, tracking_id):
+        # (campaign name, base url) for an issued tracking id, or None
+        with self._lock:
+            if tracking_id in self._targets:
+                return self._targets[tracking_id]
+            row = self._conn.execute(
+                "SELECT c.name, c.base_url FROM recipients r JOIN campaigns c ON c.id = r.campaign_id "
+                "WHERE r.tracking_id = ?",
+                (tracking_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            if len(self._targets) >= MAX_CACHED_IDS:
+                self._targets.clear()
+            self._targets[tracking_id] = row
+            return row
+
+    def click(self, tracking_id, recipient):
+        # Records a click and returns the URL to redirect to, or None for an
+        # id that was never issued. The click is on disk within FLUSH_INTERVAL.
+        target = self.target(tracking_id)
+        if target is None:
+            return None
+        campaign_name, base_url = target
+        with self._lock:
+            self.counts[campaign_name] = self.counts.get(campaign_name, 0) + 1
+        self._pending.put({'time': time.time(), 'id': tracking_id, 'recipient': recipient,
+                           'campaign': campaign_name})
+        separator = '&' if '?' in base_url else '?'
+        return f"{base_url}{separator}id={tracking_id}&recipient={quote(recipient, safe='')}"
+
+    def _flush_loop(self):
+        while not self._stop_event.is_set() or not self._pending.empty():
+            try:
+                batch = [self._pending.get(timeout=FLUSH_INTERVAL)]
+            except queue.Empty:
+                continue
+            self._stop_event.wait(FLUSH_INTERVAL)
+            while True:
+                try:
+                    batch.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+            self._flush(batch)
+
+    def _flush(self, batch):
+        self._log.write("".join(json.dumps(click) + "\n" for click in batch))
+        self._log.flush()
+        os.fsync(self._log.fileno())
+        click_counts = {}
+        for click in batch:
+            click_counts[click['id']] = click_counts.get(click['id'], 0) + 1
+        try:
+            campaign_store.record_clicks(click_counts, self.db_path)
+        except sqlite3.Error as e:
+            # The clicks are already in the log, which replay_log can re-apply
+            print(f"Failed to record {len(batch)} clicks: {e}")
+
+    def close(self):
+        self._stop_event.set()
+        self._flusher.join()
+        self._log.close()
+        self._conn.close()
+
+
+def replay_log(log_path=LOG_PATH, db_path=None):
+    # Rebuilds click counters from the log, e.g. into a restored database.
+    # Counters are added to, so only replay into a store without them.
+    click_counts = {}
+    with open(log_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                tracking_id = json.loads(line)['id']
+                click_counts[tracking_id] = click_counts.get(tracking_id, 0) + 1
+    return campaign_store.record_clicks(click_counts, db_path)
+
+
+class ClickHandler(BaseHTTPRequestHandler):
+    # Keep-alive so a client following many links reuses its connection
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = parse_qs(url.query)
+        tracker = self.server.tracker
+        if url.path.rstrip('/').endswith('/stats'):
+            with tracker._lock:
+                body = json.dumps(tracker.counts).encode()
+            self._reply(200, body, {'Content-Type': 'application/json'})
+            return
+        tracking_id = params.get('id', [''])[0]
+        location = tracker.click(tracking_id, params.get('recipient', [''])[0]) if tracking_id else None
+        if location is None:
+            self._reply(404, b"Unknown link")
+        else:
+            self._reply(302, b"", {'Location': location})
+
+    def _reply(self, status, body, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ClickServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Room for the burst of connections right after a campaign goes out
+    request_queue_size = 1024
+
+    def __init__(self, address, tracker):
+        super().__init__(address, ClickHandler)
+        self.tracker = tracker
+
+
+def start_tracker(port=DEFAULT_PORT, host='127.0.0.1', db_path=None, log_path=LOG_PATH):
+    global _tracker
+    with _tracker_lock:
+        if _tracker is not None:
+            return _tracker
+        server = ClickServer((host, port), ClickTracker(db_path, log_path))
+        threading.Thread(target=server.serve_forever, name="click-tracker", daemon=True).start()
+        _tracker = server
+        return server
+
+
+def stop_tracker():
+    global _tracker
+    with _tracker_lock:
+        if _tracker is not None:
+            _tracker.shutdown()
+            _tracker.server_close()
+            _tracker.tracker.close()
+            _tracker = None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record link clicks and redirect to the campaign URL")
+    parser.add_argument("--host", default='127.0.0.1')
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--db", default=campaign_store.DB_PATH)
+    parser.add_argument("--log", default=LOG_PATH)
+    args = parser.parse_args()
+    tracker = ClickTracker(args.db, args.log)
+    server = ClickServer((args.host, args.port), tracker)
+    print(f"Tracking clicks on http://{args.host}:{args.port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        tracker.close()
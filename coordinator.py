@@ -0,0 +1,300 @@
+import argparse
+import hmac
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import campaign_store
+import capability
+import image_store
+import scheduler
+import send_journal
+import send_queue
+
+# Hands queued messages out to sender workers (sender_worker.py) on other
+# Macs or Messages accounts. Each claim is a lease: a worker renews it while
+# it works through the batch, and once it lapses the reaper settles the items
+# from the send journal so another worker can pick them up.
+DEFAULT_PORT = 8766
+LEASE_SECONDS = 60
+DEFAULT_CLAIM_SIZE = 10
+# Shared secret every request must carry as "Authorization: Bearer <token>".
+# Claims hand out phone numbers and messages, so anything listening beyond
+# localhost needs one.
+TOKEN = os.environ.get('MESSENGER_COORDINATOR_TOKEN')
+LOCAL_HOSTS = ('127.0.0.1', 'localhost', '::1')
+
+
+def _register(conn, sender_id, host):
+    now = time.time()
+    conn.execute(
+        "INSERT INTO senders (sender_id, host, registered_at, last_seen) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT (sender_id) DO UPDATE SET host = excluded.host, last_seen = excluded.last_seen",
+        (sender_id, host, now, now)
+    )
+
+
+def register(sender_id, host, db_path=None):
+    campaign_store.write(_register, sender_id, host, db_path=db_path)
+
+
+def _lease(conn, sender_id, candidates, lease_seconds):
+    # The candidates, (id, queued_seq) pairs, still queued, leased to the sender
+    now = time.time()
+    conn.execute("UPDATE senders SET last_seen = ? WHERE sender_id = ?", (now, sender_id))
+    if not candidates:
+        return []
+    return [row['id'] for row in conn.execute(
+        "UPDATE send_queue SET status = 'sending', lease_owner = ?, lease_expires = ?, updated_at = ? "
+        f"WHERE (id, queued_seq) IN (VALUES {', '.join('(?, ?)' for _ in candidates)}) AND status = 'queued' "
+        "RETURNING id",
+        (sender_id, now + lease_seconds, datetime.now().isoformat(), *(value for pair in candidates for value in pair))
+    ).fetchall()]
+
+
+def claim(sender_id, limit=DEFAULT_CLAIM_SIZE, lease_seconds=LEASE_SECONDS, db_path=None,
+          quiet_hours=scheduler.QUIET_HOURS):
+    # Leases up to `limit` of the scheduler's next eligible items to the
+    # sender; the status check keeps concurrent claims from overlapping
+    send_scheduler = scheduler.get_scheduler(db_path)
+    try:
+        candidates = send_scheduler.pop_many(limit, quiet_hours=quiet_hours)
+        ids = campaign_store.write(_lease, sender_id, candidates, lease_seconds, db_path=db_path)
+        while candidates and len(ids) < limit:
+            # Some were claimed or cancelled since the scheduler read them
+            candidates = send_scheduler.pop_many(limit - len(ids), quiet_hours=quiet_hours)
+            ids += campaign_store.write(_lease, sender_id, candidates, lease_seconds, db_path=db_path)
+    except Exception:
+        # Popped items the lease didn't take are still queued; re-read them
+        send_scheduler.reset()
+        raise
+    if not ids:
+        return []
+    with campaign_store.connect(db_path) as conn:
+        rows = conn.execute(
+            "SELECT q.id, q.campaign_name, q.idx, q.service, q.attempt, q.payload, q.tracking_id, "
+            "r.phone, r.name, c.image_hash FROM send_queue q "
+            "JOIN campaigns c ON c.name = q.campaign_name "
+            "JOIN recipients r ON r.campaign_id = c.id AND r.idx = q.idx "
+            f"WHERE q.id IN ({', '.join('?' for _ in ids)}) ORDER BY q.id",
+            ids
+        )
+        return [dict(row) for row in rows]
+
+
+def _renew(conn, sender_id, item_ids, lease_seconds):
+    now = time.time()
+    conn.execute("UPDATE senders SET last_seen = ? WHERE sender_id = ?", (now, sender_id))
+    return conn.executemany(
+        "UPDATE send_queue SET lease_expires = ? WHERE id = ? AND lease_owner = ? AND status = 'sending'",
+        ((now + lease_seconds, item_id, sender_id) for item_id in item_ids)
+    ).rowcount
+
+
+def renew(sender_id, item_ids, lease_seconds=LEASE_SECONDS, db_path=None):
+    return campaign_store.write(_renew, sender_id, list(item_ids), lease_seconds, db_path=db_path)
+
+
+def _leased_item(sender_id, item_id, db_path=None):
+    with campaign_store.connect(db_path) as conn:
+        row = conn.execute(
+            "SELECT id, campaign_name, idx, service, attempt, tracking_id FROM send_queue "
+            "WHERE id = ? AND lease_owner = ? AND status = 'sending'",
+            (item_id, sender_id)
+        ).fetchone()
+        return dict(row) if row else None
+
+
+def _journal_key(item):
+    return send_journal.idempotency_key(item['campaign_name'], item['idx'], item['attempt'],
+                                        item['service'] or 'iMessage')
+
+
+def begin_send(sender_id, item_id, db_path=None):
+    # Journals the intent to send. False if the sender no longer holds the
+    # lease or the item was already dispatched; either way it must not send.
+    item = _leased_item(sender_id, item_id, db_path)
+    if item is None:
+        return False
+    return send_journal.record_intent(_journal_key(item), item['campaign_name'], item['idx'], item['attempt'],
+                                      item['service'] or 'iMessage', db_path)
+
+
+def _finish(conn, sender_id, item_id, result, error):
+    row = conn.execute(
+        "SELECT q.id, q.campaign_name, q.idx, q.service, q.attempt, q.tracking_id, r.handle FROM send_queue q "
+        "JOIN campaigns c ON c.name = q.campaign_name "
+        "JOIN recipients r ON r.campaign_id = c.id AND r.idx = q.idx "
+        "WHERE q.id = ? AND q.status = 'sending' AND q.lease_owner = ?",
+        (item_id, sender_id)
+    ).fetchone()
+    if row is None:
+        return False
+    item = dict(row)
+    send_journal.set_outcome(conn, _journal_key(item), result, error)
+    if item['service'] != 'SMS':
+        capability.add_observations(conn, capability.observations(item['handle'], result))
+    campaign_store.set_recipient_result(conn, item['campaign_name'], item['idx'], result, item['tracking_id'])
+    conn.execute(
+        "UPDATE send_queue SET status = ?, lease_owner = NULL, lease_expires = NULL, updated_at = ? WHERE id = ?",
+        ('failed' if error else 'sent', datetime.now().isoformat(), item_id)
+    )
+    counter = 'failed' if error else 'sent'
+    conn.execute(f"UPDATE senders SET {counter} = {counter} + 1 WHERE sender_id = ?", (sender_id,))
+    return True
+
+
+def finish_send(sender_id, item_id, result, error, db_path=None):
+    # A sender's outcome is final: it already waited on delivery and fell
+    # back to SMS itself. Everything it changes commits together, and only
+    # while the sender still holds the lease; False, with nothing written,
+    # once the item was reaped or re-leased.
+    return campaign_store.write(_finish, sender_id, item_id, result, error, db_path=db_path)
+
+
+def senders(db_path=None):
+    with campaign_store.connect(db_path) as conn:
+        rows = conn.execute(
+            "SELECT s.*, (SELECT COUNT(*) FROM send_queue q WHERE q.lease_owner = s.sender_id "
+            "AND q.status = 'sending') AS leased FROM senders s ORDER BY sender_id"
+        )
+        return [dict(row) for row in rows]
+
+
+class CoordinatorHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _authorized(self):
+        token = self.server.token
+        if not token:
+            return True
+        offered = self.headers.get('Authorization', '')
+        if hmac.compare_digest(offered.encode(), f"Bearer {token}".encode()):
+            return True
+        # Unread request bodies would be taken for the next request on the connection
+        self.close_connection = True
+        self._json({'error': "Unauthorized"}, 401)
+        return False
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        db_path = self.server.db_path
+        if self.path.startswith('/image/'):
+            image_hash = os.path.basename(self.path)
+            try:
+                with open(image_store.image_path(image_hash), 'rb') as f:
+                    self._reply(200, f.read(), 'application/octet-stream')
+            except OSError:
+                self._reply(404, b"Unknown image", 'text/plain')
+        elif self.path == '/status':
+            self._json({'senders': senders(db_path)})
+        else:
+            self._reply(404, b"Not found", 'text/plain')
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        db_path = self.server.db_path
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        sender_id = request.get('sender_id')
+        if not sender_id:
+            self._json({'error': "sender_id is required"}, 400)
+        elif self.path == '/register':
+            register(sender_id, request.get('host'), db_path)
+            self.server.rates[sender_id] = request.get('rate')
+            self._json({'lease_seconds': self.server.lease_seconds})
+        elif self.path == '/claim':
+            # Each sender account gets no more than its rate, however often it claims
+            limit = request.get('limit', DEFAULT_CLAIM_SIZE)
+            pacing = scheduler.bucket(sender_id, self.server.sender_rate(sender_id), burst=limit)
+            limit = min(limit, pacing.available())
+            items = claim(sender_id, limit, self.server.lease_seconds, db_path,
+                          self.server.quiet_hours) if limit else []
+            pacing.take(len(items))
+            self._json({'items': items})
+        elif self.path == '/renew':
+            self._json({'renewed': renew(sender_id, request.get('ids', []), self.server.lease_seconds, db_path)})
+        elif self.path == '/begin':
+            self._json({'ok': begin_send(sender_id, request['id'], db_path)})
+        elif self.path == '/finish':
+            self._json({'ok': finish_send(sender_id, request['id'], request['result'], request.get('error'),
+                                          db_path)})
+        else:
+            self._json({'error': "Not found"}, 404)
+
+    def _json(self, body, status=200):
+        self._reply(status, json.dumps(body).encode(), 'application/json')
+
+    def _reply(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class CoordinatorServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, db_path=None, lease_seconds=LEASE_SECONDS, quiet_hours=scheduler.QUIET_HOURS,
+                 max_rate=None, token=None):
+        super().__init__(address, CoordinatorHandler)
+        self.db_path = db_path
+        self.token = token
+        self.lease_seconds = lease_seconds
+        self.quiet_hours = quiet_hours
+        self.max_rate = max_rate
+        self.rates = {}  # sender_id -> messages per minute it registered with
+        self._stop_event = threading.Event()
+        self._reaper = threading.Thread(target=self._reap, name="lease-reaper", daemon=True)
+        self._reaper.start()
+
+    def sender_rate(self, sender_id):
+        rate = self.rates.get(sender_id) or self.max_rate or send_queue.DEFAULT_RATE_PER_MINUTE
+        return min(rate, self.max_rate) if self.max_rate else rate
+
+    def _reap(self):
+        while not self._stop_event.wait(self.lease_seconds / 4):
+            send_queue.recover_interrupted(self.db_path, expired_leases=True)
+
+    def server_close(self):
+        self._stop_event.set()
+        super().server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Share queued campaign messages out to sender workers")
+    parser.add_argument("--host", default='127.0.0.1')
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--db", default=campaign_store.DB_PATH)
+    parser.add_argument("--lease", type=float, default=LEASE_SECONDS, help="seconds a claim lasts unless renewed")
+    parser.add_argument("--max-rate", type=float, help="messages per minute any one sender may claim")
+    parser.add_argument("--no-quiet-hours", action="store_true",
+                        help="hand out messages at any hour instead of holding them overnight")
+    parser.add_argument("--enqueue", action="append", default=[], metavar="CAMPAIGN",
+                        help="queue a campaign's unsent recipients before serving")
+    parser.add_argument("--token", default=TOKEN,
+                        help="shared secret senders must present (default: $MESSENGER_COORDINATOR_TOKEN)")
+    args = parser.parse_args()
+    if not args.token and args.host not in LOCAL_HOSTS:
+        parser.error("--token (or MESSENGER_COORDINATOR_TOKEN) is required when listening beyond localhost")
+    if args.max_rate is not None and args.max_rate <= 0:
+        parser.error("--max-rate must be more than 0")
+    for campaign_name in args.enqueue:
+        print(f"Queued {send_queue.enqueue_unsent(campaign_name, args.db)} messages from '{campaign_name}'")
+    server = CoordinatorServer((args.host, args.port), args.db, args.lease,
+                               None if args.no_quiet_hours else scheduler.QUIET_HOURS, args.max_rate, args.token)
+    print(f"Coordinating senders on http://{args.host}:{args.port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
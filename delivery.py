@@ -0,0 +1,146 @@
+import threading
+import time
+
+import campaign_store
+import capability
+import image_store
+import metrics
+from transport import TransportError, normalize_phone
+
+INITIAL_CHECK_DELAY = 2
+MAX_CHECK_DELAY = 30
+DELIVERY_TIMEOUT = 120
+POLL_INTERVAL = 1.0
+BATCH_SIZE = 500
+
+_verifier_lock = threading.Lock()
+_verifier = None
+
+
+def next_check_delay(checks):
+    return min(INITIAL_CHECK_DELAY * (2 ** checks), MAX_CHECK_DELAY)
+
+
+def mark_verifying(conn, item_id):
+    # Inside a campaign_store.write, right after an iMessage goes out
+    now = time.time()
+    conn.execute(
+        "UPDATE send_queue SET status = 'verifying', sent_at = ?, next_check_at = ?, checks = 0 WHERE id = ?",
+        (now, now + next_check_delay(0), item_id)
+    )
+
+
+def await_delivery(item_id, db_path=None):
+    campaign_store.write(mark_verifying, item_id, db_path=db_path)
+
+
+def _apply_checks(conn, results, observations, confirmed, fallbacks, pending, now):
+    # One pass's outcomes, committed together
+    for campaign_name, idx, result in results:
+        campaign_store.set_recipient_result(conn, campaign_name, idx, result)
+    capability.add_observations(conn, observations)
+    conn.executemany("UPDATE send_queue SET status = 'sent' WHERE id = ?", ((row['id'],) for row in confirmed))
+    conn.executemany("UPDATE send_queue SET status = 'queued', service = 'SMS' WHERE id = ?",
+                     ((row['id'],) for row in fallbacks))
+    conn.executemany("UPDATE send_queue SET next_check_at = ?, checks = ? WHERE id = ?",
+                     ((now + next_check_delay(row['checks'] + 1), row['checks'] + 1, row['id'])
+                      for row in pending))
+
+
+def verify_due(messenger, db_path=None):
+    # One pass: every in-flight message whose next check is due is checked
+    # with a single batched call, then confirmed, backed off, or routed to
+    # the SMS fallback once DELIVERY_TIMEOUT has passed without confirmation.
+    now = time.time()
+    with campaign_store.connect(db_path) as conn:
+        due = conn.execute(
+            "SELECT q.id, q.campaign_name, q.idx, q.sent_at, q.checks, r.phone, r.name, c.image_hash "
+            "FROM send_queue q "
+            "JOIN campaigns c ON c.name = q.campaign_name "
+            "JOIN recipients r ON r.campaign_id = c.id AND r.idx = q.idx "
+            "WHERE q.status = 'verifying' AND q.next_check_at <= ? "
+            "ORDER BY q.next_check_at LIMIT ?",
+            (now, BATCH_SIZE)
+        ).fetchall()
+    if not due:
+        return 0, 0
+
+    phones = {row['id']: normalize_phone(str(row['phone'])) for row in due}
+    with metrics.timed("delivery_check_batch"):
+        delivered = messenger.check_delivered_many(sorted(set(phones.values())))
+
+    confirmed, fallbacks, pending = [], [], []
+    for row in due:
+        phone = phones[row['id']]
+        if delivered.get(phone):
+            confirmed.append(row)
+        elif now - row['sent_at'] >= DELIVERY_TIMEOUT:
+            fallbacks.append(row)
+        else:
+            pending.append(row)
+
+    results = [(row['campaign_name'], row['idx'], _confirmed_result(messenger, row, phones[row['id']]))
+               for row in confirmed]
+    # A number whose iMessage never confirmed is routed to SMS until that observation expires
+    observations = ([(phones[row['id']], capability.IMESSAGE, now) for row in confirmed]
+                    + [(phones[row['id']], capability.SMS_ONLY, now) for row in fallbacks])
+    campaign_store.write(_apply_checks, results, observations, confirmed, fallbacks, pending, now, db_path=db_path)
+    metrics.count("imessage", len(confirmed))
+    return len(confirmed), len(fallbacks)
+
+
+def _confirmed_result(messenger, row, phone):
+    # As in the blocking flow, the campaign image follows a confirmed iMessage
+    result = f"Text message sent to {row['name']} at {phone} via iMessage"
+    if row['image_hash']:
+        image_path = image_store.image_path(row['image_hash'])
+        try:
+            with metrics.timed("image_send"):
+                messenger.send_file(phone, image_path)
+            result += f" and image sent from {image_path}"
+        except TransportError as e:
+            print(f"Image send failed for {phone}: {e}")
+    return result
+
+
+class DeliveryVerifier(threading.Thread):
+    def __init__(self, messenger, db_path=None):
+        super().__init__(name="delivery-verifier", daemon=True)
+        self.messenger = messenger
+        self.db_path = db_path
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def active(self):
+        return self.is_alive() and not self._stop_event.is_set()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                confirmed, fallbacks = verify_due(self.messenger, self.db_path)
+                if confirmed or fallbacks:
+                    print(f"Delivery check: {confirmed} confirmed, {fallbacks} routed to SMS")
+            except TransportError as e:
+                print(f"Delivery check failed: {e}")
+            except Exception as e:
+                # e.g. the store is locked; items stay 'verifying' for the next pass
+                print(f"Delivery check failed: {type(e).__name__}: {e}")
+            self._stop_event.wait(POLL_INTERVAL)
+
+
+def start_verifier(messenger, db_path=None):
+    global _verifier
+    with _verifier_lock:
+        if _verifier is not None and _verifier.active():
+            return _verifier
+        _verifier = DeliveryVerifier(messenger, db_path)
+        _verifier.start()
+        return _verifier
+
+
+def stop_verifier():
+    with _verifier_lock:
+        if _verifier is not None:
+            _verifier.stop()
@@ -0,0 +1,59 @@
+import functools
+import hashlib
+import io
+import os
+
+try:
+    from PIL import Image
+except ImportError:  # thumbnails fall back to the original image
+    Image = None
+
+IMAGE_DIR = 'campaign_images'
+THUMBNAIL_SIZE = 480
+
+
+def _extension(data):
+    if data.startswith(b'\x89PNG'):
+        return 'png'
+    if data.startswith(b'\xff\xd8'):
+        return 'jpg'
+    return 'img'
+
+
+def store_image(data):
+    # Images are stored once under their content hash; the returned
+    # "<sha256>.<ext>" name is what campaigns keep as image_hash
+    image_hash = f"{hashlib.sha256(data).hexdigest()}.{_extension(data)}"
+    path = image_path(image_hash)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    return image_hash
+
+
+def image_path(image_hash):
+    return os.path.abspath(os.path.join(IMAGE_DIR, image_hash[:2], image_hash))
+
+
+@functools.lru_cache(maxsize=32)
+def thumbnail(image_hash, size=THUMBNAIL_SIZE):
+    # Downscaled once to disk, then served from memory on every rerun
+    thumb_path = os.path.join(IMAGE_DIR, 'thumbnails', f"{size}_{image_hash.split('.')[0]}.png")
+    if os.path.exists(thumb_path):
+        with open(thumb_path, 'rb') as f:
+            return f.read()
+    with open(image_path(image_hash), 'rb') as f:
+        data = f.read()
+    if Image is None:
+        return data
+    image = Image.open(io.BytesIO(data))
+    image.thumbnail((size, size))
+    output = io.BytesIO()
+    image.save(output, format='PNG')
+    os.makedirs(os.path.dirname(thumb_path), exist_ok=True)
+    with open(thumb_path, 'wb') as f:
+        f.write(output.getvalue())
+    return output.getvalue()
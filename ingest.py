@@ -0,0 +1,114 @@
+import codecs
+import csv
+import os
+
+import pandas as pd
+
+import phones
+import recipient_table
+
+EXPECTED_COLUMNS = ["Phone", "Name", "Age", "Sex", "Party Last Primary", "Precinct Name", "Zip Code"]
+# Read as text so phones and zips keep their digits; Age is converted after
+COLUMN_DTYPES = {column: str for column in EXPECTED_COLUMNS}
+SAMPLE_BYTES = 64 * 1024
+CHUNK_SIZE = 50_000
+DELIMITERS = "\t,;|"
+
+
+class IngestError(Exception):
+    pass
+
+
+def detect_encoding(prefix):
+    if prefix.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    if prefix.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return 'utf-16'
+    # BOM-less UTF-16 shows up as a NUL in every other byte
+    if prefix and prefix.count(b'\x00') > len(prefix) // 4:
+        even_nulls = prefix[0::2].count(b'\x00')
+        odd_nulls = prefix[1::2].count(b'\x00')
+        return 'utf-16-be' if even_nulls > odd_nulls else 'utf-16-le'
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(prefix, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return 'latin1'
+
+
+def detect_delimiter(sample):
+    # Drop the last line, which is usually cut off mid-row
+    lines = sample.splitlines()
+    if len(lines) > 1:
+        lines = lines[:-1]
+    try:
+        return csv.Sniffer().sniff("\n".join(lines), delimiters=DELIMITERS).delimiter
+    except csv.Error:
+        return '\t'
+
+
+def _file_size(fileobj):
+    position = fileobj.tell()
+    size = fileobj.seek(0, os.SEEK_END)
+    fileobj.seek(position)
+    return size
+
+
+def read_voter_csv(fileobj, chunksize=CHUNK_SIZE, progress=None):
+    # progress(rows_read, fraction_of_file) is called after every chunk
+    prefix = fileobj.read(SAMPLE_BYTES)
+    fileobj.seek(0)
+    if not prefix:
+        raise IngestError("The uploaded file is empty. Please check the file format and try again.")
+
+    encoding = detect_encoding(prefix)
+    sample = codecs.getincrementaldecoder(encoding)(errors='replace').decode(prefix)
+    delimiter = detect_delimiter(sample)
+
+    header = next(csv.reader([sample.lstrip('\ufeff').splitlines()[0]], delimiter=delimiter))
+    missing_columns = [col for col in EXPECTED_COLUMNS if col not in header]
+    if missing_columns:
+        raise IngestError(
+            f"The following columns are missing from the CSV file: {', '.join(missing_columns)}. "
+            "Please ensure the CSV file contains all the required columns.")
+
+    try:
+        df = _read_chunks(fileobj, encoding, delimiter, chunksize, progress)
+    except UnicodeDecodeError:
+        # The sample looked like UTF-8 but the rest of the file is not
+        fileobj.seek(0)
+        df = _read_chunks(fileobj, 'latin1', delimiter, chunksize, progress)
+
+    if df.empty:
+        raise IngestError("DataFrame is empty after parsing. Please check the file format and try again.")
+    # Round first: a fractional age like 45.5 can't be cast to Int64 as is
+    df['Age'] = pd.to_numeric(df['Age'], errors='coerce').round().astype('Int64')
+    # E.164 from here on, so dedup and suppression compare like with like
+    df['Phone'] = phones.normalize_series(df['Phone'])
+    return df
+
+
+def _read_chunks(fileobj, encoding, delimiter, chunksize, progress):
+    total_bytes = _file_size(fileobj) or 1
+    chunks = []
+    rows_read = 0
+    try:
+        reader = pd.read_csv(fileobj, sep=delimiter, encoding=encoding, dtype=COLUMN_DTYPES,
+                             chunksize=chunksize)
+        for chunk in reader:
+            chunks.append(chunk)
+            rows_read += len(chunk)
+            if progress:
+                progress(rows_read, min(fileobj.tell() / total_bytes, 1.0))
+    except (pd.errors.ParserError, pd.errors.EmptyDataError) as e:
+        raise IngestError(f"Failed to read CSV with encoding: {encoding}, delimiter: {delimiter!r}. Error: {e}")
+    if not chunks:
+        return pd.DataFrame(columns=EXPECTED_COLUMNS)
+    return pd.concat(chunks, ignore_index=True)
+
+
+def build_results(df):
+    # Every row starts unsent. Extra CSV columns are kept so message
+    # templates can refer to them.
+    extra_columns = [column for column in df.columns if column not in EXPECTED_COLUMNS]
+    return recipient_table.RecipientTable(df[EXPECTED_COLUMNS + extra_columns])
@@ -1,20 +1,22 @@
 import streamlit as st
 import pandas as pd
-import subprocess
-import os
-import time
 import json
-import uuid
-import urllib.parse
 from datetime import datetime
-import base64
-import sys
-from io import StringIO
-
-def create_tracking_link(base_url, recipient_id):
-    tracking_id = str(uuid.uuid4())
-    tracking_url = f"{base_url}?id={tracking_id}&recipient={recipient_id}"
-    return tracking_url, tracking_id
+import sqlite3
+
+import campaign_stats
+import campaign_store
+import catalog
+import image_store
+import ingest
+import metrics
+from messenger_core import create_campaign, create_tracking_link, delete_campaign, start_sending, test_sms
+import reply_sync
+import scheduler
+import send_queue
+import suppression
+import templating
+import transport
 
 def save_tracking_info(tracking_data):
     with open('tracking_info.json', 'w') as f:
@@ -27,191 +29,12 @@ def load_tracking_info():
     except FileNotFoundError:
         return []
 
-# Add the test_sms function here
-def test_sms(phone, name, message):
-    # Normalize phone number
-    if not phone.startswith("+1") and len(phone) == 10:
-        phone = f"+1{phone}"
-
-    sms_applescript = f'''
-    tell application "Messages"
-        set targetBuddy to "{phone}"
-        set textMessage to "Hello {name},\n\n{message}"
-        send textMessage to buddy targetBuddy
-    end tell
-    '''
-    try:
-        result = subprocess.run(
-            ["osascript", "-e", sms_applescript],
-            capture_output=True,
-            text=True,
-            check=True
-        )
-        print(f"Success: {result.stdout}")
-        return f"SMS sent to {name} at {phone}", None
-    except subprocess.CalledProcessError as e:
-        print(f"Error: {e.stderr}")
-        return f"Failed to send SMS to {name} ({phone}): {e.stderr}", e.stderr
-
-def send_imessage(phone, name, message, tracking_link, image_path=None):
-    # Normalize phone number
-    if not phone.startswith("+1") and len(phone) == 10:
-        phone = f"+1{phone}"
-
-    # AppleScript for iMessage
-    imessage_applescript = f'''
-    tell application "Messages"
-        set targetBuddy to "{phone}"
-        set targetService to id of 1st service whose service type = iMessage
-        set textMessage to "Hello {name},\n\n{message}{tracking_link}"
-        set theBuddy to participant targetBuddy of account id targetService
-        send textMessage to theBuddy
-    end tell
-    '''
-
-    # AppleScript for SMS
-    sms_applescript = f'''
-    tell application "Messages"
-        set targetBuddy to "{phone}"
-        set textMessage to "Hello {name},\n\n{message}{tracking_link}"
-        send textMessage to buddy targetBuddy
-    end tell
-    '''
-
-    # Try iMessage first
-    try:
-        imessage_result = subprocess.run(
-            ["osascript", "-e", imessage_applescript],
-            capture_output=True,
-            text=True,
-            check=True
-        )
-        print(f"iMessage attempt: {imessage_result.stdout}")
-        time.sleep(2)
-
-        # Check delivery
-        check_applescript = f'''
-        tell application "Messages"
-            set targetBuddy to "{phone}"
-            set theBuddy to buddy targetBuddy
-            set theChat to chat of theBuddy
-            set theMessages to messages of theChat
-            if (count of theMessages) > 0 then
-                set latestMessage to item -1 of theMessages
-                return (delivered of latestMessage)
-            else
-                return false
-            end if
-        end tell
-        '''
-        check_result = subprocess.run(
-            ["osascript", "-e", check_applescript],
-            capture_output=True,
-            text=True,
-            check=True
-        ).stdout.strip()
-        print(f"Delivery check: {check_result}")
-
-        if check_result == "true":
-            result = f"Text message sent to {name} at {phone} via iMessage"
-            if image_path:
-                image_applescript = f'''
-                tell application "Messages"
-                    set targetBuddy to "{phone}"
-                    set targetService to id of 1st service whose service type = iMessage
-                    set theBuddy to participant targetBuddy of account id targetService
-                    send POSIX file "{image_path}" to theBuddy
-                end tell
-                '''
-                subprocess.run(["osascript", "-e", image_applescript], check=True)
-                result += f" and image sent from {image_path}"
-            return result, None
-
-    except subprocess.CalledProcessError as e:
-        print(f"iMessage failed: {e.stderr}")
-
-    # Fallback to SMS
-    try:
-        sms_result = subprocess.run(
-            ["osascript", "-e", sms_applescript],
-            capture_output=True,
-            text=True,
-            check=True
-        )
-        print(f"SMS attempt: {sms_result.stdout}")
-        return f"Text message sent to {name} at {phone} via SMS", None
-    except subprocess.CalledProcessError as e:
-        print(f"SMS failed: {e.stderr}")
-        return (
-            f"Failed to send to {name} ({phone}) via iMessage and SMS: {e.stderr}",
-            f"SMS error: {e.stderr}"
-        )
-    except Exception as e:
-        return f"Unexpected error sending to {name}: {str(e)}", str(e)
-    
-def get_imessage_responses(phone):
-    applescript = f'''
-    tell application "Messages"
-        set targetBuddy to "{phone}"
-        set targetService to id of 1st service whose service type = iMessage
-        set theBuddy to participant targetBuddy of account id targetService
-        set theChat to chat of theBuddy
-        set theMessages to messages of theChat
-        set latestMessage to item -1 of theMessages
-        return {{content of latestMessage, date received of latestMessage}}
-    end tell
-    '''
+RECIPIENT_PAGE_SIZE = 500
 
-    try:
-        # Ensure /usr/bin is in the PATH
-        os.environ['PATH'] = '/usr/bin:' + os.environ.get('PATH', '')
-        result = subprocess.run(
-            ["osascript", "-e", applescript],
-            capture_output=True,
-            text=True,
-            check=True
-        )
-
-        response, date = eval(result.stdout.strip())
-        print(f"Raw response from AppleScript for {phone}: {response}, {date}")  # Debugging
-        return response, date
-    except subprocess.CalledProcessError as e:
-        error_message = f"AppleScript Error for phone {phone}: {str(e)}"
-        print(error_message)
-        return f"Error getting response: {error_message}", None
-    except Exception as e:
-        error_message = f"General Error for phone {phone}: {str(e)}"
-        print(error_message)
-        return f"Error getting response: {error_message}", None
-
-def save_campaign_data(campaign_name, results, tracking_info, message_text, image_data, base_url):
-    campaign_data = {
-        'name': campaign_name,
-        'date': datetime.now().isoformat(),
-        'results': results,
-        'tracking_info': tracking_info,
-        'message_text': message_text,
-        'image_data': image_data,
-        'base_url': base_url
-    }
-
-    campaigns = load_campaigns()
-    campaigns.append(campaign_data)
-    with open('campaigns.json', 'w') as f:
-        json.dump(campaigns, f)
-
-def load_campaigns():
-    try:
-        with open('campaigns.json', 'r') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return []
-
-def delete_campaign(campaign_name):
-    campaigns = load_campaigns()
-    campaigns = [c for c in campaigns if c['name'] != campaign_name]
-    with open('campaigns.json', 'w') as f:
-        json.dump(campaigns, f)
+def select_campaign(campaign_index):
+    statuses = {entry['name']: f"{entry['status']}, {entry['row_count']} rows" for entry in campaign_index}
+    return st.selectbox("Select Campaign", options=list(statuses),
+                        format_func=lambda name: f"{name} ({statuses[name]})")
 
 def main():
     # Use the full_page parameter to maximize the app's width
@@ -219,6 +42,9 @@ def main():
 
     st.title("iMessage Sender App")
 
+    # Prometheus scrapes send pipeline timings from here while the app runs
+    metrics.start_server()
+
     with st.sidebar:
         # CSS to make the sidebar full height and justify content
         st.markdown(
@@ -252,10 +78,9 @@ def main():
             """
             <div class="disclaimer">
             <strong>Note:</strong> This application sends only <em>one</em> iMessage at a time.
-            Attempting to send multiple messages simultaneously is not supported
-            and may lead to unexpected behavior or errors. Please ensure you
-            click the 'Send' button for each recipient individually and wait
-            for confirmation before proceeding to the next recipient.
+            'Send All Unsent' and the recipient grid's bulk actions queue recipients
+            and send them one by one in the background at the chosen
+            messages-per-minute rate.
             <strong>Important:</strong> iMessages may not be delivered to non-Apple (Android) devices.
             If a message fails to send, try sending a standard text message manually.
             </div>
@@ -275,55 +100,45 @@ def main():
 def create_campaign_tab():
     st.header("Create Campaign")
     campaign_name = st.text_input("Enter campaign name:")
+    name_taken = any(entry['name'] == campaign_name for entry in catalog.campaign_index())
+    if name_taken:
+        st.error(f"A campaign named '{campaign_name}' already exists. Choose another name, or delete it "
+                 "on the Campaign Statistics tab first.")
     uploaded_file = st.file_uploader("Choose a CSV file", type="csv")
 
     if uploaded_file is not None:
-        # Define expected column names
-        expected_columns = ["Phone", "Name", "Age", "Sex", "Party Last Primary", "Precinct Name", "Zip Code"]  # Correct column name
-        # Read the file content as bytes
-        csv_bytes = uploaded_file.read()
-        df = None  # Initialize df outside the loop
-
-        # Try to decode the bytes with different encodings
-        for encoding in ['utf-16', 'utf-8-sig', 'utf-16-le', 'utf-16-be', 'latin1']:  # prioritize utf-16
+        # Parse each upload once; later reruns of the tab reuse the DataFrame
+        if st.session_state.get('ingested_file_id') != uploaded_file.file_id:
+            progress_bar = st.progress(0.0, text="Reading CSV...")
             try:
-                # Decode the bytes into a string
-                csv_data = csv_bytes.decode(encoding)
-
-                # Try to parse the CSV with the appropriate delimiter
-                try:
-                    df = pd.read_csv(StringIO(csv_data), delimiter='\t')
-
-                    # Check for the expected columns
-                    missing_columns = [col for col in expected_columns if col not in df.columns]
-                    if missing_columns:
-                        st.error(
-                            f"The following columns are missing from the CSV file: {', '.join(missing_columns)}. Please ensure the CSV file contains all the required columns.")
-                        df = None
-                    else:
-                        st.write(f"Successfully read CSV!")
-                    break  # If successful, exit the loop
-
-                except Exception as e:
-                    st.write(f"Failed to read CSV with encoding: {encoding}, delimiter: '\\t'. Error: {e}")
-                    continue  # If reading fails, continue to next encoding
-
-            except UnicodeDecodeError:
-                st.write(f"Failed to decode with encoding: {encoding}")
-                continue  # If decoding fails, continue to next encoding
-
-        if df is None:
-            st.error("Failed to read CSV with all attempted encodings and delimiters. Please check the file format.")
-            return
-
-        # Check if DataFrame is empty after parsing
-        if df.empty:
-            st.error("DataFrame is empty after parsing. Please check the file format and try again.")
-            return
+                df = ingest.read_voter_csv(
+                    uploaded_file,
+                    progress=lambda rows, fraction: progress_bar.progress(fraction, text=f"Read {rows} rows...")
+                )
+            except ingest.IngestError as e:
+                progress_bar.empty()
+                st.error(str(e))
+                return
+            progress_bar.empty()
+            st.session_state.ingested_file_id = uploaded_file.file_id
+            st.session_state.ingested_df = df
+        df = st.session_state.ingested_df
+        st.write(f"Successfully read CSV!")
 
         row_count = len(df)  # Get the number of rows
         st.write(f"Number of rows in uploaded from CSV: {row_count}")  # Display row count
 
+        # Phones were normalized at ingest; drop the rows that shouldn't be texted
+        skip_contacted = st.checkbox("Leave out voters another campaign has already texted", value=True)
+        df, dropped = suppression.screen(df, skip_contacted)
+        columns = st.columns(len(dropped) + 1)
+        columns[0].metric("Recipients", len(df))
+        for column, (reason, count) in zip(columns[1:], dropped.items()):
+            column.metric(reason, count)
+        if df.empty:
+            st.warning("No recipients are left to text after removing invalid, duplicate and opted-out phones.")
+            return
+
         st.write("Preview of uploaded data:")
         st.dataframe(df.head())
 
@@ -334,45 +149,39 @@ def create_campaign_tab():
         st.subheader("Message Preview")
         col1, col2 = st.columns(2)
         with col1:
-            st.text_area("Message", value=f"Hello [Name],\n{message}\n[Tracking Link]", height=100, disabled=True)
+            template = templating.MessageTemplate(message)
+            st.text_area("Message", value=template.render(df.iloc[0].to_dict(), "[Tracking Link]"),
+                         height=100, disabled=True)
+            unknown_fields = template.unknown_fields(df.columns)
+            if unknown_fields:
+                st.warning(f"These placeholders don't match a CSV column: "
+                           f"{', '.join(f'[{field}]' for field in unknown_fields)}")
         with col2:
             if image_file:
                 st.image(image_file, caption="Campaign Image", use_column_width=True)
             else:
                 st.write("No image selected")
 
-        if st.button("Create Campaign", key="create_button") and message and base_url and campaign_name:
-            image_data = None
-            if image_file:
-                image_data = base64.b64encode(image_file.getvalue()).decode()
-
-            tracking_info = {}
-            results = []
-
+        if st.button("Create Campaign", key="create_button", disabled=name_taken) and message and base_url \
+                and campaign_name:
             # store the data without sending the messages
             try:
-                results = [{"Phone": row['Phone'], "Name": row['Name'], "Age": row['Age'], "Sex": row['Sex'],
-                            "Party Last Primary": row['Party Last Primary'], "Precinct Name": row['Precinct Name'],
-                            "Zip Code": row['Zip Code'], "result": "Not Sent", "tracking_id": None} for index, row in
-                           df.iterrows()]
-            except KeyError as e:
-                st.error(
-                    f"KeyError: {e}. This indicates that a required column is missing from your DataFrame. Please double-check the CSV file and ensure all required columns are present and named correctly.")
-                return
-
-            save_campaign_data(campaign_name, results, tracking_info, message, image_data, base_url)
-            st.success(f"Campaign '{campaign_name}' created successfully!")
+                create_campaign(campaign_name, df, message, base_url, image_file.getvalue() if image_file else None)
+                st.success(f"Campaign '{campaign_name}' created successfully!")
+            except campaign_store.CampaignExistsError as e:
+                st.error(str(e))
 
 def send_messages_tab():
     st.header("Send Messages")
 
-    campaigns = load_campaigns()
-    if not campaigns:
+    campaign_index = catalog.campaign_index()
+    if not campaign_index:
         st.warning("No campaigns available. Please create a campaign in the 'Create Campaign' tab first.")
         return
 
-    selected_campaign = st.selectbox("Select Campaign", options=[c['name'] for c in campaigns])
-    campaign_data = next(c for c in campaigns if c['name'] == selected_campaign)
+    selected_campaign = select_campaign(campaign_index)
+    index_entry = next(entry for entry in campaign_index if entry['name'] == selected_campaign)
+    campaign_data = campaign_store.load_campaign(selected_campaign, with_results=False)
 
     # Campaign Details in one row
     col1, col2, col3, col4 = st.columns([2, 1.5, 1.5, 2])  # Added a fourth column
@@ -383,86 +192,171 @@ def send_messages_tab():
     with col3:
         st.write(f"**Time Created:** {campaign_data['date'][11:16]}")  # Extract time
     with col4:  # Added the row count to the new column
-        st.write(f"**Row Count:** {len(campaign_data['results'])}")
+        st.write(f"**Row Count:** {index_entry['row_count']}")
 
     # Message Preview (Same as Create Campaign)
     st.subheader("Message Preview")
     col1, col2 = st.columns(2)
     with col1:
-        st.text_area("Message", value=f"Hello [Name],\n{campaign_data['message_text']}\n[Tracking Link]", height=100,
+        template = templating.MessageTemplate(campaign_data['message_text'])
+        preview_recipient = campaign_store.load_recipient(selected_campaign, 0) or {}
+        st.text_area("Message", value=template.render(preview_recipient, "[Tracking Link]"), height=100,
                      disabled=True)
     with col2:
-        if campaign_data['image_data']:
-            image_bytes = base64.b64decode(campaign_data['image_data'])
-            st.image(image_bytes, caption="Campaign Image", use_column_width=True)
+        if campaign_data['image_hash']:
+            st.image(image_store.thumbnail(campaign_data['image_hash']), caption="Campaign Image",
+                     use_column_width=True)
         else:
             st.write("No image selected")
 
-    st.subheader("Send Individual Messages")
-
-    # Column Titles
-    column_titles = ["Name (Phone)", "Age", "Sex", "Party", "Last Primary", "Precinct", "Zip", "Action"]
-    column_widths = [3, 1, 1, 1.5, 2, 2.5, 1.5, 1.5]  # Same widths as data columns
-    title_cols = st.columns(column_widths)
-    for i, title in enumerate(column_titles):
-        title_cols[i].write(f"**{title}**")
-
-    # Pagination
-    if 'start_index' not in st.session_state:
-        st.session_state.start_index = 0
-    if 'end_index' not in st.session_state:
-        st.session_state.end_index = min(100, len(campaign_data['results']))
-
-    def load_more():
-        st.session_state.start_index = st.session_state.end_index
-        st.session_state.end_index = min(st.session_state.end_index + 100, len(campaign_data['results']))
-
-    # Display messages for the current page
-    for i in range(st.session_state.start_index, st.session_state.end_index):
-        result = campaign_data['results'][i]
-
-        # Create columns for each piece of information
-        cols = st.columns(column_widths)  # Use the same widths as titles
-
-        cols[0].write(f"**{result['Name']}** ({result['Phone']})")
-        cols[1].write(f"{result['Age']}")
-        cols[2].write(f"{result['Sex']}")
-        cols[3].write(f"{result['Party Last Primary']}")
-        cols[4].write(f"{result.get('Party Last Primary', 'N/A')}")
-        cols[5].write(f"{result['Precinct Name']}")
-        cols[6].write(f"{result['Zip Code']}")
-
-        # Button column
-        with cols[7]:
-            key = f"send_button_{i}"
-            if key not in st.session_state:
-                st.session_state[key] = False
-
-            if not st.session_state[key]:
-                if st.button("Send", key=f"button_{i}", help=f"Send to {result['Name']}",
-                             use_container_width=True):
-                    tracking_link, tracking_id = create_tracking_link(campaign_data['base_url'], result['Phone'])
-                    personalized_message = campaign_data['message_text'].replace("[Name]", result['Name'])
-                    result_message, error_message = send_imessage(result['Phone'], result['Name'], personalized_message,
-                                                     tracking_link, None)
-                    if error_message:
-                        st.warning(f"Message to {result['Name']} may not have been delivered (potential non-Apple device). Error: {error_message}")
-                    else:
-                        st.success(f"Message sent to {result['Name']}", icon="✅")
-
-                    result['result'] = result_message
-                    save_campaign_data(campaign_data['name'], campaign_data['results'],
-                                        campaign_data['tracking_info'],
-                                        campaign_data['message_text'], campaign_data['image_data'],
-                                        campaign_data['base_url'])
-                    st.session_state[key] = True
+    st.subheader("Send All Messages")
+    rate = st.number_input("Messages per minute", min_value=1, max_value=600,
+                           value=send_queue.DEFAULT_RATE_PER_MINUTE)
+    start, end = scheduler.QUIET_HOURS
+    quiet_hours = scheduler.QUIET_HOURS if st.checkbox(
+        f"Hold texts between {start}:00 and {end}:00 in each recipient's time zone",
+        value=True) else None
+    first_precincts = st.multiselect("Send these precincts first",
+                                     campaign_store.filter_options(campaign_data['name']).get("Precinct Name", []))
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        if st.button("Send All Unsent", use_container_width=True):
+            queued = send_queue.enqueue_unsent(
+                campaign_data['name'],
+                precinct_priorities={precinct: scheduler.PRIORITY_FIRST for precinct in first_precincts})
+            start_sending(rate, quiet_hours)
+            st.success(f"Queued {queued} messages")
+    with col2:
+        if st.button("Pause Sending", use_container_width=True):
+            send_queue.stop_worker()
+    with col3:
+        if st.button("Cancel Queued", use_container_width=True):
+            cancelled = send_queue.cancel(campaign_data['name'])
+            st.info(f"Cancelled {cancelled} queued messages")
+
+    # The worker sends in the background; this only reads its progress
+    queue_progress = send_queue.progress(campaign_data['name'])
+    queued_total = sum(n for status, n in queue_progress.items() if status != 'cancelled')
+    if queued_total:
+        finished = queue_progress.get('sent', 0) + queue_progress.get('failed', 0)
+        st.progress(finished / queued_total,
+                    text=f"{finished} of {queued_total} sent ({queue_progress.get('failed', 0)} failed, "
+                         f"{queue_progress.get('verifying', 0)} awaiting delivery confirmation, "
+                         f"{queue_progress.get('queued', 0)} waiting)")
+        held, resumes_at = scheduler.get_scheduler().held(quiet_hours=quiet_hours)
+        if queue_progress.get('queued') and held:
+            st.caption(f"About {held} messages are held for quiet hours; the first go out at "
+                       f"{datetime.fromtimestamp(resumes_at):%H:%M}.")
+        col1, col2 = st.columns(2)
+        with col1:
+            st.button("Refresh Progress", use_container_width=True)
+        with col2:
+            if queue_progress.get('queued') and not send_queue.worker_running():
+                if st.button("Resume Sending", use_container_width=True):
+                    start_sending(rate, quiet_hours)
                     st.experimental_rerun()
-            else:
-                st.success("Sent", icon="✅")
 
-    # Load More button
-    if st.session_state.end_index < len(campaign_data['results']):
-        st.button("Load 100 More", on_click=load_more)
+    with st.expander("Send Pipeline Timings"):
+        pipeline_metrics()
+
+    st.subheader("Recipients")
+    recipient_grid(campaign_data['name'], rate, quiet_hours)
+
+def pipeline_metrics():
+    # Since the app started, across every campaign; Refresh Progress updates it
+    stages, outcomes = metrics.snapshot()
+    depth = send_queue.queue_depth()
+    columns = st.columns(5)
+    for column, (label, value) in zip(columns, [
+        ("iMessage", outcomes.get("imessage", 0)),
+        ("SMS Fallback", outcomes.get("sms_fallback", 0)),
+        ("SMS", outcomes.get("sms", 0)),
+        ("Failed", outcomes.get("failed", 0)),
+        ("Queue Depth", depth.get('queued', 0) + depth.get('sending', 0) + depth.get('verifying', 0)),
+    ]):
+        column.metric(label, value)
+    if stages:
+        st.dataframe(pd.DataFrame(stages), hide_index=True, use_container_width=True)
+    else:
+        st.write("Nothing has been timed yet.")
+    st.caption(f"Prometheus metrics: http://127.0.0.1:{metrics.DEFAULT_PORT}/metrics")
+
+def paged_table(campaign_name, filters, sort, descending, key):
+    _, total = campaign_store.query_recipients(campaign_name, filters, limit=0)
+    page_count = max((total + RECIPIENT_PAGE_SIZE - 1) // RECIPIENT_PAGE_SIZE, 1)
+    page = st.number_input(f"Page (of {page_count}, {total} rows)", min_value=1, max_value=page_count, value=1,
+                           key=f"{key}_page_{campaign_name}")
+    page_df, _ = campaign_store.query_recipients(
+        campaign_name, filters, sort, descending, limit=RECIPIENT_PAGE_SIZE, offset=(page - 1) * RECIPIENT_PAGE_SIZE
+    )
+    st.dataframe(page_df[["Row", "Name", "Phone", "Precinct Name", "Status", "Clicks", "Reply", "result"]],
+                 hide_index=True, use_container_width=True)
+
+def recipient_grid(campaign_name, rate, quiet_hours):
+    # One data grid showing a single page of recipients. Filtering, sorting
+    # and paging happen in the campaign store, so a rerun only ever
+    # transfers RECIPIENT_PAGE_SIZE rows whatever the campaign's size.
+    options = campaign_store.filter_options(campaign_name)
+    filters = {}
+    filter_cols = st.columns(len(options))
+    for col, (key, values) in zip(filter_cols, options.items()):
+        with col:
+            filters[key] = st.multiselect(key, values, key=f"filter_{campaign_name}_{key}")
+
+    col1, col2, col3 = st.columns([2, 1, 1])
+    with col1:
+        sort = st.selectbox("Sort by", list(campaign_store.SORT_COLUMNS), key=f"sort_{campaign_name}")
+    with col2:
+        descending = st.checkbox("Descending", key=f"descending_{campaign_name}")
+
+    _, total = campaign_store.query_recipients(campaign_name, filters, limit=0)
+    page_count = max((total + RECIPIENT_PAGE_SIZE - 1) // RECIPIENT_PAGE_SIZE, 1)
+    with col3:
+        page = st.number_input(f"Page (of {page_count})", min_value=1, max_value=page_count, value=1,
+                               key=f"page_{campaign_name}")
+    page_df, total = campaign_store.query_recipients(
+        campaign_name, filters, sort, descending, limit=RECIPIENT_PAGE_SIZE, offset=(page - 1) * RECIPIENT_PAGE_SIZE
+    )
+    st.caption(f"{total} matching recipients")
+
+    page_df.insert(0, "Select", False)
+    edited = st.data_editor(
+        page_df,
+        hide_index=True,
+        use_container_width=True,
+        disabled=[column for column in page_df.columns if column != "Select"],
+        column_config={"Row": st.column_config.NumberColumn("Row", format="%d")},
+        key=f"grid_{campaign_name}_{page}_{sort}_{descending}"
+    )
+    selected = edited.loc[edited["Select"], "Row"].tolist()
+
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        if st.button(f"Send Selected ({len(selected)})", use_container_width=True, disabled=not selected):
+            queued = send_queue.enqueue(campaign_name, selected)
+            start_sending(rate, quiet_hours)
+            st.success(f"Queued {queued} messages")
+    with col2:
+        # Only the unsent rows among those shown; none if the Status filter leaves Not Sent out
+        unsent_filters = {**filters, "Status": ["Not Sent"]}
+        unsent_total = 0
+        if not filters.get("Status") or "Not Sent" in filters["Status"]:
+            _, unsent_total = campaign_store.query_recipients(campaign_name, unsent_filters, limit=0)
+        if st.button(f"Send Matching Unsent ({unsent_total})", use_container_width=True, disabled=not unsent_total):
+            queued = send_queue.enqueue(campaign_name, campaign_store.recipient_indices(campaign_name, unsent_filters))
+            start_sending(rate, quiet_hours)
+            st.success(f"Queued {queued} messages")
+    with col3:
+        if st.button("Retry Failed", use_container_width=True):
+            # Retries wait behind first sends still queued
+            queued = send_queue.enqueue(campaign_name, campaign_store.recipient_indices(
+                campaign_name, {"Status": ["Failed"]}), priority=scheduler.PRIORITY_RETRY)
+            start_sending(rate, quiet_hours)
+            st.success(f"Queued {queued} failed messages for retry")
+    with col4:
+        if st.button(f"Skip Selected ({len(selected)})", use_container_width=True, disabled=not selected):
+            send_queue.skip(campaign_name, selected)
+            st.experimental_rerun()
 
 def send_manual_message_tab():
     st.header("Send Manual Message")
@@ -470,20 +364,30 @@ def send_manual_message_tab():
     name = st.text_input("Recipient Name:")
     phone = st.text_input("Recipient Phone Number:")
 
-    campaigns = load_campaigns()
-    if not campaigns:
+    campaign_index = catalog.campaign_index()
+    if not campaign_index:
         st.warning("No campaigns available. Please create a campaign in the 'Create Campaign' tab first.")
         return
 
-    selected_campaign = st.selectbox("Select Campaign", options=[c['name'] for c in campaigns])
-    campaign_data = next(c for c in campaigns if c['name'] == selected_campaign)
+    selected_campaign = select_campaign(campaign_index)
+    campaign_data = campaign_store.load_campaign(selected_campaign, with_results=False)
     base_url = campaign_data['base_url']
     message_text = campaign_data['message_text']
 
+    # The campaign message may use other CSV columns; ask for those too
+    template = templating.MessageTemplate(message_text)
+    manual_recipient = {"Name": name, "Phone": phone}
+    extra_fields = template.unknown_fields(manual_recipient)
+    for field in extra_fields:
+        manual_recipient[field] = st.text_input(f"{field}:", key=f"manual_{field}")
+    missing_fields = [field for field in extra_fields if not manual_recipient[field]]
+    if missing_fields:
+        st.warning(f"Fill in these placeholders before sending: "
+                   f"{', '.join(f'[{field}]' for field in missing_fields)}")
+
     # Message Preview
     st.subheader("Message Preview")
-    preview_message = message_text.replace("[Name]", name) if name else message_text
-    st.text_area("Preview", value=f"Hello {name},\n{preview_message}\n[Tracking Link]", height=100, disabled=True)
+    st.text_area("Preview", value=template.render(manual_recipient, "[Tracking Link]"), height=100, disabled=True)
 
     # Add a test SMS button
     if st.button("Test SMS Send"):
@@ -494,10 +398,10 @@ def send_manual_message_tab():
             st.success(result)
 
     # Existing send button
-    if st.button("Send Message", disabled=not (name and phone and base_url and message_text)):
+    if st.button("Send Message", disabled=bool(missing_fields) or not (name and phone and base_url and message_text)):
         tracking_link, tracking_id = create_tracking_link(base_url, phone)
-        personalized_message = message_text.replace("[Name]", name)
-        result_message, error_message = send_imessage(phone, name, personalized_message, tracking_link, None)
+        result_message, error_message = transport.get_transport().send_with_fallback(
+            phone, name, template.render(manual_recipient, tracking_link))
         if error_message:
             st.warning(f"Message to {name} may not have been delivered. Error: {error_message}")
         else:
@@ -507,13 +411,13 @@ def send_manual_message_tab():
 def campaign_statistics_tab():
     st.header("Campaign Statistics")
 
-    campaigns = load_campaigns()
-    if not campaigns:
+    campaign_index = catalog.campaign_index()
+    if not campaign_index:
         st.warning("No campaigns available. Please create a campaign in the 'Create Campaign' tab first.")
         return
 
-    selected_campaign = st.selectbox("Select Campaign", options=[c['name'] for c in campaigns])
-    campaign_data = next(c for c in campaigns if c['name'] == selected_campaign)
+    selected_campaign = select_campaign(campaign_index)
+    campaign_data = campaign_store.load_campaign(selected_campaign, with_results=False)
 
     # Review Messages
     st.subheader("Message Review")
@@ -521,39 +425,37 @@ def campaign_statistics_tab():
     st.write(f"Campaign Date: {campaign_data['date'][:10]}")
     st.text_area("Sent Message", value=campaign_data['message_text'], height=100, disabled=True)
 
-    if campaign_data['image_data']:
-        st.image(base64.b64decode(campaign_data['image_data']), caption="Sent Image", use_column_width=True)
+    if campaign_data['image_hash']:
+        st.image(image_store.thumbnail(campaign_data['image_hash']), caption="Sent Image", use_column_width=True)
     else:
         st.write("No image selected")
 
-    successful_sends = sum(1 for msg in campaign_data['results'] if not msg['result'].startswith("Error"))
-    failed_sends = len(campaign_data['results']) - successful_sends
+    # Counters are kept current as results are written, so this is one row read
+    summary = campaign_stats.summary(selected_campaign)
+    columns = st.columns(len(summary))
+    for column, (label, value) in zip(columns, summary.items()):
+        column.metric(label, value)
 
-    col1, col2 = st.columns(2)
-    col1.metric("Successfully Sent", successful_sends)
-    col2.metric("Failed to Send", failed_sends)
+    st.subheader("Breakdown by Segment")
+    breakdowns = campaign_stats.breakdowns(selected_campaign)
+    segment = st.radio("Group by", campaign_stats.SEGMENTS, horizontal=True)
+    st.dataframe(breakdowns[segment], hide_index=True, use_container_width=True)
 
-    if failed_sends > 0:
+    if summary["Failed"]:
         st.subheader("Failed Messages")
-        failed_messages = [msg for msg in campaign_data['results'] if msg['result'].startswith("Error")]
-        for msg in failed_messages:
-            st.write(f"Name: {msg['Name']}, Phone: {msg['Phone']}")
-            st.write(f"Error: {msg['result']}")
-            st.write("---")
+        paged_table(selected_campaign, {"Status": ["Failed"]}, "Row", False, "failed")
 
-    # Click Statistics
     st.subheader("Link Click Statistics")
-    tracking_info = campaign_data['tracking_info']
-    clicked = sum(1 for info in tracking_info.values() if info['clicked'])
-    not_clicked = len(tracking_info) - clicked
-
-    col1, col2 = st.columns(2)
-    col1.metric("Clicked", clicked)
-    col2.metric("Not Clicked", not_clicked)
-
-    st.subheader("Detailed Statistics")
-    for tracking_id, info in tracking_info.items():
-        st.write(f"Name: {info['Name']}, Phone: {info['Phone']}, Clicked: {'Yes' if info['clicked'] else 'No'}")
+    paged_table(selected_campaign, {"Status": ["Sent"]}, "Clicks", True, "clicks")
+
+    st.subheader("Replies")
+    if st.button("Sync Replies"):
+        try:
+            read, matched = reply_sync.sync_replies()
+            st.success(f"Read {read} new messages, {matched} replies from campaign recipients")
+        except sqlite3.Error as e:
+            st.error(f"Could not read the Messages database at {reply_sync.CHAT_DB_PATH}: {e}")
+    paged_table(selected_campaign, {"Replied": [True]}, "Row", False, "replies")
 
     # Delete Campaign
     st.subheader("Delete Campaign")
@@ -0,0 +1,175 @@
+import argparse
+import sys
+from datetime import datetime
+
+import campaign_stats
+import campaign_store
+import ingest
+import messenger_core
+import metrics
+import scheduler
+import send_queue
+
+
+def _print_progress(counts):
+    total = sum(n for status, n in counts.items() if status != 'cancelled')
+    done = counts.get('sent', 0) + counts.get('failed', 0)
+    print(f"[{datetime.now():%H:%M:%S}] {done}/{total} done: {counts.get('sent', 0)} sent, "
+          f"{counts.get('failed', 0)} failed, {counts.get('verifying', 0)} awaiting delivery, "
+          f"{counts.get('queued', 0)} queued", flush=True)
+
+
+def create(args):
+    image_data = None
+    if args.image:
+        with open(args.image, 'rb') as f:
+            image_data = f.read()
+    message = args.message
+    if args.message_file:
+        with open(args.message_file, 'r', encoding='utf-8') as f:
+            message = f.read()
+    with open(args.csv, 'rb') as f:
+        kept, dropped = messenger_core.create_campaign_from_csv(
+            args.name, f, message, args.base_url, image_data, skip_contacted=not args.include_contacted,
+            progress=lambda rows, fraction: print(f"Read {rows} rows ({fraction:.0%})", flush=True)
+        )
+    print(f"Created campaign '{args.name}' with {kept} recipients")
+    for reason, count in dropped.items():
+        print(f"  {reason}: {count}")
+
+
+def send(args):
+    counts = messenger_core.run_campaign(args.name, args.rate, args.concurrency, progress=_print_progress,
+                                         poll_interval=args.interval, quiet_hours=args.quiet_hours,
+                                         precinct_priorities=_precinct_priorities(args))
+    return 1 if counts.get('failed') else 0
+
+
+def retry_failed(args):
+    indices = messenger_core.failed_indices(args.name)
+    print(f"Retrying {len(indices)} failed recipients", flush=True)
+    if not indices:
+        return 0
+    # Retries go after fresh sends of any campaign still queued
+    counts = messenger_core.run_campaign(args.name, args.rate, args.concurrency, indices,
+                                         progress=_print_progress, poll_interval=args.interval,
+                                         quiet_hours=args.quiet_hours, priority=scheduler.PRIORITY_RETRY,
+                                         precinct_priorities=_precinct_priorities(args))
+    return 1 if counts.get('failed') else 0
+
+
+def status(args):
+    names = [args.name] if args.name else [entry['name'] for entry in campaign_store.campaign_index()]
+    for name in names:
+        summary = campaign_stats.summary(name)
+        if summary is None:
+            print(f"No campaign named '{name}'", file=sys.stderr)
+            return 1
+        print(name)
+        for label, value in summary.items():
+            print(f"  {label}: {value}")
+        queue_counts = send_queue.progress(name)
+        if queue_counts:
+            print("  Queue: " + ", ".join(f"{n} {status}" for status, n in sorted(queue_counts.items())))
+    return 0
+
+
+def export(args):
+    if args.output.endswith('.parquet'):
+        # The compact columnar form, readable with RecipientTable.load
+        table = campaign_store.load_recipients(args.name)
+        if table is None:
+            print(f"No campaign named '{args.name}'", file=sys.stderr)
+            return 1
+        table.save(args.output)
+        rows = len(table)
+    elif args.output == '-':
+        rows = messenger_core.export_campaign(args.name, sys.stdout)
+    else:
+        with open(args.output, 'w', newline='', encoding='utf-8') as f:
+            rows = messenger_core.export_campaign(args.name, f)
+    print(f"Exported {rows} recipients", file=sys.stderr)
+
+
+def _quiet_hours(value):
+    # "21-9" for 9pm to 9am, or "off"
+    if value == 'off':
+        return None
+    try:
+        start, end = (int(hour) for hour in value.split('-'))
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected START-END hours, e.g. 21-9, or off")
+    if not (0 <= start < 24 and 0 <= end < 24):
+        raise argparse.ArgumentTypeError("hours must be between 0 and 23")
+    return start, end
+
+
+def _precinct_priorities(args):
+    return {precinct: scheduler.PRIORITY_FIRST for precinct in args.first_precinct} or None
+
+
+def _add_send_options(parser):
+    parser.add_argument("name")
+    parser.add_argument("--rate", type=float, default=send_queue.DEFAULT_RATE_PER_MINUTE,
+                        help="messages per minute across all workers")
+    parser.add_argument("--concurrency", type=int, default=1, help="send workers sharing the rate")
+    parser.add_argument("--interval", type=float, default=5.0, help="seconds between progress lines")
+    parser.add_argument("--quiet-hours", type=_quiet_hours, default=scheduler.QUIET_HOURS,
+                        help="hours in the recipient's time zone to hold texts, e.g. 21-9 (the default), or off")
+    parser.add_argument("--first-precinct", action="append", default=[], metavar="PRECINCT",
+                        help="send this precinct's recipients before everyone else (repeatable)")
+    parser.add_argument("--metrics-port", type=int, help="serve Prometheus metrics on this port while sending")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="messenger_cli", description="Create and send campaigns without the UI")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    parser_create = commands.add_parser("create", help="create a campaign from a voter CSV")
+    parser_create.add_argument("name")
+    parser_create.add_argument("csv")
+    message = parser_create.add_mutually_exclusive_group(required=True)
+    message.add_argument("--message")
+    message.add_argument("--message-file")
+    parser_create.add_argument("--base-url", required=True)
+    parser_create.add_argument("--image")
+    parser_create.add_argument("--include-contacted", action="store_true",
+                               help="keep voters another campaign has already texted")
+    parser_create.set_defaults(func=create)
+
+    parser_send = commands.add_parser("send", help="send every unsent message and wait for delivery")
+    _add_send_options(parser_send)
+    parser_send.set_defaults(func=send)
+
+    parser_retry = commands.add_parser("retry-failed", help="re-send the messages that failed")
+    _add_send_options(parser_retry)
+    parser_retry.set_defaults(func=retry_failed)
+
+    parser_status = commands.add_parser("status", help="show campaign counters")
+    parser_status.add_argument("name", nargs="?")
+    parser_status.set_defaults(func=status)
+
+    parser_export = commands.add_parser("export", help="write recipients and results as CSV (or .parquet)")
+    parser_export.add_argument("name")
+    parser_export.add_argument("-o", "--output", default='-')
+    parser_export.set_defaults(func=export)
+
+    args = parser.parse_args(argv)
+    if args.command in ("send", "retry-failed") and args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    if args.command in ("send", "retry-failed") and args.rate <= 0:
+        parser.error("--rate must be more than 0")
+    if getattr(args, 'metrics_port', None):
+        metrics.start_server(args.metrics_port)
+    try:
+        return args.func(args) or 0
+    except (ingest.IngestError, campaign_store.CampaignExistsError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        print("Stopped; run the same command again to resume", file=sys.stderr)
+        return 130
+
+
+if __name__ == "__main__":
+    sys.exit(main())
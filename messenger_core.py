@@ -0,0 +1,141 @@
+import time
+import uuid
+from datetime import datetime
+
+import campaign_store
+import capability
+import delivery
+import image_store
+import ingest
+import metrics
+import phones
+import scheduler
+import send_queue
+import suppression
+import templating
+import transport
+
+# Shared by the Streamlit UI (messenger6.py) and the CLI (messenger_cli.py);
+# nothing here may import streamlit
+EXPORT_PAGE_SIZE = 10_000
+ACTIVE_QUEUE_STATUSES = ('queued', 'sending', 'verifying')
+
+
+def create_tracking_link(base_url, recipient_id):
+    tracking_id = str(uuid.uuid4())
+    tracking_url = templating.tracking_link(base_url, tracking_id, recipient_id)
+    return tracking_url, tracking_id
+
+
+def test_sms(phone, name, message):
+    with metrics.timed("test_sms"):
+        return transport.get_transport().send_sms(phone, name, message)
+
+
+def send_imessage(phone, name, message, tracking_link, image_path=None):
+    # Numbers known to be SMS-only skip the iMessage attempt and delivery wait
+    handle = phones.to_e164(phone)
+    sms_only = handle is not None and capability.service_for(handle) == capability.SMS_ONLY
+    with metrics.timed("send_imessage"):
+        result = transport.get_transport().send_imessage(phone, name, message, tracking_link, image_path, sms_only)
+    if handle is not None and not sms_only:
+        capability.observe(handle, result[0])
+    return result
+
+
+def start_sending(rate_per_minute, quiet_hours=scheduler.QUIET_HOURS):
+    messenger = transport.get_transport()
+    delivery.start_verifier(messenger)
+    send_queue.start_worker(messenger, rate_per_minute, quiet_hours=quiet_hours)
+
+
+def save_campaign_data(campaign_name, results, tracking_info, message_text, image_hash, base_url):
+    campaign_data = {
+        'name': campaign_name,
+        'date': datetime.now().isoformat(),
+        'results': results,
+        'tracking_info': tracking_info,
+        'message_text': message_text,
+        'image_hash': image_hash,
+        'base_url': base_url
+    }
+    with metrics.timed("save_campaign_data"):
+        campaign_store.save_campaign(campaign_data)
+
+
+def load_campaigns():
+    return campaign_store.load_campaigns()
+
+
+def delete_campaign(campaign_name):
+    campaign_store.delete_campaign(campaign_name)
+
+
+def create_campaign(campaign_name, df, message_text, base_url, image_data=None):
+    # df as read_voter_csv returns it, already screened
+    image_hash = image_store.store_image(image_data) if image_data else None
+    save_campaign_data(campaign_name, ingest.build_results(df), {}, message_text, image_hash, base_url)
+
+
+def create_campaign_from_csv(campaign_name, fileobj, message_text, base_url, image_data=None,
+                             skip_contacted=True, progress=None):
+    # Returns (recipients kept, {reason: rows dropped}); raises ingest.IngestError,
+    # or campaign_store.CampaignExistsError before reading the file
+    if campaign_store.campaign_version(campaign_name) is not None:
+        raise campaign_store.CampaignExistsError(f"A campaign named '{campaign_name}' already exists.")
+    df = ingest.read_voter_csv(fileobj, progress=progress)
+    df, dropped = suppression.screen(df, skip_contacted)
+    if df.empty:
+        raise ingest.IngestError("No recipients are left to text after removing invalid, duplicate "
+                                 "and opted-out phones.")
+    create_campaign(campaign_name, df, message_text, base_url, image_data)
+    return len(df), dropped
+
+
+def failed_indices(campaign_name):
+    return campaign_store.recipient_indices(campaign_name, {"Status": ["Failed"]})
+
+
+def run_campaign(campaign_name, rate_per_minute, concurrency=1, indices=None, progress=None, poll_interval=1.0,
+                 quiet_hours=scheduler.QUIET_HOURS, priority=scheduler.PRIORITY_NORMAL, precinct_priorities=None):
+    # Blocking send for scripts: queues the unsent recipients (or `indices`,
+    # at `priority`), runs `concurrency` workers that share rate_per_minute
+    # between them plus the delivery verifier, and returns once nothing is
+    # left in flight, which includes waiting out quiet hours.
+    # progress(queue counts by status) is called every poll_interval.
+    if indices is None:
+        send_queue.enqueue_unsent(campaign_name, precinct_priorities=precinct_priorities)
+    else:
+        send_queue.enqueue(campaign_name, indices, priority=priority, precinct_priorities=precinct_priorities)
+    messenger = transport.get_transport()
+    send_queue.recover_interrupted()
+    workers = [send_queue.SendWorker(messenger, rate_per_minute, recover=False, quiet_hours=quiet_hours)
+               for _ in range(concurrency)]
+    verifier = delivery.DeliveryVerifier(messenger)
+    threads = workers + [verifier]
+    for thread in threads:
+        thread.start()
+    try:
+        while True:
+            counts = send_queue.progress(campaign_name)
+            if progress:
+                progress(counts)
+            if not any(counts.get(status) for status in ACTIVE_QUEUE_STATUSES):
+                return counts
+            time.sleep(poll_interval)
+    finally:
+        for thread in threads:
+            thread.stop()
+        for thread in threads:
+            thread.join()
+
+
+def export_campaign(campaign_name, fileobj):
+    # Every recipient with status, clicks and reply, written a page at a time
+    offset = 0
+    while True:
+        page, total = campaign_store.query_recipients(campaign_name, limit=EXPORT_PAGE_SIZE, offset=offset)
+        page.to_csv(fileobj, index=False, header=offset == 0)
+        offset += len(page)
+        if offset >= total or page.empty:
+            return offset
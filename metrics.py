@@ -0,0 +1,171 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# In-process timings and counters for the send pipeline, served as
+# Prometheus text on http://127.0.0.1:8767/metrics and shown in the UI.
+# Every stage shares one set of latency buckets, in seconds.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+DEFAULT_PORT = int(os.environ.get('MESSENGER_METRICS_PORT', 8767))
+
+_lock = threading.Lock()
+# stage -> [count per bucket (last is +Inf), total seconds, observations]
+_stages = {}
+# outcome -> messages
+_outcomes = {}
+# name -> (help text, function returning {label value: number})
+_gauges = {}
+
+_server_lock = threading.Lock()
+_server = None
+
+
+def observe(stage, seconds):
+    with _lock:
+        histogram = _stages.get(stage)
+        if histogram is None:
+            histogram = _stages[stage] = [[0] * (len(BUCKETS) + 1), 0.0, 0]
+        buckets = histogram[0]
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                buckets[i] += 1
+                break
+        else:
+            buckets[-1] += 1
+        histogram[1] += seconds
+        histogram[2] += 1
+
+
+@contextmanager
+def timed(stage):
+    # Failed stages are timed too; a timeout is often the slow part
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+
+def count(outcome, n=1):
+    with _lock:
+        _outcomes[outcome] = _outcomes.get(outcome, 0) + n
+
+
+def register_gauge(name, help_text, function):
+    # function is called on every scrape, e.g. to count the send queue
+    _gauges[name] = (help_text, function)
+
+
+def reset():
+    with _lock:
+        _stages.clear()
+        _outcomes.clear()
+
+
+def _quantile(buckets, observations, q):
+    # Upper bound of the bucket holding the q-th observation
+    seen = 0
+    for bound, n in zip(BUCKETS + (float('inf'),), buckets):
+        seen += n
+        if seen >= q * observations:
+            return bound
+    return float('inf')
+
+
+def snapshot():
+    # Per-stage summary and outcome counts for the UI panel
+    with _lock:
+        stages = {stage: (list(buckets), total, observations)
+                  for stage, (buckets, total, observations) in _stages.items()}
+        outcomes = dict(_outcomes)
+    rows = [{
+        "Stage": stage,
+        "Count": observations,
+        "Mean (s)": round(total / observations, 3),
+        "p50 ≤ (s)": _quantile(buckets, observations, 0.5),
+        "p95 ≤ (s)": _quantile(buckets, observations, 0.95),
+        "Total (s)": round(total, 1),
+    } for stage, (buckets, total, observations) in sorted(stages.items())]
+    return rows, outcomes
+
+
+def gauge_values():
+    values = {}
+    for name, (_, function) in _gauges.items():
+        try:
+            values[name] = function()
+        except Exception as e:
+            print(f"Metric {name} failed: {e}")
+    return values
+
+
+def render():
+    # Prometheus text exposition format
+    with _lock:
+        stages = {stage: (list(buckets), total, observations)
+                  for stage, (buckets, total, observations) in _stages.items()}
+        outcomes = dict(_outcomes)
+    lines = ["# HELP messenger_stage_seconds Time spent in each stage of sending, syncing and saving",
+             "# TYPE messenger_stage_seconds histogram"]
+    for stage, (buckets, total, observations) in sorted(stages.items()):
+        cumulative = 0
+        for bound, n in zip(BUCKETS, buckets):
+            cumulative += n
+            lines.append(f'messenger_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+        lines.append(f'messenger_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {observations}')
+        lines.append(f'messenger_stage_seconds_sum{{stage="{stage}"}} {total}')
+        lines.append(f'messenger_stage_seconds_count{{stage="{stage}"}} {observations}')
+    lines += ["# HELP messenger_messages_total Messages by final outcome",
+              "# TYPE messenger_messages_total counter"]
+    for outcome, n in sorted(outcomes.items()):
+        lines.append(f'messenger_messages_total{{outcome="{outcome}"}} {n}')
+    for name, values in gauge_values().items():
+        lines += [f"# HELP {name} {_gauges[name][0]}", f"# TYPE {name} gauge"]
+        for label, value in sorted(values.items()):
+            lines.append(f'{name}{{status="{label}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0].rstrip('/') in ('', '/metrics'):
+            body, status = render().encode(), 200
+        else:
+            body, status = b"Not found", 404
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+def start_server(port=DEFAULT_PORT, host='127.0.0.1'):
+    # Idempotent; None when the port is taken, e.g. by another process of the app
+    global _server
+    with _server_lock:
+        if _server is None:
+            try:
+                _server = MetricsServer((host, port), MetricsHandler)
+            except OSError as e:
+                print(f"Metrics server not started on port {port}: {e}")
+                return None
+            threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+        return _server
+
+
+def stop_server():
+    global _server
+    with _server_lock:
+        if _server is not None:
+            _server.shutdown()
+            _server.server_close()
+            _server = None
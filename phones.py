@@ -0,0 +1,44 @@
+import re
+
+import pandas as pd
+
+NON_DIGITS = re.compile(r"\D")
+
+
+def to_e164(value, default_country_code="1"):
+    # "+15551234567" for anything that reads as a phone number: strings with
+    # punctuation, or ints/floats pandas parsed the column as. Email handles
+    # (iMessage accounts) are lowercased; anything else is None.
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    text = str(value).strip()
+    if "@" in text:
+        return text.lower()
+    digits = NON_DIGITS.sub("", text)
+    if text.startswith("+") and 8 <= len(digits) <= 15:
+        return f"+{digits}"
+    if len(digits) == 10:
+        return f"+{default_country_code}{digits}"
+    if len(digits) == 11 and digits.startswith(default_country_code):
+        return f"+{digits}"
+    return None
+
+
+def normalize_series(series, default_country_code="1"):
+    # Vectorized to_e164 for a whole column; missing where a value is not a
+    # phone number. Emails are left to to_e164 since CSV phones never are.
+    if pd.api.types.is_float_dtype(series):
+        series = series.astype('Int64')
+    text = series.astype(object).where(series.notna(), "").astype(str).str.strip()
+    digits = text.str.replace(NON_DIGITS, "", regex=True)
+    length = digits.str.len()
+    international = text.str.startswith("+") & length.between(8, 15)
+    national = length == 10
+    with_country = (length == 11) & digits.str.startswith(default_country_code)
+    normalized = pd.Series(None, index=series.index, dtype=object)
+    normalized[with_country] = "+" + digits[with_country]
+    normalized[national] = f"+{default_country_code}" + digits[national]
+    normalized[international] = "+" + digits[international]
+    return normalized
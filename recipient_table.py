@@ -0,0 +1,114 @@
+from collections.abc import Mapping
+
+import pandas as pd
+
+# A campaign's recipients column by column instead of one dict per row.
+# Values that repeat across a campaign (sex, party, precinct, zip) are
+# categoricals, ages are nullable ints and text is one str per cell, so a
+# 1M-row campaign takes a fraction of the memory of the dicts. result and
+# tracking_id stay object columns; status changes are made in the campaign
+# store, not here.
+CATEGORICAL_COLUMNS = ["Sex", "Party Last Primary", "Precinct Name", "Zip Code"]
+RESULT_COLUMNS = ["result", "tracking_id"]
+
+
+def _py(value):
+    # Plain Python values for templates, SQLite and JSON
+    if value is None or value is pd.NA:
+        return None
+    if isinstance(value, float) and value != value:
+        return None
+    if hasattr(value, 'item'):
+        return value.item()
+    return value
+
+
+def _text(series):
+    # str for every value, None for empty cells, so a column has one type
+    values = series.astype(object)
+    present = values.notna()
+    if pd.api.types.infer_dtype(values, skipna=True) not in ('string', 'empty'):
+        values[present] = values[present].astype(str)
+    return values.where(present, None)
+
+
+def compact(frame):
+    frame = frame.copy()
+    if "result" not in frame:
+        frame["result"] = "Not Sent"
+    if "tracking_id" not in frame:
+        frame["tracking_id"] = None
+    for column in frame.columns:
+        if column in RESULT_COLUMNS:
+            frame[column] = frame[column].astype(object)
+        elif column == "Age":
+            frame[column] = pd.to_numeric(frame[column], errors='coerce').round().astype('Int64')
+        elif column in CATEGORICAL_COLUMNS:
+            frame[column] = _text(frame[column]).astype('category')
+        elif not (pd.api.types.is_numeric_dtype(frame[column]) or
+                  isinstance(frame[column].dtype, pd.CategoricalDtype)):
+            frame[column] = _text(frame[column])
+    return frame
+
+
+class RecipientRow(Mapping):
+    # Read-only view of one recipient; every read goes to the table's columns
+
+    __slots__ = ("_table", "_position")
+
+    def __init__(self, table, position):
+        self._table = table
+        self._position = position
+
+    def __getitem__(self, key):
+        if key not in self._table.frame.columns:
+            raise KeyError(key)
+        return _py(self._table.frame[key].iat[self._position])
+
+    def __iter__(self):
+        return iter(self._table.frame.columns)
+
+    def __len__(self):
+        return len(self._table.frame.columns)
+
+    def __repr__(self):
+        return f"RecipientRow({dict(self)!r})"
+
+
+class RecipientTable:
+    def __init__(self, frame):
+        self.frame = compact(frame)
+
+    @classmethod
+    def from_records(cls, records):
+        return cls(pd.DataFrame.from_records(list(records)))
+
+    @classmethod
+    def load(cls, path):
+        return cls(pd.read_parquet(path))
+
+    def save(self, path):
+        # Parquet keeps the categoricals, so the file is about as small as the table
+        self.frame.to_parquet(path, index=False)
+
+    def __len__(self):
+        return len(self.frame)
+
+    def __getitem__(self, position):
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError(position)
+        return RecipientRow(self, position)
+
+    def __iter__(self):
+        return (RecipientRow(self, position) for position in range(len(self)))
+
+    @property
+    def columns(self):
+        return list(self.frame.columns)
+
+    def column(self, key):
+        # One column as a list of plain Python values
+        return [_py(value) for value in self.frame[key].tolist()]
+
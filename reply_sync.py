@@ -0,0 +1,59 @@
+import os
+import sqlite3
+from datetime import datetime
+
+import campaign_store
+import metrics
+import phones
+import suppression
+
+CHAT_DB_PATH = os.environ.get('MESSENGER_CHAT_DB', os.path.expanduser('~/Library/Messages/chat.db'))
+# chat.db dates count from 2001-01-01, in nanoseconds on current macOS and
+# in seconds on older versions
+APPLE_EPOCH = 978307200
+BATCH_SIZE = 5000
+
+
+def unix_time(date):
+    return APPLE_EPOCH + (date / 1e9 if date > 1e11 else date)
+
+
+def _received_at(date):
+    if date is None:
+        return None
+    return datetime.fromtimestamp(unix_time(date)).isoformat()
+
+
+def read_messages(since_rowid, limit=BATCH_SIZE, chat_db_path=None):
+    # Incoming messages after the watermark, oldest first, read-only so
+    # Messages can keep writing while we read
+    chat_db_path = chat_db_path or CHAT_DB_PATH
+    conn = sqlite3.connect(f"file:{chat_db_path}?mode=ro", uri=True)
+    try:
+        rows = conn.execute(
+            "SELECT m.ROWID, h.id, COALESCE(m.text, ''), m.date FROM message m "
+            "JOIN handle h ON h.ROWID = m.handle_id "
+            "WHERE m.ROWID > ? AND m.is_from_me = 0 ORDER BY m.ROWID LIMIT ?",
+            (since_rowid, limit)
+        ).fetchall()
+    finally:
+        conn.close()
+    return [(rowid, phones.to_e164(handle), text, _received_at(date)) for rowid, handle, text, date in rows]
+
+
+def sync_replies(chat_db_path=None, db_path=None):
+    # Reads everything new since the last sync in batches of BATCH_SIZE;
+    # senders who replied STOP are added to the suppression list.
+    # Returns (messages read, replies matched to recipients).
+    read = matched = 0
+    with metrics.timed("reply_sync"):
+        while True:
+            watermark = campaign_store.reply_watermark(db_path)
+            with metrics.timed("chat_db_read"):
+                messages = read_messages(watermark, BATCH_SIZE, chat_db_path)
+            if not messages:
+                return read, matched
+            suppression.suppress([handle for _, handle, text, _ in messages if suppression.is_stop_reply(text)],
+                                 "Replied STOP", db_path)
+            matched += campaign_store.record_replies(messages, messages[-1][0], db_path)
+            read += len(messages)
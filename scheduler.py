@@ -0,0 +1,268 @@
+import bisect
+import heapq
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from functools import lru_cache
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+import campaign_store
+
+# Decides which queued message goes out next and when. Queued items wait in
+# one heap per recipient time zone, ordered by priority tier and then queue
+# order, so picking the next one is a pop from the heap of an open zone
+# (O(log n)) however many are pending. A zone is closed during quiet hours
+# in its local time. Sends are paced by a token bucket per sender account.
+QUIET_HOURS = (21, 9)  # no texts from 9pm until 9am, recipient's local time
+DEFAULT_TIMEZONE = os.environ.get('MESSENGER_TIMEZONE')  # for unknown zips; None is this Mac's zone
+REFILL_SECONDS = 1.0
+
+# Priority tiers: lower goes first
+PRIORITY_FIRST = 0
+PRIORITY_NORMAL = 10
+PRIORITY_RETRY = 20
+
+LOCAL_ACCOUNT = 'local'
+
+# Heap entries are plain ints, priority in the high bits, then queued_seq,
+# then item id in the low ones, so a million pending sends take tens of MB
+# rather than hundreds and pop in queue order within a priority tier
+_ID_BITS = 40
+_ID_MASK = (1 << _ID_BITS) - 1
+_SEQ_BITS = 40
+_SEQ_MASK = (1 << _SEQ_BITS) - 1
+
+# First three digits of a US zip -> time zone, as (first prefix, zone) runs.
+# Prefixes that straddle a zone line go to the zone most of them are in.
+ZIP_PREFIX_ZONES = [
+    (5, "America/New_York"),
+    (6, "America/Puerto_Rico"),
+    (10, "America/New_York"),
+    (324, "America/Chicago"),  # Florida panhandle
+    (326, "America/New_York"),
+    (350, "America/Chicago"),  # Alabama, middle Tennessee
+    (373, "America/New_York"),  # Chattanooga
+    (375, "America/Chicago"),
+    (376, "America/New_York"),  # east Tennessee
+    (380, "America/Chicago"),  # west Tennessee, Mississippi
+    (398, "America/New_York"),  # Georgia, Kentucky, Ohio, Indiana
+    (420, "America/Chicago"),  # western Kentucky
+    (425, "America/New_York"),
+    (463, "America/Chicago"),  # Gary
+    (465, "America/New_York"),
+    (476, "America/Chicago"),  # Evansville
+    (478, "America/New_York"),  # Indiana, Michigan
+    (500, "America/Chicago"),  # Iowa to South Dakota
+    (577, "America/Denver"),  # Rapid City
+    (580, "America/Chicago"),  # North Dakota
+    (590, "America/Denver"),  # Montana
+    (600, "America/Chicago"),  # Illinois to Nebraska
+    (690, "America/Denver"),  # western Nebraska
+    (700, "America/Chicago"),  # Louisiana to Texas
+    (798, "America/Denver"),  # El Paso, Colorado, Wyoming, southern Idaho
+    (838, "America/Los_Angeles"),  # northern Idaho
+    (840, "America/Denver"),  # Utah
+    (850, "America/Phoenix"),
+    (870, "America/Denver"),  # New Mexico
+    (889, "America/Los_Angeles"),  # Nevada, California
+    (967, "Pacific/Honolulu"),
+    (969, "Pacific/Guam"),
+    (970, "America/Los_Angeles"),  # Oregon, Washington
+    (995, "America/Anchorage"),
+]
+_ZIP_PREFIXES = [prefix for prefix, _ in ZIP_PREFIX_ZONES]
+
+_buckets_lock = threading.Lock()
+_buckets = {}
+_schedulers_lock = threading.Lock()
+_schedulers = {}
+
+
+def zip_timezone(zip_code):
+    # Time zone name for a US zip, or None when it isn't one
+    digits = ''.join(c for c in str(zip_code or '') if c.isdigit())[:5]
+    if len(digits) != 5:
+        return None
+    position = bisect.bisect_right(_ZIP_PREFIXES, int(digits[:3])) - 1
+    return ZIP_PREFIX_ZONES[position][1] if position >= 0 else None
+
+
+@lru_cache(maxsize=None)
+def _zone(name):
+    # None is the local zone, which naive datetimes are already in
+    if name is None:
+        return None
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        print(f"Unknown time zone {name}; using local time")
+        return None
+
+
+def quiet_until(now, zone_name, quiet_hours=QUIET_HOURS):
+    # When the quiet hours `now` falls in end, or None outside them
+    if not quiet_hours or quiet_hours[0] == quiet_hours[1]:
+        return None
+    start, end = quiet_hours
+    local = datetime.fromtimestamp(now, _zone(zone_name))
+    hour = local.hour + local.minute / 60
+    if not (start <= hour < end if start < end else hour >= start or hour < end):
+        return None
+    resume = local.replace(hour=end, minute=0, second=0, microsecond=0)
+    if resume <= local:
+        resume += timedelta(days=1)
+    return resume.timestamp()
+
+
+class TokenBucket:
+    # rate_per_minute tokens a minute, saving up at most `burst` while idle.
+    # The count may go negative; that debt is waited out before the next send.
+    def __init__(self, rate_per_minute, burst=1):
+        self.rate_per_minute = rate_per_minute
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate_per_minute / 60)
+        self._updated = now
+
+    def reserve(self):
+        # Takes a token and returns how long to wait before using it, so
+        # workers sharing the bucket space their sends out between them
+        with self._lock:
+            self._refill()
+            self._tokens -= 1
+            return max(0.0, -self._tokens * 60 / self.rate_per_minute)
+
+    def refund(self):
+        # A reserved token that went unused, e.g. with nothing to send
+        with self._lock:
+            self._tokens += 1
+
+    def available(self):
+        with self._lock:
+            self._refill()
+            return max(0, int(self._tokens))
+
+    def take(self, n=1):
+        with self._lock:
+            self._refill()
+            self._tokens -= n
+
+
+def bucket(account, rate_per_minute, burst=1):
+    # One bucket per sender account, shared by every worker sending from it
+    with _buckets_lock:
+        existing = _buckets.get(account)
+        if existing is None:
+            existing = _buckets[account] = TokenBucket(rate_per_minute, burst)
+        else:
+            existing.rate_per_minute = rate_per_minute
+            existing.burst = burst
+        return existing
+
+
+class Scheduler:
+    def __init__(self, db_path=None, recipient_time=True):
+        # recipient_time=False applies quiet hours in DEFAULT_TIMEZONE for everyone.
+        # Quiet hours are passed on each call: workers sharing the scheduler
+        # may use different ones, and reading it must not change theirs.
+        self.db_path = db_path
+        self.recipient_time = recipient_time
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        # Forget every heap; the next pop reads all queued items again
+        with self._lock:
+            self._zones = {}  # zone name -> heap of entries
+            self._seen_seq = 0
+            self._refilled_at = None
+
+    def _refill(self):
+        # Items queued since the last refill. Entries for items that were since
+        # claimed, cancelled or deleted stay in the heaps and fail their claim.
+        with campaign_store.connect(self.db_path) as conn:
+            latest = conn.execute("SELECT MAX(queued_seq) FROM send_queue").fetchone()[0] or 0
+            if latest < self._seen_seq:
+                # A different or recreated database at the same path
+                self._zones, self._seen_seq = {}, 0
+            cursor = conn.cursor()
+            cursor.row_factory = None
+            cursor.execute(
+                "SELECT q.id, q.priority, q.queued_seq, r.zip FROM send_queue q INDEXED BY send_queue_queued_seq "
+                "JOIN campaigns c ON c.name = q.campaign_name "
+                "JOIN recipients r ON r.campaign_id = c.id AND r.idx = q.idx "
+                "WHERE q.queued_seq > ? AND q.status = 'queued'",
+                (self._seen_seq,)
+            )
+            added = {}
+            for item_id, priority, queued_seq, zip_code in cursor:
+                zone_name = (zip_timezone(zip_code) if self.recipient_time else None) or DEFAULT_TIMEZONE
+                added.setdefault(zone_name, []).append(
+                    (((max(priority, 0) << _SEQ_BITS) | queued_seq) << _ID_BITS) | item_id)
+                self._seen_seq = max(self._seen_seq, queued_seq)
+        for zone_name, entries in added.items():
+            heap = self._zones.setdefault(zone_name, [])
+            if len(entries) > len(heap):
+                # Bulk loads, e.g. the first refill, heapify in linear time
+                heap.extend(entries)
+                heapq.heapify(heap)
+            else:
+                for entry in entries:
+                    heapq.heappush(heap, entry)
+        self._refilled_at = time.monotonic()
+
+    def _maybe_refill(self):
+        if self._refilled_at is None or time.monotonic() - self._refilled_at >= REFILL_SECONDS:
+            self._refill()
+
+    def pop(self, now=None, quiet_hours=QUIET_HOURS):
+        # (id, queued_seq) of the next item to send, or None when nothing is eligible
+        items = self.pop_many(1, now, quiet_hours)
+        return items[0] if items else None
+
+    def pop_many(self, limit, now=None, quiet_hours=QUIET_HOURS):
+        now = time.time() if now is None else now
+        with self._lock:
+            self._maybe_refill()
+            open_zones = [heap for zone_name, heap in self._zones.items()
+                          if heap and quiet_until(now, zone_name, quiet_hours) is None]
+            items = []
+            while len(items) < limit:
+                heap = min((heap for heap in open_zones if heap), key=lambda heap: heap[0], default=None)
+                if heap is None:
+                    break
+                entry = heapq.heappop(heap)
+                items.append((entry & _ID_MASK, (entry >> _ID_BITS) & _SEQ_MASK))
+            return items
+
+    def held(self, now=None, quiet_hours=QUIET_HOURS):
+        # (items waiting out quiet hours, when the first of them may go) for status lines
+        now = time.time() if now is None else now
+        with self._lock:
+            self._maybe_refill()
+            held, resumes_at = 0, None
+            for zone_name, heap in self._zones.items():
+                until = quiet_until(now, zone_name, quiet_hours) if heap else None
+                if until is not None:
+                    held += len(heap)
+                    resumes_at = until if resumes_at is None else min(resumes_at, until)
+            return held, resumes_at
+
+
+def get_scheduler(db_path=None, recipient_time=True):
+    # One scheduler per database, shared by the workers sending from it
+    db_path = db_path or campaign_store.DB_PATH
+    with _schedulers_lock:
+        existing = _schedulers.get(db_path)
+        if existing is None:
+            existing = _schedulers[db_path] = Scheduler(db_path, recipient_time)
+        elif existing.recipient_time != recipient_time:
+            existing.recipient_time = recipient_time
+            existing.reset()
+        return existing
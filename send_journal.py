@@ -0,0 +1,44 @@
+import time
+
+import campaign_store
+
+# Write-ahead record of every dispatch. An intent row is committed before a
+# message is handed to the transport and its outcome after, under a key that
+# names the campaign, recipient, attempt and service. A key can only be
+# dispatched once, and after a crash the journal tells an interrupted send
+# (may or may not have gone out) from one that never started.
+
+
+def idempotency_key(campaign_name, idx, attempt, service):
+    return f"{campaign_name}/{idx}/{attempt}/{service}"
+
+
+def _record_intent(conn, key, campaign_name, idx, attempt, service):
+    cursor = conn.execute(
+        "INSERT OR IGNORE INTO send_journal (idempotency_key, campaign_name, idx, attempt, service, intent_at) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        (key, campaign_name, idx, attempt, service, time.time())
+    )
+    return cursor.rowcount == 1
+
+
+def record_intent(key, campaign_name, idx, attempt, service, db_path=None):
+    # False when the key was already dispatched, i.e. sending it again
+    # would be a duplicate. Returns once the intent is committed.
+    return campaign_store.write(_record_intent, key, campaign_name, idx, attempt, service, db_path=db_path)
+
+
+def set_outcome(conn, key, result, error):
+    # Inside a campaign_store.write, alongside the result it produced
+    conn.execute("UPDATE send_journal SET outcome_at = ?, result = ?, error = ? WHERE idempotency_key = ?",
+                 (time.time(), result, error, key))
+
+
+def record_outcome(key, result, error, db_path=None):
+    campaign_store.write(set_outcome, key, result, error, db_path=db_path)
+
+
+def entry(key, db_path=None):
+    with campaign_store.connect(db_path) as conn:
+        row = conn.execute("SELECT * FROM send_journal WHERE idempotency_key = ?", (key,)).fetchone()
+        return dict(row) if row else None
@@ -0,0 +1,372 @@
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import campaign_store
+import capability
+import click_tracker
+import delivery
+import metrics
+import phones
+import scheduler
+import send_journal
+import suppression
+import templating
+
+DEFAULT_RATE_PER_MINUTE = 20
+IDLE_POLL_SECONDS = 1.0
+
+_worker_lock = threading.Lock()
+_worker = None
+
+
+def _insert_items(conn, rows):
+    # New items take the next queued_seqs off the store's counter; re-queued
+    # ones get theirs from the send_queue_requeue_counter trigger
+    seq = conn.execute("SELECT value FROM store_meta WHERE key = 'queue_seq'").fetchone()[0]
+    conn.execute("UPDATE store_meta SET value = ? WHERE key = 'queue_seq'", (seq + len(rows),))
+    cursor = conn.executemany(
+        "INSERT INTO send_queue (campaign_name, idx, status, enqueued_at, updated_at, payload, tracking_id, "
+        "service, priority, queued_seq) VALUES (?, ?, 'queued', ?, ?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT (campaign_name, idx) DO UPDATE SET status = 'queued', service = excluded.service, "
+        "attempt = send_queue.attempt + 1, lease_owner = NULL, lease_expires = NULL, "
+        "payload = excluded.payload, tracking_id = excluded.tracking_id, updated_at = excluded.updated_at, "
+        "priority = excluded.priority "
+        "WHERE send_queue.status NOT IN ('queued', 'sending', 'verifying')",
+        (row + (seq + n,) for n, row in enumerate(rows, 1))
+    )
+    return cursor.rowcount
+
+
+def enqueue(campaign_name, indices, db_path=None, priority=scheduler.PRIORITY_NORMAL, precinct_priorities=None):
+    # precinct_priorities ({precinct name: tier}) overrides `priority` for
+    # those precincts' recipients; lower tiers are sent first
+    campaign_data = campaign_store.load_campaign(campaign_name, with_results=False, db_path=db_path)
+    if campaign_data is None:
+        return 0
+    # Only the recipients being queued are read, straight into columns
+    recipients = campaign_store.load_recipients(campaign_name, indices, db_path).frame
+    indices = list(recipients.index)
+    if not indices:
+        return 0
+
+    # Numbers that opted out since the campaign was created are skipped, not sent
+    handles = phones.normalize_series(recipients['Phone'])
+    opted_out = handles.isin(suppression.suppressed(db_path))
+    if opted_out.any():
+        campaign_store.update_recipient_results(
+            [(campaign_name, idx, "Skipped") for idx in recipients.index[opted_out]], db_path=db_path)
+        recipients, handles = recipients[~opted_out], handles[~opted_out]
+        indices = list(recipients.index)
+        if not indices:
+            return 0
+
+    # Known SMS-only numbers are queued straight for SMS
+    capability.probe(handles.dropna(), db_path=db_path)
+    known = capability.known(db_path)
+    services = [capability.SMS_ONLY if known.get(handle) == capability.SMS_ONLY else None for handle in handles]
+
+    # Render every payload up front so the worker only hands text to the transport
+    tracking_ids = [str(uuid.uuid4()) for _ in indices]
+    links = templating.tracking_links(click_tracker.link_base(campaign_data['base_url']), tracking_ids,
+                                      recipients['Phone'])
+    payloads = templating.MessageTemplate(campaign_data['message_text']).render_many(recipients, links)
+    priorities = [priority] * len(indices)
+    if precinct_priorities and 'Precinct Name' in recipients:
+        priorities = [precinct_priorities.get(precinct, priority) for precinct in recipients['Precinct Name']]
+
+    now = datetime.now().isoformat()
+    return campaign_store.write(_insert_items, [
+        (campaign_name, idx, now, now, payload, tracking_id, service, item_priority)
+        for idx, payload, tracking_id, service, item_priority
+        in zip(indices, payloads, tracking_ids, services, priorities)
+    ], db_path=db_path)
+
+
+def enqueue_unsent(campaign_name, db_path=None, precinct_priorities=None):
+    with campaign_store.connect(db_path) as conn:
+        indices = [row['idx'] for row in conn.execute(
+            "SELECT idx FROM recipients r WHERE result = 'Not Sent' "
+            "AND campaign_id = (SELECT id FROM campaigns WHERE name = ?) "
+            # Already queued or in flight, e.g. when resuming after a restart
+            "AND NOT EXISTS (SELECT 1 FROM send_queue q WHERE q.campaign_name = ? AND q.idx = r.idx "
+            "AND q.status IN ('queued', 'sending', 'verifying')) ORDER BY idx",
+            (campaign_name, campaign_name)
+        )]
+    return enqueue(campaign_name, indices, db_path, precinct_priorities=precinct_priorities)
+
+
+def _cancel(conn, campaign_name):
+    cursor = conn.execute(
+        "UPDATE send_queue SET status = 'cancelled', updated_at = ? WHERE campaign_name = ? AND status = 'queued'",
+        (datetime.now().isoformat(), campaign_name)
+    )
+    return cursor.rowcount
+
+
+def cancel(campaign_name, db_path=None):
+    return campaign_store.write(_cancel, campaign_name, db_path=db_path)
+
+
+def _skip(conn, campaign_name, indices):
+    # Queued sends for these recipients are cancelled along with marking them
+    # skipped, so the worker doesn't send them anyway
+    cancelled = 0
+    now = datetime.now().isoformat()
+    for start in range(0, len(indices), 500):
+        chunk = indices[start:start + 500]
+        cancelled += conn.execute(
+            "UPDATE send_queue SET status = 'cancelled', updated_at = ? "
+            f"WHERE status = 'queued' AND campaign_name = ? AND idx IN ({', '.join('?' for _ in chunk)})",
+            (now, campaign_name, *chunk)
+        ).rowcount
+    for idx in indices:
+        campaign_store.set_recipient_result(conn, campaign_name, idx, "Skipped")
+    return cancelled
+
+
+def skip(campaign_name, indices, db_path=None):
+    return campaign_store.write(_skip, campaign_name, [int(idx) for idx in indices], db_path=db_path)
+
+
+def progress(campaign_name, db_path=None):
+    with campaign_store.connect(db_path) as conn:
+        rows = conn.execute(
+            "SELECT status, COUNT(*) AS n FROM send_queue WHERE campaign_name = ? GROUP BY status",
+            (campaign_name,)
+        )
+        return {row['status']: row['n'] for row in rows}
+
+
+def queue_depth(db_path=None):
+    # Items per status across every campaign
+    with campaign_store.connect(db_path) as conn:
+        rows = conn.execute("SELECT status, COUNT(*) AS n FROM send_queue GROUP BY status")
+        return {row['status']: row['n'] for row in rows}
+
+
+metrics.register_gauge("messenger_queue_depth", "Send queue items by status", queue_depth)
+
+
+def _set_status(conn, item_id, status):
+    conn.execute("UPDATE send_queue SET status = ?, updated_at = ? WHERE id = ?",
+                 (status, datetime.now().isoformat(), item_id))
+
+
+def _fallback_to_sms(conn, item_id):
+    conn.execute("UPDATE send_queue SET status = 'queued', service = 'SMS', updated_at = ? WHERE id = ?",
+                 (datetime.now().isoformat(), item_id))
+
+
+def _claim(conn, item_id, queued_seq):
+    # The queued_seq check turns away a scheduler entry for an item that was
+    # deleted along with its campaign and whose id went to a new one
+    return conn.execute(
+        "UPDATE send_queue SET status = 'sending', lease_owner = NULL, lease_expires = NULL, updated_at = ? "
+        "WHERE id = ? AND queued_seq = ? AND status = 'queued'",
+        (datetime.now().isoformat(), item_id, queued_seq)
+    ).rowcount == 1
+
+
+def _claim_next(send_scheduler, db_path=None, quiet_hours=scheduler.QUIET_HOURS):
+    # The scheduler's next eligible item; ones it still holds but that were
+    # claimed or cancelled since it read them are skipped
+    while True:
+        candidate = send_scheduler.pop(quiet_hours=quiet_hours)
+        if candidate is None:
+            return None
+        item_id, queued_seq = candidate
+        try:
+            claimed = campaign_store.write(_claim, item_id, queued_seq, db_path=db_path)
+        except Exception:
+            # The item is still queued but no longer in the heaps; re-read them
+            send_scheduler.reset()
+            raise
+        if not claimed:
+            continue
+        with campaign_store.connect(db_path) as conn:
+            return dict(conn.execute(
+                "SELECT q.id, q.campaign_name, q.idx, q.service, q.attempt, q.payload, q.tracking_id, r.phone, r.name "
+                "FROM send_queue q "
+                "JOIN campaigns c ON c.name = q.campaign_name "
+                "JOIN recipients r ON r.campaign_id = c.id AND r.idx = q.idx "
+                "WHERE q.id = ?",
+                (item_id,)
+            ).fetchone())
+
+
+def _commit_outcome(conn, item, service, result_message, error_message, key):
+    # First attempts go out as iMessage without waiting on delivery; the
+    # delivery verifier re-queues unconfirmed ones with service 'SMS'
+    if key is not None:
+        send_journal.set_outcome(conn, key, result_message, error_message)
+    campaign_store.set_recipient_result(conn, item['campaign_name'], item['idx'], result_message,
+                                        item['tracking_id'])
+    if service == 'iMessage' and not error_message:
+        delivery.mark_verifying(conn, item['id'])
+    elif service == 'iMessage':
+        _fallback_to_sms(conn, item['id'])
+    else:
+        _set_status(conn, item['id'], 'failed' if error_message else 'sent')
+
+
+def _apply_outcome(item, service, result_message, error_message, db_path=None, key=None):
+    # The journal outcome (under `key`, unless already recorded), recipient
+    # result and queue status of one send, committed together
+    campaign_store.write(_commit_outcome, item, service, result_message, error_message, key, db_path=db_path)
+
+
+def _commit_awaiting(conn, item):
+    campaign_store.set_recipient_result(conn, item['campaign_name'], item['idx'],
+                                        f"Awaiting iMessage delivery to {item['name']} at {item['phone']}",
+                                        item['tracking_id'])
+    delivery.mark_verifying(conn, item['id'])
+
+
+def _commit_interrupted(conn, item, service, key):
+    result = (f"Failed to confirm {service} to {item['name']} ({item['phone']}): the send was "
+              "interrupted. Check Messages before retrying.")
+    send_journal.set_outcome(conn, key, result, "interrupted")
+    campaign_store.set_recipient_result(conn, item['campaign_name'], item['idx'], result)
+    _set_status(conn, item['id'], 'failed')
+
+
+def _requeue(conn, item_ids):
+    conn.executemany(
+        "UPDATE send_queue SET status = 'queued', lease_owner = NULL, lease_expires = NULL, updated_at = ? "
+        "WHERE id = ? AND status = 'sending'",
+        ((datetime.now().isoformat(), item_id) for item_id in item_ids)
+    )
+
+
+def _journal_key(item, service):
+    return send_journal.idempotency_key(item['campaign_name'], item['idx'], item['attempt'], service)
+
+
+def _settle(item, service, journal_entry, db_path=None, expired_leases=False):
+    # An item the journal shows was already dispatched
+    if journal_entry['outcome_at'] is not None:
+        _apply_outcome(item, service, journal_entry['result'], journal_entry['error'], db_path)
+    elif service == 'iMessage' and not expired_leases:
+        campaign_store.write(_commit_awaiting, item, db_path=db_path)
+    else:
+        campaign_store.write(_commit_interrupted, item, service, _journal_key(item, service), db_path=db_path)
+
+
+def recover_interrupted(db_path=None, expired_leases=False):
+    # Settles items a dead worker left 'sending' from the send journal, so
+    # nothing is sent twice: outcomes it recorded are applied, dispatches cut
+    # off mid-send are confirmed through delivery checks (iMessage) or marked
+    # failed for a deliberate retry (SMS), and the rest go back on the queue.
+    # Local workers hold no lease; expired_leases=True instead settles items
+    # whose remote sender (see coordinator.py) stopped renewing its lease.
+    # Their delivery can't be checked from here, so any cut-off send fails.
+    if expired_leases:
+        where, params = "q.lease_owner IS NOT NULL AND q.lease_expires < ?", (time.time(),)
+    else:
+        where, params = "q.lease_owner IS NULL", ()
+    with campaign_store.connect(db_path) as conn:
+        items = [dict(row) for row in conn.execute(
+            "SELECT q.id, q.campaign_name, q.idx, q.service, q.attempt, q.tracking_id, r.phone, r.name "
+            "FROM send_queue q "
+            "JOIN campaigns c ON c.name = q.campaign_name "
+            "JOIN recipients r ON r.campaign_id = c.id AND r.idx = q.idx "
+            f"WHERE q.status = 'sending' AND {where}",
+            params
+        )]
+    requeue = []
+    for item in items:
+        service = item['service'] or 'iMessage'
+        journal_entry = send_journal.entry(_journal_key(item, service), db_path)
+        if journal_entry is None:
+            requeue.append(item['id'])
+        else:
+            _settle(item, service, journal_entry, db_path, expired_leases)
+    if requeue:
+        campaign_store.write(_requeue, requeue, db_path=db_path)
+    if items:
+        print(f"Recovered {len(items)} interrupted sends ({len(requeue)} re-queued)")
+
+
+class SendWorker(threading.Thread):
+    def __init__(self, messenger, rate_per_minute=DEFAULT_RATE_PER_MINUTE, db_path=None, recover=True,
+                 quiet_hours=scheduler.QUIET_HOURS, account=scheduler.LOCAL_ACCOUNT):
+        # recover=False for all but one of several workers sharing the queue,
+        # which must not recover each other's in-flight sends. Workers on the
+        # same account share its rate_per_minute.
+        super().__init__(name="send-queue-worker", daemon=True)
+        self.messenger = messenger
+        self.rate_per_minute = rate_per_minute
+        self.db_path = db_path
+        self.recover = recover
+        self.quiet_hours = quiet_hours
+        self.account = account
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def active(self):
+        return self.is_alive() and not self._stop_event.is_set()
+
+    def run(self):
+        if self.recover:
+            recover_interrupted(self.db_path)
+        while not self._stop_event.is_set():
+            # Read every round, so start_worker can change them on a running worker
+            pacing = scheduler.bucket(self.account, self.rate_per_minute)
+            send_scheduler = scheduler.get_scheduler(self.db_path)
+            delay = pacing.reserve()
+            if delay > 0 and self._stop_event.wait(delay):
+                break
+            item = _claim_next(send_scheduler, self.db_path, self.quiet_hours)
+            if item is None:
+                # Nothing queued, or all of it waiting out quiet hours
+                pacing.refund()
+                self._stop_event.wait(IDLE_POLL_SECONDS)
+                continue
+            self._send(item)
+
+    def _send(self, item):
+        service = item['service'] or 'iMessage'
+        key = _journal_key(item, service)
+        if not send_journal.record_intent(key, item['campaign_name'], item['idx'], item['attempt'], service,
+                                          self.db_path):
+            # Already dispatched under this key; settled from the journal, not sent again
+            print(f"Skipping duplicate send {key}")
+            _settle(item, service, send_journal.entry(key, self.db_path), self.db_path)
+            return
+        with metrics.timed("queue_send"):
+            result_message, error_message = self.messenger.send_via(
+                service, str(item['phone']), str(item['name']), item['payload'])
+        print(f"Queue send to {item['phone']}: {result_message}")
+        _apply_outcome(item, service, result_message, error_message, self.db_path, key)
+
+
+def start_worker(messenger, rate_per_minute=DEFAULT_RATE_PER_MINUTE, db_path=None,
+                 quiet_hours=scheduler.QUIET_HOURS):
+    global _worker
+    with _worker_lock:
+        if _worker is not None and _worker.active():
+            _worker.messenger = messenger
+            _worker.rate_per_minute = rate_per_minute
+            _worker.quiet_hours = quiet_hours
+            return _worker
+        if _worker is not None:
+            # Let a paused worker finish its in-flight send before a new one
+            # re-queues whatever was left 'sending'
+            _worker.join()
+        _worker = SendWorker(messenger, rate_per_minute, db_path, quiet_hours=quiet_hours)
+        _worker.start()
+        return _worker
+
+
+def stop_worker():
+    with _worker_lock:
+        if _worker is not None:
+            _worker.stop()
+
+
+def worker_running():
+    return _worker is not None and _worker.active()
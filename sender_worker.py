@@ -0,0 +1,160 @@
+import argparse
+import json
+import os
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import image_store
+import metrics
+import transport
+
+# Runs on each sending Mac: claims batches from coordinator.py, sends them
+# through the local Messages transport and reports every outcome back. It
+# needs no copy of the campaign store.
+DEFAULT_RATE_PER_MINUTE = 20
+IDLE_POLL_SECONDS = 2.0
+REQUEST_TIMEOUT = 30
+FINISH_RETRY_MAX_SECONDS = 60
+TOKEN = os.environ.get('MESSENGER_COORDINATOR_TOKEN')
+
+
+class SenderWorker:
+    def __init__(self, coordinator_url, sender_id, rate_per_minute=DEFAULT_RATE_PER_MINUTE, claim_size=10,
+                 messenger=None, token=TOKEN):
+        self.coordinator_url = coordinator_url.rstrip('/')
+        self.token = token
+        self.sender_id = sender_id
+        self.rate_per_minute = rate_per_minute
+        self.claim_size = claim_size
+        self.messenger = messenger or transport.get_transport()
+        self.lease_seconds = None
+        self._held = set()
+        self._held_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._done_event = threading.Event()
+
+    def _headers(self):
+        return {'Authorization': f"Bearer {self.token}"} if self.token else {}
+
+    def _post(self, path, **payload):
+        request = urllib.request.Request(
+            self.coordinator_url + path,
+            data=json.dumps({'sender_id': self.sender_id, **payload}).encode(),
+            headers={'Content-Type': 'application/json', **self._headers()}
+        )
+        with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT) as response:
+            return json.loads(response.read())
+
+    def _image_path(self, image_hash):
+        # Images are content-addressed, so a local copy under the same hash is the same image
+        path = image_store.image_path(image_hash)
+        if not os.path.exists(path):
+            request = urllib.request.Request(f"{self.coordinator_url}/image/{image_hash}", headers=self._headers())
+            with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT) as response:
+                image_store.store_image(response.read())
+        return path
+
+    def _renew_leases(self):
+        # Runs until run() returns, not just until stop(), so leases held
+        # while an outcome is still being reported stay renewed
+        while not self._done_event.wait(self.lease_seconds / 3):
+            with self._held_lock:
+                held = list(self._held)
+            if held:
+                try:
+                    self._post('/renew', ids=held)
+                except (OSError, urllib.error.URLError) as e:
+                    print(f"Lease renewal failed: {e}")
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        self.lease_seconds = self._post('/register', host=socket.gethostname(),
+                                        rate=self.rate_per_minute)['lease_seconds']
+        threading.Thread(target=self._renew_leases, name="lease-renewer", daemon=True).start()
+        try:
+            self._send_claimed()
+        finally:
+            self._done_event.set()
+
+    def _send_claimed(self):
+        next_send = time.monotonic()
+        while not self._stop_event.is_set():
+            try:
+                items = self._post('/claim', limit=self.claim_size)['items']
+            except (OSError, urllib.error.URLError) as e:
+                print(f"Claim failed: {e}")
+                items = []
+            if not items:
+                self._stop_event.wait(IDLE_POLL_SECONDS)
+                continue
+            with self._held_lock:
+                self._held.update(item['id'] for item in items)
+            for item in items:
+                delay = next_send - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                next_send = time.monotonic() + 60.0 / self.rate_per_minute
+                self._send(item)
+                with self._held_lock:
+                    self._held.discard(item['id'])
+
+    def _send(self, item):
+        # Nothing is journaled until /begin, so an item skipped before then
+        # just goes back on the queue when its lease lapses
+        image_path = None
+        try:
+            if item['service'] != 'SMS' and item['image_hash']:
+                image_path = self._image_path(item['image_hash'])
+            began = self._post('/begin', id=item['id'])['ok']
+        except (OSError, urllib.error.URLError) as e:
+            print(f"Skipping {item['campaign_name']}/{item['idx']}: {e}")
+            return
+        if not began:
+            print(f"Lease on {item['campaign_name']}/{item['idx']} lost; not sending")
+            return
+        phone, name = str(item['phone']), str(item['name'])
+        if item['service'] == 'SMS':
+            result, error = self.messenger.send_via('SMS', phone, name, item['payload'])
+        else:
+            result, error = self.messenger.send_with_fallback(phone, name, item['payload'], image_path)
+        print(f"[{self.sender_id}] {result}", flush=True)
+        self._finish(item, result, error)
+
+    def _finish(self, item, result, error):
+        # The message went out, so its outcome is reported however long the
+        # coordinator is unreachable; the item's lease is renewed meanwhile
+        delay = 1
+        while True:
+            try:
+                self._post('/finish', id=item['id'], result=result, error=error)
+                return
+            except (OSError, urllib.error.URLError) as e:
+                print(f"Reporting {item['campaign_name']}/{item['idx']} failed: {e}; retrying in {delay}s")
+                time.sleep(delay)
+                delay = min(delay * 2, FINISH_RETRY_MAX_SECONDS)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Send queued campaign messages claimed from a coordinator")
+    parser.add_argument("--coordinator", default="http://127.0.0.1:8766")
+    parser.add_argument("--id", default=socket.gethostname(), help="unique name for this sender")
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE_PER_MINUTE, help="messages per minute")
+    parser.add_argument("--claim-size", type=int, default=10)
+    parser.add_argument("--metrics-port", type=int, help="serve Prometheus metrics on this port")
+    parser.add_argument("--token", default=TOKEN,
+                        help="the coordinator's shared secret (default: $MESSENGER_COORDINATOR_TOKEN)")
+    args = parser.parse_args()
+    if args.rate <= 0:
+        parser.error("--rate must be more than 0")
+    if args.metrics_port:
+        metrics.start_server(args.metrics_port)
+    worker = SenderWorker(args.coordinator, args.id, args.rate, args.claim_size, token=args.token)
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        worker.stop()
@@ -0,0 +1,90 @@
+import threading
+from datetime import datetime
+
+import campaign_store
+
+# Replies that opt a number out of every future campaign
+STOP_WORDS = {"stop", "stopall", "stop all", "unsubscribe", "cancel", "end", "quit", "optout", "opt out"}
+
+_lock = threading.Lock()
+_suppressed = {}
+_contacted = {}
+
+
+def is_stop_reply(text):
+    return (text or "").strip().strip(".!").lower() in STOP_WORDS
+
+
+def _suppress(conn, handles, reason):
+    now = datetime.now().isoformat()
+    cursor = conn.executemany("INSERT OR IGNORE INTO suppressed (handle, reason, added_at) VALUES (?, ?, ?)",
+                              ((handle, reason, now) for handle in handles if handle))
+    return cursor.rowcount
+
+
+def suppress(handles, reason, db_path=None):
+    return campaign_store.write(_suppress, list(handles), reason, db_path=db_path)
+
+
+def _unsuppress(conn, handle):
+    return conn.execute("DELETE FROM suppressed WHERE handle = ?", (handle,)).rowcount == 1
+
+
+def unsuppress(handle, db_path=None):
+    return campaign_store.write(_unsuppress, handle, db_path=db_path)
+
+
+def suppressed(db_path=None):
+    # Every opted-out handle as a set, for O(1) checks; reloaded only when
+    # the suppression list has changed since the last call
+    db_path = db_path or campaign_store.DB_PATH
+    with campaign_store.connect(db_path) as conn:
+        version = conn.execute("SELECT value FROM store_meta WHERE key = 'suppression_version'").fetchone()['value']
+        with _lock:
+            cached = _suppressed.get(db_path)
+            if cached and cached[0] == version:
+                return cached[1]
+        handles = frozenset(row['handle'] for row in conn.execute("SELECT handle FROM suppressed"))
+    with _lock:
+        _suppressed[db_path] = (version, handles)
+    return handles
+
+
+def contacted(db_path=None):
+    # Handles any campaign has already messaged, reloaded when the store version moves
+    db_path = db_path or campaign_store.DB_PATH
+    version = campaign_store.store_version(db_path)
+    with _lock:
+        cached = _contacted.get(db_path)
+        if cached and cached[0] == version:
+            return cached[1]
+    with campaign_store.connect(db_path) as conn:
+        handles = frozenset(row['handle'] for row in conn.execute(
+            "SELECT DISTINCT handle FROM recipients WHERE handle IS NOT NULL "
+            "AND result IS NOT 'Not Sent' AND result IS NOT 'Skipped'"
+        ))
+    with _lock:
+        _contacted[db_path] = (version, handles)
+    return handles
+
+
+def screen(df, skip_contacted=True, db_path=None):
+    # Drops rows without a valid phone, repeats of a phone earlier in the
+    # file, opted-out phones and (optionally) phones another campaign has
+    # already texted. Expects Phone normalized to E.164, as read_voter_csv
+    # leaves it. Returns the kept rows and how many went for each reason.
+    phone = df['Phone']
+    invalid = phone.isna()
+    duplicate = ~invalid & phone.duplicated()
+    opted_out = ~invalid & ~duplicate & phone.isin(suppressed(db_path))
+    already_contacted = ~invalid & ~duplicate & ~opted_out & phone.isin(contacted(db_path))
+    dropped = invalid | duplicate | opted_out
+    if skip_contacted:
+        dropped |= already_contacted
+    counts = {
+        "Invalid phone": int(invalid.sum()),
+        "Duplicate": int(duplicate.sum()),
+        "Opted out": int(opted_out.sum()),
+        "Already contacted": int(already_contacted.sum()),
+    }
+    return df[~dropped].reset_index(drop=True), counts
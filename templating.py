@@ -0,0 +1,88 @@
+import re
+from urllib.parse import quote
+
+import pandas as pd
+
+GREETING = "Hello [Name],\n\n"
+TRACKING_LINK = "Tracking Link"
+PLACEHOLDER = re.compile(r"\[([^\[\]]+)\]")
+
+
+def tracking_link(base_url, tracking_id, recipient_id):
+    # The recipient is usually a phone: encoded, its "+" isn't read back as a space
+    return f"{base_url}?id={tracking_id}&recipient={quote(_value_text(recipient_id), safe='')}"
+
+
+def tracking_links(base_url, tracking_ids, recipient_ids):
+    recipients = _as_text(pd.Series(list(recipient_ids))).map(lambda value: quote(value, safe=''))
+    return base_url + "?id=" + pd.Series(list(tracking_ids), dtype=object) + "&recipient=" + recipients
+
+
+def _as_text(series):
+    # Whole-number floats (zips/phones pandas read as floats) print without ".0"
+    if pd.api.types.is_float_dtype(series) and (series.dropna() % 1 == 0).all():
+        series = series.astype('Int64')
+    return series.astype(object).where(series.notna(), "").astype(str)
+
+
+def _value_text(value):
+    if value is None or (pd.api.types.is_scalar(value) and pd.isna(value)):
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class MessageTemplate:
+    # A campaign message compiled once into literal and placeholder segments.
+    # "[Column Name]" is filled from the recipient's CSV column and
+    # "[Tracking Link]" from their link (appended if the message has none).
+    # Placeholders that match no column are left as written.
+
+    def __init__(self, message_text):
+        text = GREETING + message_text
+        if f"[{TRACKING_LINK}]" not in message_text:
+            text += f"[{TRACKING_LINK}]"
+        self.segments = []
+        position = 0
+        for match in PLACEHOLDER.finditer(text):
+            if match.start() > position:
+                self.segments.append((False, text[position:match.start()]))
+            self.segments.append((True, match.group(1)))
+            position = match.end()
+        if position < len(text):
+            self.segments.append((False, text[position:]))
+
+    @property
+    def fields(self):
+        return [value for is_field, value in self.segments if is_field and value != TRACKING_LINK]
+
+    def unknown_fields(self, columns):
+        return [field for field in self.fields if field not in columns]
+
+    def render(self, recipient, tracking_link=""):
+        parts = []
+        for is_field, value in self.segments:
+            if not is_field:
+                parts.append(value)
+            elif value == TRACKING_LINK:
+                parts.append(tracking_link)
+            elif value in recipient:
+                parts.append(_value_text(recipient[value]))
+            else:
+                parts.append(f"[{value}]")
+        return "".join(parts)
+
+    def render_many(self, df, links):
+        # One pass per segment over whole columns instead of one render per row
+        rendered = pd.Series("", index=df.index, dtype=object)
+        for is_field, value in self.segments:
+            if not is_field:
+                rendered = rendered + value
+            elif value == TRACKING_LINK:
+                rendered = rendered + pd.Series(list(links), index=df.index, dtype=object)
+            elif value in df.columns:
+                rendered = rendered + _as_text(df[value])
+            else:
+                rendered = rendered + f"[{value}]"
+        return rendered
@@ -0,0 +1,34 @@
+import os
+import sys
+from datetime import datetime
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import campaign_store  # noqa: E402
+import scheduler  # noqa: E402
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    # A scratch store, with the fake osascript from fakebin/ first on PATH.
+    # The scheduler re-reads the queue on every pop, so re-queued items show up at once.
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(scheduler, 'REFILL_SECONDS', 0)
+    monkeypatch.setenv('PATH', os.path.join(REPO_DIR, 'fakebin') + os.pathsep + os.environ.get('PATH', ''))
+    return str(tmp_path / "campaigns.db")
+
+
+@pytest.fixture
+def make_campaign(db_path):
+    def make(name="test", rows=3, **columns):
+        recipients = [{"Phone": f"+1555{i:07d}", "Name": f"Voter {i}", "result": "Not Sent",
+                       **{key: values[i] for key, values in columns.items()}} for i in range(rows)]
+        campaign_store.save_campaign({
+            'name': name, 'date': datetime.now().isoformat(), 'message_text': "Hi [Name]",
+            'base_url': "https://example.org", 'image_hash': None, 'results': recipients,
+        }, db_path=db_path)
+        return name
+    return make
@@ -0,0 +1,79 @@
+import io
+import json
+import os
+import sqlite3
+import threading
+
+import pytest
+
+import campaign_store
+import messenger_core
+import send_queue
+
+
+def _within(seconds, function, *args):
+    # Runs function in a thread so a hang fails the test instead of the suite
+    outcome = {}
+
+    def run():
+        try:
+            outcome['value'] = function(*args)
+        except Exception as e:
+            outcome['error'] = e
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(seconds)
+    assert not thread.is_alive(), f"{function.__name__} hung"
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome.get('value')
+
+
+def test_writer_open_failure_fails_writes_and_recovers(tmp_path):
+    db_path = str(tmp_path / "missing" / "campaigns.db")
+    with pytest.raises(sqlite3.OperationalError):
+        _within(10, campaign_store.delete_campaign, "anything", db_path)
+    os.mkdir(tmp_path / "missing")
+    _within(10, campaign_store.delete_campaign, "anything", db_path)
+    assert campaign_store.campaign_index(db_path) == []
+
+
+def test_concurrent_result_updates_keep_counters(db_path, make_campaign):
+    name = make_campaign(rows=50)
+    threads = [threading.Thread(target=campaign_store.update_recipient_result,
+                                args=(name, idx, f"Text message sent to Voter {idx} via iMessage"),
+                                kwargs={'db_path': db_path}) for idx in range(50)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    [entry] = campaign_store.campaign_index(db_path)
+    assert entry['sent_count'] == 50
+
+
+def test_creating_a_duplicate_name_keeps_the_existing_campaign(db_path, make_campaign):
+    name = make_campaign(rows=2)
+    send_queue.enqueue(name, [0, 1], db_path)
+    campaign_store.update_recipient_result(name, 0, "Text message sent via SMS", db_path=db_path)
+    with pytest.raises(campaign_store.CampaignExistsError):
+        make_campaign(rows=1)
+    assert len(campaign_store.load_recipients(name, [0, 1], db_path)) == 2
+    assert campaign_store.load_recipient(name, 0, db_path)['result'] == "Text message sent via SMS"
+    assert send_queue.progress(name, db_path) == {'queued': 2}
+
+
+def test_create_from_csv_refuses_an_existing_name(db_path, make_campaign, monkeypatch):
+    monkeypatch.setattr(campaign_store, 'DB_PATH', db_path)
+    name = make_campaign(rows=1)
+    with pytest.raises(campaign_store.CampaignExistsError):
+        messenger_core.create_campaign_from_csv(name, io.BytesIO(b""), "Hi", "https://example.org")
+
+
+def test_json_migration_keeps_the_last_copy_of_each_name(db_path):
+    copies = [{'name': "old", 'date': "2024-01-01T00:00:00", 'message_text': "Hi", 'base_url': "https://e.org",
+               'results': [{"Phone": "+15550000000", "Name": "Ann", "result": result}]}
+              for result in ("Not Sent", "Text message sent via SMS")]
+    with open(campaign_store.LEGACY_JSON_PATH, 'w') as f:
+        json.dump(copies, f)
+    assert campaign_store.load_recipient("old", 0, db_path)['result'] == "Text message sent via SMS"
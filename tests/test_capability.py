@@ -0,0 +1,20 @@
+import capability
+
+HANDLE = "+15550000001"
+
+
+def test_failed_send_does_not_overwrite_sms_only(db_path):
+    capability.observe(HANDLE, "Text message sent to Ann at 5550000001 via SMS", db_path)
+    assert capability.service_for(HANDLE, db_path) == capability.SMS_ONLY
+    capability.observe(HANDLE, "Failed to send to Ann (5550000001) via iMessage and SMS: timed out", db_path)
+    assert capability.service_for(HANDLE, db_path) == capability.SMS_ONLY
+
+
+def test_failed_send_records_nothing(db_path):
+    capability.observe(HANDLE, "Failed to send to Ann (5550000001) via iMessage: timed out", db_path)
+    assert capability.service_for(HANDLE, db_path) is None
+
+
+def test_imessage_send_is_recorded(db_path):
+    capability.observe(HANDLE, "Text message sent to Ann at 5550000001 via iMessage", db_path)
+    assert capability.service_for(HANDLE, db_path) == capability.IMESSAGE
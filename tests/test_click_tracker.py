@@ -0,0 +1,46 @@
+import http.client
+import json
+import threading
+from urllib.parse import quote
+
+import campaign_store
+import click_tracker
+
+
+def _get(server, path):
+    conn = http.client.HTTPConnection("127.0.0.1", server.server_address[1], timeout=5)
+    try:
+        conn.request("GET", path)
+        response = conn.getresponse()
+        return response.status, response.getheader('Location'), response.read()
+    finally:
+        conn.close()
+
+
+def test_clicks_redirect_log_and_count_on_localhost(db_path, make_campaign, tmp_path):
+    name = make_campaign(rows=2, tracking_id=["t0", "t1"])
+    log_path = str(tmp_path / "clicks.log")
+    tracker = click_tracker.ClickTracker(db_path, log_path)
+    server = click_tracker.ClickServer(("127.0.0.1", 0), tracker)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        status, location, _ = _get(server, f"/c?id=t0&recipient={quote('+15550000000', safe='')}")
+        assert status == 302
+        assert location == "https://example.org?id=t0&recipient=%2B15550000000"
+        assert _get(server, "/c?id=t0&recipient=x")[0] == 302
+        assert _get(server, "/c?id=t1")[0] == 302
+        assert _get(server, "/c?id=never-issued")[0] == 404
+        assert _get(server, "/c")[0] == 404
+        status, _, body = _get(server, "/stats")
+        assert status == 200 and json.loads(body) == {name: 3}
+    finally:
+        server.shutdown()
+        server.server_close()
+        tracker.close()  # flushes whatever is pending
+
+    with open(log_path, encoding='utf-8') as f:
+        clicks = [json.loads(line) for line in f]
+    assert [(click['id'], click['campaign']) for click in clicks] == [("t0", name), ("t0", name), ("t1", name)]
+    assert clicks[0]['recipient'] == "+15550000000"
+    counters = campaign_store.campaign_counters(name, db_path)
+    assert (counters['click_count'], counters['clicked_count']) == (3, 2)
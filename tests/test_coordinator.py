@@ -0,0 +1,73 @@
+import sqlite3
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+import campaign_store
+import coordinator
+import sender_worker
+import send_queue
+
+
+def _result(name, idx, db_path):
+    return campaign_store.load_recipients(name, [idx], db_path)[0]['result']
+
+
+def test_finish_after_lease_loss_writes_nothing(db_path, make_campaign):
+    name = make_campaign(rows=1)
+    send_queue.enqueue(name, [0], db_path)
+    coordinator.register("w1", "host-1", db_path)
+    coordinator.register("w2", "host-2", db_path)
+    [item] = coordinator.claim("w1", 1, lease_seconds=-1, db_path=db_path, quiet_hours=None)
+    # w1's lease lapsed without a journaled send, so the reaper re-queues it for w2
+    send_queue.recover_interrupted(db_path, expired_leases=True)
+    assert [i['id'] for i in coordinator.claim("w2", 1, db_path=db_path, quiet_hours=None)] == [item['id']]
+    assert coordinator.begin_send("w2", item['id'], db_path)
+
+    assert not coordinator.finish_send("w1", item['id'], "Failed to send", "stale", db_path)
+    assert _result(name, 0, db_path) == "Not Sent"
+
+    assert coordinator.finish_send("w2", item['id'], "Text message sent to Voter 0 via iMessage", None, db_path)
+    assert _result(name, 0, db_path) == "Text message sent to Voter 0 via iMessage"
+    assert send_queue.progress(name, db_path) == {'sent': 1}
+
+
+def test_failed_lease_leaves_items_for_the_next_claim(db_path, make_campaign, monkeypatch):
+    name = make_campaign(rows=2)
+    send_queue.enqueue(name, [0, 1], db_path)
+    coordinator.register("w1", "host-1", db_path)
+    write = campaign_store.write
+
+    def locked(function, *args, **kwargs):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(campaign_store, 'write', locked)
+    with pytest.raises(sqlite3.OperationalError):
+        coordinator.claim("w1", 2, db_path=db_path, quiet_hours=None)
+    monkeypatch.setattr(campaign_store, 'write', write)
+    assert [i['idx'] for i in coordinator.claim("w1", 2, db_path=db_path, quiet_hours=None)] == [0, 1]
+
+
+def test_requests_without_the_token_are_refused(db_path, make_campaign):
+    name = make_campaign(rows=1)
+    send_queue.enqueue(name, [0], db_path)
+    server = coordinator.CoordinatorServer(("127.0.0.1", 0), db_path, quiet_hours=None, token="s3cret")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        with pytest.raises(urllib.error.HTTPError) as refused:
+            urllib.request.urlopen(url + "/status", timeout=5)
+        assert refused.value.code == 401
+        intruder = sender_worker.SenderWorker(url, "w0", messenger=object(), token="guess")
+        with pytest.raises(urllib.error.HTTPError) as refused:
+            intruder._post('/claim', limit=1)
+        assert refused.value.code == 401
+
+        worker = sender_worker.SenderWorker(url, "w1", messenger=object(), token="s3cret")
+        assert worker._post('/register', host="host-1", rate=60)['lease_seconds'] == coordinator.LEASE_SECONDS
+        assert [item['idx'] for item in worker._post('/claim', limit=1)['items']] == [0]
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,25 @@
+import sqlite3
+import time
+
+import delivery
+
+
+def test_verifier_survives_store_errors(monkeypatch):
+    calls = []
+
+    def verify_due(messenger, db_path=None):
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            raise sqlite3.OperationalError("database is locked")
+        return 0, 0
+
+    monkeypatch.setattr(delivery, 'verify_due', verify_due)
+    monkeypatch.setattr(delivery, 'POLL_INTERVAL', 0.01)
+    verifier = delivery.DeliveryVerifier(messenger=None)
+    verifier.start()
+    deadline = time.monotonic() + 5
+    while len(calls) < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    verifier.stop()
+    verifier.join()
+    assert len(calls) >= 3
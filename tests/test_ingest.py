@@ -0,0 +1,14 @@
+import io
+
+import ingest
+
+HEADER = "Phone,Name,Age,Sex,Party Last Primary,Precinct Name,Zip Code\n"
+
+
+def test_fractional_age_is_rounded():
+    csv = HEADER + "5551234567,Ann,45.5,F,D,P1,10001\n5551234568,Bob,,M,R,P2,10002\n5551234569,Cy,30,M,R,P2,10002\n"
+    df = ingest.read_voter_csv(io.BytesIO(csv.encode()))
+    assert str(df['Age'].dtype) == 'Int64'
+    assert df['Age'].iloc[0] in (45, 46)
+    assert df['Age'].isna().iloc[1]
+    assert df['Age'].iloc[2] == 30
@@ -0,0 +1,11 @@
+import pytest
+
+import messenger_cli
+
+
+@pytest.mark.parametrize("rate", ["0", "-5"])
+def test_send_rejects_a_rate_that_never_refills(rate, capsys):
+    with pytest.raises(SystemExit) as exit_info:
+        messenger_cli.main(["send", "test", "--rate", rate])
+    assert exit_info.value.code == 2
+    assert "--rate must be more than 0" in capsys.readouterr().err
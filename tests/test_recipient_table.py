@@ -0,0 +1,15 @@
+import pandas as pd
+
+import recipient_table
+
+
+def test_fractional_age_is_rounded():
+    table = recipient_table.RecipientTable(pd.DataFrame({"Name": ["Ann", "Bob"], "Age": ["45.5", "x"]}))
+    ages = table.column("Age")
+    assert ages[0] in (45, 46)
+    assert pd.isna(ages[1])
+
+
+def test_from_records_with_float_age():
+    table = recipient_table.RecipientTable.from_records([{"Name": "Ann", "Age": 61.7}])
+    assert table[0]["Age"] == 62
@@ -0,0 +1,55 @@
+import sqlite3
+import time
+
+import campaign_store
+import reply_sync
+import suppression
+
+
+def _chat_db(path, messages):
+    # The handle and message columns reply_sync reads from Messages' chat.db
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE IF NOT EXISTS handle (ROWID INTEGER PRIMARY KEY, id TEXT)")
+    conn.execute("CREATE TABLE IF NOT EXISTS message (ROWID INTEGER PRIMARY KEY, handle_id INTEGER, text TEXT, "
+                 "date INTEGER, is_from_me INTEGER)")
+    # Nanoseconds since 2001, as current macOS stores them, a minute from now
+    date = int((time.time() + 60 - reply_sync.APPLE_EPOCH) * 1e9)
+    for handle, text, is_from_me in messages:
+        row = conn.execute("SELECT ROWID FROM handle WHERE id = ?", (handle,)).fetchone()
+        handle_id = row[0] if row else conn.execute("INSERT INTO handle (id) VALUES (?)", (handle,)).lastrowid
+        conn.execute("INSERT INTO message (handle_id, text, date, is_from_me) VALUES (?, ?, ?, ?)",
+                     (handle_id, text, date, is_from_me))
+    conn.commit()
+    conn.close()
+
+
+def _replies(name, db_path):
+    page, _ = campaign_store.query_recipients(name, {"Replied": [True]}, db_path=db_path)
+    return dict(zip(page["Row"], page["Reply"]))
+
+
+def test_sync_matches_contacted_recipients_and_suppresses_stop(db_path, make_campaign, tmp_path):
+    name = make_campaign(rows=3)
+    for idx in (0, 1):
+        campaign_store.update_recipient_result(name, idx, "Text message sent via iMessage", db_path=db_path)
+    chat_db = str(tmp_path / "chat.db")
+    _chat_db(chat_db, [
+        ("(555) 000-0000", "Thanks!", 0),  # recipient 0, written the way Messages may store it
+        ("+15550000002", "Who is this?", 0),  # recipient 2 was never texted
+        ("+15550000000", "Our own message", 1),
+        ("5550000001", "STOP", 0),  # recipient 1
+        ("+15559999999", "stop", 0),  # not a recipient, still opted out
+    ])
+
+    assert reply_sync.sync_replies(chat_db, db_path) == (4, 2)
+    assert campaign_store.reply_watermark(db_path) == 5
+    assert _replies(name, db_path) == {0: "Thanks!", 1: "STOP"}
+    assert suppression.suppressed(db_path) == {"+15550000001", "+15559999999"}
+
+    # Nothing new past the watermark
+    assert reply_sync.sync_replies(chat_db, db_path) == (0, 0)
+
+    _chat_db(chat_db, [("+15550000000", "See you there", 0)])
+    assert reply_sync.sync_replies(chat_db, db_path) == (1, 1)
+    assert campaign_store.reply_watermark(db_path) == 6
+    assert _replies(name, db_path) == {0: "See you there", 1: "STOP"}
@@ -0,0 +1,88 @@
+import sqlite3
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import pytest
+
+import campaign_store
+import coordinator
+import scheduler
+import send_queue
+
+
+def _claim(db_path):
+    return send_queue._claim_next(scheduler.get_scheduler(db_path), db_path, quiet_hours=None)
+
+
+def _pop_all(db_path):
+    popped = []
+    while (item := _claim(db_path)) is not None:
+        popped.append(item['idx'])
+    return popped
+
+
+def test_requeued_item_waits_behind_later_ones(db_path, make_campaign):
+    name = make_campaign(rows=3)
+    send_queue.enqueue(name, [0], db_path)
+    first = _claim(db_path)
+    campaign_store.write(send_queue._set_status, first['id'], 'failed', db_path=db_path)
+    send_queue.enqueue(name, [1, 2], db_path)
+    # Item 0 keeps the lowest id but goes back on the queue last
+    send_queue.enqueue(name, [0], db_path)
+    assert _pop_all(db_path) == [1, 2, 0]
+
+
+def test_priority_goes_before_queue_order(db_path, make_campaign):
+    name = make_campaign(rows=3)
+    send_queue.enqueue(name, [0, 1], db_path, priority=scheduler.PRIORITY_RETRY)
+    send_queue.enqueue(name, [2], db_path, priority=scheduler.PRIORITY_FIRST)
+    assert _pop_all(db_path) == [2, 0, 1]
+
+
+def test_failed_claim_leaves_item_for_the_next_pop(db_path, make_campaign, monkeypatch):
+    name = make_campaign(rows=1)
+    send_queue.enqueue(name, [0], db_path)
+    write = campaign_store.write
+
+    def locked(function, *args, **kwargs):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(campaign_store, 'write', locked)
+    with pytest.raises(sqlite3.OperationalError):
+        _claim(db_path)
+    monkeypatch.setattr(campaign_store, 'write', write)
+    assert _pop_all(db_path) == [0]
+
+
+def _at(hour, zone):
+    return datetime(2026, 3, 10, hour, tzinfo=ZoneInfo(zone)).timestamp()
+
+
+def test_reading_held_does_not_change_a_workers_quiet_hours(db_path, make_campaign):
+    name = make_campaign(rows=1, **{"Zip Code": ["10001"]})
+    send_queue.enqueue(name, [0], db_path)
+    night = _at(6, "America/New_York")  # 10:00 UTC, so only the recipient zone holds it
+    send_scheduler = scheduler.get_scheduler(db_path)
+    # The page shows what would be held with quiet hours off...
+    assert scheduler.get_scheduler(db_path).held(night, quiet_hours=None) == (0, None)
+    # ...while the worker still holds New York at 6am
+    assert send_scheduler.pop(night) is None
+    assert send_scheduler.held(night)[0] == 1
+    assert send_scheduler.pop(_at(10, "America/New_York")) is not None
+
+
+def test_entries_for_a_deleted_campaign_do_not_claim_its_replacement(db_path, make_campaign):
+    la = make_campaign("west", rows=3, **{"Zip Code": ["90001"] * 3})
+    send_queue.enqueue(la, [0, 1, 2], db_path)
+    late = _at(23, "America/New_York")  # 20:00 in Los Angeles
+    send_scheduler = scheduler.get_scheduler(db_path)
+    assert send_scheduler.held(late)[0] == 0  # read into the heaps, Los Angeles still open
+    campaign_store.delete_campaign(la, db_path)
+    ny = make_campaign("east", rows=3, **{"Zip Code": ["10001"] * 3})
+    send_queue.enqueue(ny, [0, 1, 2], db_path)
+    # The new items may reuse the old ids, but not the old entries' time zone
+    while (candidate := send_scheduler.pop(late)) is not None:
+        assert not campaign_store.write(send_queue._claim, *candidate, db_path=db_path)
+    assert send_queue.progress(ny, db_path) == {'queued': 3}
+    assert sorted(item['idx'] for item in coordinator.claim(
+        "w1", 3, db_path=db_path, quiet_hours=None)) == [0, 1, 2]
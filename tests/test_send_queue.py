@@ -0,0 +1,67 @@
+import campaign_store
+import scheduler
+import send_journal
+import send_queue
+
+
+class RecordingMessenger:
+    def __init__(self):
+        self.sent = []
+
+    def send_via(self, service, phone, name, message):
+        self.sent.append((service, phone))
+        return f"Text message sent to {name} at {phone} via {service}", None
+
+
+def _claim(db_path):
+    return send_queue._claim_next(scheduler.get_scheduler(db_path), db_path, quiet_hours=None)
+
+
+def _journal(name, result, db_path):
+    key = send_journal.idempotency_key(name, 0, 0, 'iMessage')
+    send_journal.record_intent(key, name, 0, 0, 'iMessage', db_path)
+    if result:
+        send_journal.record_outcome(key, result, None, db_path)
+
+
+def test_duplicate_key_with_outcome_is_settled_not_sent(db_path, make_campaign):
+    name = make_campaign(rows=1)
+    send_queue.enqueue(name, [0], db_path)
+    _journal(name, "Text message sent to Voter 0 at +15550000000 via iMessage", db_path)
+    messenger = RecordingMessenger()
+    send_queue.SendWorker(messenger, db_path=db_path, recover=False)._send(_claim(db_path))
+    assert messenger.sent == []
+    # The recorded iMessage goes on to the delivery check instead of staying 'sending'
+    assert send_queue.progress(name, db_path) == {'verifying': 1}
+
+
+def test_duplicate_key_without_outcome_awaits_delivery(db_path, make_campaign):
+    name = make_campaign(rows=1)
+    send_queue.enqueue(name, [0], db_path)
+    _journal(name, None, db_path)
+    messenger = RecordingMessenger()
+    send_queue.SendWorker(messenger, db_path=db_path, recover=False)._send(_claim(db_path))
+    assert messenger.sent == []
+    assert send_queue.progress(name, db_path) == {'verifying': 1}
+
+
+def test_worker_sends_queued_items(db_path, make_campaign):
+    name = make_campaign(rows=2)
+    send_queue.enqueue(name, [0, 1], db_path)
+    messenger = RecordingMessenger()
+    worker = send_queue.SendWorker(messenger, db_path=db_path, recover=False)
+    while (item := _claim(db_path)) is not None:
+        worker._send(item)
+    assert [phone for _, phone in messenger.sent] == ["+15550000000", "+15550000001"]
+    assert send_queue.progress(name, db_path) == {'verifying': 2}
+
+
+def test_skip_cancels_queued_items(db_path, make_campaign):
+    name = make_campaign(rows=3)
+    send_queue.enqueue(name, [0, 1, 2], db_path)
+    assert send_queue.skip(name, [0, 2], db_path) == 2
+    assert send_queue.progress(name, db_path) == {'cancelled': 2, 'queued': 1}
+    assert _claim(db_path)['idx'] == 1
+    assert _claim(db_path) is None
+    results = campaign_store.load_campaign(name, db_path=db_path)['results']
+    assert [row['result'] for row in results] == ["Skipped", "Not Sent", "Skipped"]
@@ -0,0 +1,46 @@
+import urllib.error
+
+import sender_worker
+
+ITEM = {'id': 1, 'campaign_name': "test", 'idx': 0, 'service': None, 'image_hash': None,
+        'phone': "+15550000000", 'name': "Voter 0", 'payload': "Hi"}
+
+
+class FakeMessenger:
+    def __init__(self):
+        self.sent = []
+
+    def send_with_fallback(self, phone, name, message, image_path=None):
+        self.sent.append(phone)
+        return f"Text message sent to {name} at {phone} via iMessage", None
+
+
+def _worker(monkeypatch, post):
+    worker = sender_worker.SenderWorker("http://coordinator", "w1", messenger=FakeMessenger())
+    monkeypatch.setattr(worker, '_post', post)
+    monkeypatch.setattr(sender_worker.time, 'sleep', lambda seconds: None)
+    return worker
+
+
+def test_finish_is_retried_until_reported(monkeypatch):
+    calls = []
+
+    def post(path, **payload):
+        calls.append(path)
+        if path == '/finish' and calls.count('/finish') < 3:
+            raise urllib.error.URLError("coordinator down")
+        return {'ok': True}
+
+    worker = _worker(monkeypatch, post)
+    worker._send(ITEM)
+    assert calls == ['/begin', '/finish', '/finish', '/finish']
+    assert worker.messenger.sent == ["+15550000000"]
+
+
+def test_unreachable_begin_skips_the_item(monkeypatch):
+    def post(path, **payload):
+        raise urllib.error.URLError("coordinator down")
+
+    worker = _worker(monkeypatch, post)
+    worker._send(ITEM)
+    assert worker.messenger.sent == []
@@ -0,0 +1,21 @@
+from urllib.parse import parse_qs, urlsplit
+
+import templating
+
+
+def _recipient(url):
+    return parse_qs(urlsplit(url).query)['recipient'][0]
+
+
+def test_tracking_link_encodes_recipient():
+    url = templating.tracking_link("https://t.example/c", "abc", "+15551234567")
+    assert _recipient(url) == "+15551234567"
+    assert _recipient(templating.tracking_link("https://t.example/c", "abc", "a&b=c d")) == "a&b=c d"
+
+
+def test_tracking_links_match_tracking_link():
+    for recipients in (["+15551234567", "a&b=c d", None], [5551234567.0, 5551234568.0, None]):
+        links = templating.tracking_links("https://t.example/c", ["1", "2", "3"], recipients)
+        assert list(links) == [templating.tracking_link("https://t.example/c", str(i + 1), recipient)
+                               for i, recipient in enumerate(recipients)]
+    assert _recipient(links[0]) == "5551234567"
@@ -0,0 +1,382 @@
+import json
+import os
+import select
+import subprocess
+import threading
+import time
+
+import metrics
+import phones
+
+DELIVERY_CHECK_DELAY = 2
+COMMAND_TIMEOUT = 30
+
+# Long-lived JXA process: reads one JSON command per line on stdin and writes
+# one JSON reply per line on stdout, so Messages is attached to once and the
+# handlers are compiled once for the life of the session.
+SESSION_SCRIPT = r'''
+ObjC.import('Foundation');
+var Messages = Application('Messages');
+var stdin = $.NSFileHandle.fileHandleWithStandardInput;
+var stdout = $.NSFileHandle.fileHandleWithStandardOutput;
+
+function imessageAccount() {
+    return Messages.accounts.whose({serviceType: 'iMessage'})[0];
+}
+
+function reply(obj) {
+    stdout.writeData($(JSON.stringify(obj) + '\n').dataUsingEncoding($.NSUTF8StringEncoding));
+}
+
+var handlers = {
+    send: function (args) {
+        var target = args.service === 'iMessage'
+            ? imessageAccount().participants[args.phone]
+            : Messages.buddies[args.phone];
+        Messages.send(args.text, {to: target});
+        return true;
+    },
+    send_file: function (args) {
+        Messages.send(Path(args.path), {to: imessageAccount().participants[args.phone]});
+        return true;
+    },
+    check_delivered: function (args) {
+        var messages = Messages.buddies[args.phone].chat().messages();
+        if (messages.length === 0) {
+            return false;
+        }
+        return messages[messages.length - 1].delivered();
+    },
+    check_delivered_many: function (args) {
+        return args.phones.map(function (phone) {
+            try {
+                return handlers.check_delivered({phone: phone});
+            } catch (e) {
+                return false;
+            }
+        });
+    }
+};
+
+var buffer = '';
+while (true) {
+    var data = stdin.availableData;
+    if (data.length === 0) {
+        break;
+    }
+    buffer += $.NSString.alloc.initWithDataEncoding(data, $.NSUTF8StringEncoding).js;
+    var newline;
+    while ((newline = buffer.indexOf('\n')) >= 0) {
+        var request = JSON.parse(buffer.slice(0, newline));
+        buffer = buffer.slice(newline + 1);
+        try {
+            reply({ok: true, value: handlers[request.cmd](request)});
+        } catch (e) {
+            reply({ok: false, error: String(e)});
+        }
+    }
+}
+'''
+
+
+class TransportError(Exception):
+    pass
+
+
+def escape_applescript(text):
+    return str(text).replace("\\", "\\\\").replace('"', '\\"')
+
+
+def normalize_phone(phone):
+    # Anything that isn't a recognizable number is passed through as given
+    return phones.to_e164(phone) or phone
+
+
+class Transport:
+    # Backends implement send_text/send_file/check_delivered; the iMessage
+    # then SMS fallback flow and its result strings live here so every
+    # backend returns exactly what send_imessage/test_sms always have.
+
+    def send_text(self, phone, text, service):
+        raise NotImplementedError
+
+    def send_file(self, phone, path):
+        raise NotImplementedError
+
+    def check_delivered(self, phone):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def _send_text(self, phone, text, service):
+        with metrics.timed(f"{service.lower()}_send"):
+            self.send_text(phone, text, service)
+
+    def _check_delivered(self, phone):
+        with metrics.timed("delivery_check"):
+            return self.check_delivered(phone)
+
+    def send_sms(self, phone, name, message):
+        phone = normalize_phone(phone)
+        try:
+            self._send_text(phone, f"Hello {name},\n\n{message}", "SMS")
+            metrics.count("sms")
+            return f"SMS sent to {name} at {phone}", None
+        except TransportError as e:
+            print(f"Error: {e}")
+            metrics.count("failed")
+            return f"Failed to send SMS to {name} ({phone}): {e}", str(e)
+
+    def check_delivered_many(self, phones):
+        # Backends that can check a batch of chats in one round trip override this
+        delivered = {}
+        for phone in phones:
+            try:
+                delivered[phone] = self._check_delivered(phone)
+            except TransportError as e:
+                print(f"Delivery check failed for {phone}: {e}")
+                delivered[phone] = False
+        return delivered
+
+    def send_imessage(self, phone, name, message, tracking_link, image_path=None, sms_only=False):
+        text = f"Hello {name},\n\n{message}{tracking_link}"
+        if sms_only:
+            return self.send_via("SMS", phone, name, text)
+        return self.send_with_fallback(phone, name, text, image_path)
+
+    def send_with_fallback(self, phone, name, text, image_path=None):
+        # Blocking flow for an already rendered message: iMessage, wait,
+        # check delivery, otherwise fall back to SMS
+        phone = normalize_phone(phone)
+        try:
+            self._send_text(phone, text, "iMessage")
+            with metrics.timed("delivery_wait"):
+                time.sleep(DELIVERY_CHECK_DELAY)
+            delivered = self._check_delivered(phone)
+            print(f"Delivery check: {delivered}")
+
+            if delivered:
+                result = f"Text message sent to {name} at {phone} via iMessage"
+                if image_path:
+                    with metrics.timed("image_send"):
+                        self.send_file(phone, image_path)
+                    result += f" and image sent from {image_path}"
+                metrics.count("imessage")
+                return result, None
+        except TransportError as e:
+            print(f"iMessage failed: {e}")
+
+        with metrics.timed("sms_fallback"):
+            return self.send_via("SMS", phone, name, text)
+
+    def send_via(self, service, phone, name, text):
+        # Single attempt on one service. An iMessage sent this way is only
+        # "awaiting delivery"; delivery.py confirms it or falls back to SMS.
+        phone = normalize_phone(phone)
+        if service == "iMessage":
+            try:
+                self._send_text(phone, text, "iMessage")
+                return f"Awaiting iMessage delivery to {name} at {phone}", None
+            except TransportError as e:
+                print(f"iMessage failed: {e}")
+                return f"Failed to send to {name} ({phone}) via iMessage: {e}", f"iMessage error: {e}"
+        # SMS through here stands in for an iMessage: a fallback, or a number
+        # already known to be SMS-only
+        try:
+            self._send_text(phone, text, "SMS")
+            metrics.count("sms_fallback")
+            return f"Text message sent to {name} at {phone} via SMS", None
+        except TransportError as e:
+            print(f"SMS failed: {e}")
+            metrics.count("failed")
+            return (
+                f"Failed to send to {name} ({phone}) via iMessage and SMS: {e}",
+                f"SMS error: {e}"
+            )
+        except Exception as e:
+            metrics.count("failed")
+            return f"Unexpected error sending to {name}: {str(e)}", str(e)
+
+
+class OsascriptTransport(Transport):
+    # One osascript process per AppleScript, as the app has always done
+
+    def _run(self, applescript):
+        # Spawn and script together: each run starts a new osascript
+        try:
+            with metrics.timed("osascript_run"):
+                result = subprocess.run(
+                    ["osascript", "-e", applescript],
+                    capture_output=True,
+                    text=True,
+                    check=True
+                )
+        except subprocess.CalledProcessError as e:
+            raise TransportError(e.stderr)
+        except FileNotFoundError as e:
+            raise TransportError(str(e))
+        return result.stdout.strip()
+
+    def send_text(self, phone, text, service):
+        phone, text = escape_applescript(phone), escape_applescript(text)
+        if service == "iMessage":
+            self._run(f'''
+            tell application "Messages"
+                set targetBuddy to "{phone}"
+                set targetService to id of 1st service whose service type = iMessage
+                set textMessage to "{text}"
+                set theBuddy to participant targetBuddy of account id targetService
+                send textMessage to theBuddy
+            end tell
+            ''')
+        else:
+            self._run(f'''
+            tell application "Messages"
+                set targetBuddy to "{phone}"
+                set textMessage to "{text}"
+                send textMessage to buddy targetBuddy
+            end tell
+            ''')
+
+    def send_file(self, phone, path):
+        phone, path = escape_applescript(phone), escape_applescript(path)
+        self._run(f'''
+        tell application "Messages"
+            set targetBuddy to "{phone}"
+            set targetService to id of 1st service whose service type = iMessage
+            set theBuddy to participant targetBuddy of account id targetService
+            send POSIX file "{path}" to theBuddy
+        end tell
+        ''')
+
+    def check_delivered(self, phone):
+        phone = escape_applescript(phone)
+        return self._run(f'''
+        tell application "Messages"
+            set targetBuddy to "{phone}"
+            set theBuddy to buddy targetBuddy
+            set theChat to chat of theBuddy
+            set theMessages to messages of theChat
+            if (count of theMessages) > 0 then
+                set latestMessage to item -1 of theMessages
+                return (delivered of latestMessage)
+            else
+                return false
+            end if
+        end tell
+        ''') == "true"
+
+    def check_delivered_many(self, phones):
+        if not phones:
+            return {}
+        buddies = ", ".join(f'"{escape_applescript(phone)}"' for phone in phones)
+        output = self._run(f'''
+        tell application "Messages"
+            set deliveryStates to {{}}
+            repeat with targetBuddy in {{{buddies}}}
+                try
+                    set theMessages to messages of (chat of buddy targetBuddy)
+                    if (count of theMessages) > 0 then
+                        set end of deliveryStates to ((delivered of item -1 of theMessages) as text)
+                    else
+                        set end of deliveryStates to "false"
+                    end if
+                on error
+                    set end of deliveryStates to "false"
+                end try
+            end repeat
+            set AppleScript's text item delimiters to ","
+            return deliveryStates as text
+        end tell
+        ''')
+        return {phone: state.strip() == "true" for phone, state in zip(phones, output.split(","))}
+
+
+class PersistentOsascriptTransport(Transport):
+    # One long-lived osascript (JXA) session that all commands stream through
+
+    def __init__(self, command_timeout=COMMAND_TIMEOUT):
+        self.command_timeout = command_timeout
+        self._lock = threading.Lock()
+        self._process = None
+
+    def _session(self):
+        if self._process is None or self._process.poll() is not None:
+            with metrics.timed("session_spawn"):
+                self._process = subprocess.Popen(
+                    ["osascript", "-l", "JavaScript", "-e", SESSION_SCRIPT],
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.DEVNULL,
+                    text=True,
+                    bufsize=1
+                )
+        return self._process
+
+    def _reset(self):
+        if self._process is not None:
+            self._process.kill()
+            self._process.wait()
+            self._process = None
+
+    def _call(self, cmd, **args):
+        with self._lock:
+            try:
+                process = self._session()
+                process.stdin.write(json.dumps({"cmd": cmd, **args}) + "\n")
+                process.stdin.flush()
+                ready, _, _ = select.select([process.stdout], [], [], self.command_timeout)
+                line = process.stdout.readline() if ready else ""
+                if not line:
+                    raise TransportError("Messages session did not respond")
+                reply = json.loads(line)
+            except (OSError, ValueError, TransportError) as e:
+                self._reset()
+                raise TransportError(f"Messages session failed: {e}")
+        if not reply["ok"]:
+            raise TransportError(reply["error"])
+        return reply["value"]
+
+    def send_text(self, phone, text, service):
+        self._call("send", phone=phone, text=text, service=service)
+
+    def send_file(self, phone, path):
+        self._call("send_file", phone=phone, path=path)
+
+    def check_delivered(self, phone):
+        return self._call("check_delivered", phone=phone) is True
+
+    def check_delivered_many(self, phones):
+        if not phones:
+            return {}
+        states = self._call("check_delivered_many", phones=list(phones))
+        return {phone: state is True for phone, state in zip(phones, states)}
+
+    def close(self):
+        with self._lock:
+            if self._process is not None and self._process.poll() is None:
+                self._process.stdin.close()
+                try:
+                    self._process.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    self._process.kill()
+            self._process = None
+
+
+TRANSPORTS = {
+    "persistent": PersistentOsascriptTransport,
+    "osascript": OsascriptTransport,
+}
+
+_transport_lock = threading.Lock()
+_transport = None
+
+
+def get_transport():
+    # MESSENGER_TRANSPORT=osascript falls back to one process per AppleScript
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            _transport = TRANSPORTS[os.environ.get("MESSENGER_TRANSPORT", "persistent")]()
+        return _transport